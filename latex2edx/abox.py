@@ -288,6 +288,21 @@ class AnswerBox(object):
         self.xmlstr = self.hint_extras + etree.tostring(self.xml).decode()
         self.xmlstr_just_code = etree.tostring(self.xml_just_code).strip().decode()
         
+    def __getstate__(self):
+        '''
+        XML elements are pickled as strings, so that answer boxes can be sent between
+        processes (e.g. when rendering chapters in parallel).
+        '''
+        state = self.__dict__.copy()
+        state['xml'] = etree.tostring(self.xml, with_tail=False)
+        state['xml_just_code'] = self.xml_just_code is not self.xml
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.xml = etree.fromstring(state['xml'])
+        self.xml_just_code = self.xml[0] if state['xml_just_code'] else self.xml
+
     def abox2xml(self, aboxstr):
         if aboxstr.startswith('abox '): aboxstr = aboxstr[5:]
         s = aboxstr
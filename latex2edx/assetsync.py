@@ -0,0 +1,189 @@
+'''
+Syncing of asset files (images, and the like) into the course's static directory.
+
+Images used by the course are copied to static/images when the LaTeX is
+rendered, and images made by tools (e.g. latex2dnd) after they are run.  An
+AssetSync is shared by these, for one build, so that:
+
+  - each destination file is synced at most once per build, however many
+    times the image is used
+  - a destination file with the same content as its source (compared by size,
+    then sha1 hash) is left alone, keeping its timestamp
+  - where the filesystem supports it, the destination is made as a reflink
+    (copy-on-write clone) or hard link of the source, rather than a copy
+  - files are copied without running a shell (so paths may have spaces),
+    and replaced atomically
+
+Destination files are made readable by all (as "chmod og+r" used to do).
+summary() reports the totals, for the build log.
+'''
+
+import glob
+import hashlib
+import os
+import shutil
+
+try:
+    import fcntl
+    FICLONE = 0x40049409		# linux ioctl for making a reflink
+except ImportError:
+    fcntl = None
+
+
+def file_sha1(fn):
+    sha = hashlib.sha1()
+    with open(fn, 'rb') as fp:
+        for data in iter(lambda: fp.read(1 << 20), b''):
+            sha.update(data)
+    return sha.hexdigest()
+
+
+def same_content(src, dst):
+    '''
+    Return True if files src and dst have the same content.
+    '''
+    try:
+        if os.path.samefile(src, dst):
+            return True
+        if os.path.getsize(src) != os.path.getsize(dst):
+            return False
+    except OSError:
+        return False
+    return file_sha1(src) == file_sha1(dst)
+
+
+class AssetSync(object):
+    '''
+    Copies asset files into the static directory, once per build, skipping unchanged files.
+    '''
+
+    def __init__(self, links=True, verbose=False):
+        '''
+        links = if True, then make reflinks or hard links instead of copies, where possible
+        '''
+        self.links = links
+        self.verbose = verbose
+        self.synced = {}		# {destination: source} for files synced in this build
+        self.dirs = set()		# directories known to exist
+        self.ncopied = 0
+        self.ncloned = 0		# reflinks made
+        self.nlinked = 0		# hard links made
+        self.nunchanged = 0		# destination already had the same content
+        self.nrepeated = 0		# same file synced again in this build
+        self.nfailed = 0
+        self.nbytes = 0			# bytes copied
+
+    def mkdir(self, dirname):
+        '''
+        Make directory dirname (and its parents) if it does not already exist.
+        '''
+        dirname = str(dirname)
+        if dirname not in self.dirs:
+            os.makedirs(dirname, exist_ok=True)
+            self.dirs.add(dirname)
+
+    def copy(self, src, dst):
+        '''
+        Sync file src to dst (a file name, or a directory to put it in).  Returns True if dst is now
+        the same as src, or False (with an error printed) if src could not be copied.
+        '''
+        src = str(src)
+        dst = str(dst)
+        if os.path.isdir(dst):
+            dst = os.path.join(dst, os.path.basename(src))
+        key = os.path.abspath(dst)
+        if self.synced.get(key) == os.path.abspath(src):
+            self.nrepeated += 1
+            return True
+        try:
+            if os.path.exists(dst) and same_content(src, dst):
+                self.nunchanged += 1
+                self.make_readable(dst)
+            else:
+                self.replace(src, dst)
+        except (IOError, OSError) as err:
+            print("[assetsync] Error!  Failed to copy %s to %s, err=%s" % (src, dst, err))
+            self.nfailed += 1
+            return False
+        self.synced[key] = os.path.abspath(src)
+        return True
+
+    def copy_files(self, pattern, dstdir):
+        '''
+        Sync files matching glob pattern into directory dstdir (which is made if needed).
+        Returns the number of files synced, or raises an exception if any failed.
+        '''
+        self.mkdir(dstdir)
+        fnset = sorted(glob.glob(str(pattern)))
+        for fn in fnset:
+            if not self.copy(fn, dstdir):
+                raise Exception("[assetsync] Failed to copy %s to %s" % (fn, dstdir))
+        return len(fnset)
+
+    def replace(self, src, dst):
+        '''
+        Replace dst by a reflink, hard link, or copy of src (made under a temporary name, then renamed).
+        '''
+        tmpfn = os.path.join(os.path.dirname(dst) or '.', '.%s.tmp' % os.path.basename(dst))
+        if os.path.lexists(tmpfn):
+            os.unlink(tmpfn)
+        how = 'copied'
+        if self.links and self.reflink(src, tmpfn):
+            how = 'cloned'
+            self.ncloned += 1
+        elif self.links and self.hardlink(src, tmpfn):
+            how = 'linked'
+            self.nlinked += 1
+        else:
+            shutil.copyfile(src, tmpfn)
+            shutil.copymode(src, tmpfn)
+            self.ncopied += 1
+            self.nbytes += os.path.getsize(tmpfn)
+        self.make_readable(tmpfn)
+        os.replace(tmpfn, dst)
+        if self.verbose:
+            print("[assetsync] %s %s to %s" % (how, src, dst))
+
+    @staticmethod
+    def reflink(src, dst):
+        '''
+        Make dst a copy-on-write clone of src, if the filesystem supports it.  Returns True if done.
+        '''
+        if fcntl is None:
+            return False
+        try:
+            with open(src, 'rb') as sfp, open(dst, 'wb') as dfp:
+                fcntl.ioctl(dfp.fileno(), FICLONE, sfp.fileno())
+            shutil.copymode(src, dst)
+            return True
+        except (IOError, OSError):
+            if os.path.exists(dst):
+                os.unlink(dst)
+            return False
+
+    @staticmethod
+    def hardlink(src, dst):
+        '''
+        Make dst a hard link to src, if possible, and if src is already readable by all
+        (since the mode of a hard link is that of its source).  Returns True if done.
+        '''
+        try:
+            if os.stat(src).st_mode & 0o044 != 0o044:
+                return False
+            os.link(src, dst)
+            return True
+        except (OSError, AttributeError):
+            return False
+
+    @staticmethod
+    def make_readable(fn):
+        mode = os.stat(fn).st_mode
+        if mode & 0o044 != 0o044:
+            os.chmod(fn, mode | 0o044)
+
+    def summary(self):
+        msg = "%d assets copied (%d bytes), %d linked, %d unchanged, %d repeats skipped" % (
+            self.ncopied, self.nbytes, self.ncloned + self.nlinked, self.nunchanged, self.nrepeated)
+        if self.nfailed:
+            msg += ", %d failed" % self.nfailed
+        return msg
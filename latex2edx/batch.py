@@ -0,0 +1,153 @@
+'''
+Batch conversion of many courses (e.g. semester variants) in one run.
+
+A batch is a list of jobs, each a dict giving the tex file and the keyword
+arguments for latex2edx, e.g. from a YAML manifest:
+
+    defaults:                   # options for all jobs (optional)
+      popup_flag: true
+    jobs:
+      - tex: course.tex
+        output_dir: course_fall
+        dir: fall               # working directory for the job (default: that of the manifest)
+      - tex: course.tex
+        output_dir: course_spring
+        dir: spring
+        config_file: latex2edx_config.py
+        log: spring.log         # write job output to this file
+
+Jobs are run in one process (or in each process of a worker pool), so python
+startup, module imports and plasTeX setup are done once, not once per course.
+An error in one job is reported, and doesn't stop the other jobs.
+
+Python API:
+
+    from latex2edx.batch import convert_batch, load_manifest
+    results = convert_batch(load_manifest('manifest.yaml'), processes=4)
+'''
+
+import contextlib
+import multiprocessing
+import os
+import time
+import traceback
+
+JOB_KEYS = ['tex', 'dir', 'config_file', 'log', 'name']		# job keys which are not latex2edx arguments
+
+
+class BatchJobResult(object):
+    '''
+    Outcome of one batch job.
+    '''
+
+    def __init__(self, name, ok, seconds, error=None, details=None):
+        self.name = name
+        self.ok = ok
+        self.seconds = seconds
+        self.error = error		# error message, if not ok
+        self.details = details		# traceback, if not ok
+
+    def __repr__(self):
+        return '<BatchJobResult %s %s %.2f sec>' % (self.name, 'ok' if self.ok else 'FAILED', self.seconds)
+
+
+def load_manifest(fn):
+    '''
+    Load list of jobs from YAML manifest file.  Job directories are relative to that of the manifest.
+    '''
+    import yaml
+    with open(fn) as fp:
+        manifest = yaml.safe_load(fp)
+    if isinstance(manifest, list):
+        manifest = {'jobs': manifest}
+    if not isinstance(manifest, dict) or not isinstance(manifest.get('jobs'), list):
+        raise Exception("Batch manifest %s should have a list of jobs" % fn)
+    defaults = manifest.get('defaults') or {}
+    mdir = os.path.dirname(os.path.abspath(fn))
+    jobs = []
+    for job in manifest['jobs']:
+        if isinstance(job, str):
+            job = {'tex': job}
+        job = dict(defaults, **job)
+        job['dir'] = os.path.join(mdir, job.get('dir', '.'))
+        jobs.append(job)
+    return jobs
+
+
+def job_name(job):
+    name = job.get('name')
+    if name:
+        return name
+    name = job.get('tex', '<no tex file>')
+    if job.get('dir'):
+        name = os.path.normpath(os.path.join(os.path.relpath(job['dir']), name))
+    if job.get('output_dir'):
+        name += ' -> %s' % job['output_dir']
+    return name
+
+
+def run_job(job):
+    '''
+    Run one batch job, in the current process; returns a BatchJobResult.
+    '''
+    from .main import latex2edx, load_config_file
+    import plasTeX
+    from .buildcache import IdGenerator
+
+    name = job_name(job)
+    t0 = time.time()
+    cwd = os.getcwd()
+    logfp = None
+    try:
+        os.chdir(job.get('dir') or '.')
+        args = dict((k, v) for (k, v) in job.items() if k not in JOB_KEYS)
+        if 'tex' not in job:
+            raise Exception("Batch job has no tex file")
+        if job.get('log'):
+            logfp = open(job['log'], 'w')
+        with contextlib.redirect_stdout(logfp) if logfp else contextlib.suppress():
+            if job.get('config_file'):
+                args['extra_xml_filters'] = (args.get('extra_xml_filters') or []) + \
+                    load_config_file(job['config_file'])
+            plasTeX.idgen = IdGenerator(1)		# so element ids are the same as for a separate run
+            c = latex2edx(job['tex'], **args)
+            c.convert()
+        return BatchJobResult(name, True, time.time() - t0)
+    except Exception as err:
+        details = traceback.format_exc()
+        if logfp:
+            logfp.write(details)
+        return BatchJobResult(name, False, time.time() - t0, error=str(err) or err.__class__.__name__,
+                              details=details)
+    finally:
+        if logfp:
+            logfp.close()
+        os.chdir(cwd)
+
+
+def convert_batch(jobs, processes=0, defaults=None):
+    '''
+    Run list of jobs (dicts, see module docstring); if processes > 1, then run them in a pool
+    of that many worker processes.  Returns list of BatchJobResult, in the order of jobs.
+    '''
+    if defaults:
+        jobs = [dict(defaults, **job) for job in jobs]
+    if processes > 1 and len(jobs) > 1:
+        with multiprocessing.Pool(min(processes, len(jobs))) as pool:
+            return pool.map(run_job, jobs, chunksize=1)
+    return [run_job(job) for job in jobs]
+
+
+def summary(results):
+    '''
+    Return text summary report of batch results.
+    '''
+    nfailed = len([x for x in results if not x.ok])
+    lines = ["Batch summary: %d jobs, %d succeeded, %d failed, %.2f sec total" % (
+        len(results), len(results) - nfailed, nfailed, sum([x.seconds for x in results]))]
+    for res in results:
+        line = "  %-6s %8.2f s  %s" % ('ok' if res.ok else 'FAILED', res.seconds, res.name)
+        if not res.ok:
+            line += ': %s' % res.error
+        lines.append(line)
+    return '\n'.join(lines)
@@ -0,0 +1,293 @@
+'''
+Synthetic courses and an end-to-end benchmark for latex2edx.
+
+make_course generates a course of any size, using the edXpsl macros
+(edXchapter, edXsection, edXtext, edXproblem, edXabox, label, ref, toclabel,
+tocref, index, includegraphics).  run_benchmark converts such courses at
+several sizes, with profiling on, and records the time and peak memory of each
+stage and filter.  For each stage, the scaling exponent (the slope of log time
+against log size) is computed, so that stages which scale superlinearly stand
+out.  Results are saved as JSON, and can be compared against a previous run:
+
+    python -m latex2edx.benchmark --sizes 1,2,4,8 --vary chapters -o bench.json
+    python -m latex2edx.benchmark --sizes 1,2,4,8 --compare bench.json
+'''
+
+import contextlib
+import json
+import math
+import optparse
+import os
+import shutil
+import time
+
+try:
+    from collections import OrderedDict
+except:
+    from ordereddict import OrderedDict
+
+DEFAULT_PARAMS = OrderedDict([('chapters', 2),		# number of chapters
+                              ('sections', 2),		# sections per chapter
+                              ('problems', 2),		# problems per section
+                              ('aboxes', 1),		# answer boxes per problem
+                              ('equations', 2),		# labeled equations (and refs to them) per section
+                              ('images', 1),		# images per section
+                              ('index', 1),		# index entries per section
+                              ])
+
+SUPERLINEAR_EXPONENT = 1.25	# stages scaling faster than size**SUPERLINEAR_EXPONENT are flagged
+MIN_TIME = 0.005		# stages faster than this (sec) at all sizes are too noisy to fit
+
+IMAGE_FN = 'example-image.png'
+
+
+def make_course(**params):
+    '''
+    Return LaTeX for a synthetic course; params (see DEFAULT_PARAMS) give its size.
+    '''
+    p = dict(DEFAULT_PARAMS, **params)
+    lines = ['\\documentclass[12pt]{article}',
+             '\\usepackage{edXpsl}',
+             '',
+             '\\begin{document}',
+             '\\begin{edXcourse}{SYN.1x}{Synthetic course}[url_name=2020_Synthetic showanswer=always]',
+             '']
+    for c in range(1, p['chapters'] + 1):
+        lines += ['\\begin{edXchapter}{Chapter %d}' % c,
+                  '\\toclabel{chap:%d}' % c,
+                  '']
+        for s in range(1, p['sections'] + 1):
+            sid = '%d-%d' % (c, s)
+            lines += ['\\begin{edXsection}{Section %s}' % sid,
+                      '',
+                      '\\begin{edXtext}{Reading %s}' % sid,
+                      'This is the reading for section %s, on topic %d.' % (sid, s)]
+            lines += ['\\index{topic %d!part %d}' % (s, k) for k in range(1, p['index'] + 1)]
+            for e in range(1, p['equations'] + 1):
+                lines += ['\\begin{equation}',
+                          '  x_{%d} = \\frac{a_{%d}}{b + %d} \\label{eq:%s-%d}' % (e, c, s, sid, e),
+                          '\\end{equation}',
+                          'Equation \\ref{eq:%s-%d} follows from Equation \\ref{eq:%s-%d}.' % (
+                              sid, e, sid, max(e - 1, 1))]
+            for k in range(1, p['images'] + 1):
+                lines += ['\\includegraphics{%s}' % IMAGE_FN]
+            lines += ['\\end{edXtext}',
+                      '']
+            for q in range(1, p['problems'] + 1):
+                lines += ['\\begin{edXproblem}{Problem %s-%d}{url_name="p%s-%d"}' % (sid, q, sid, q),
+                          '\\tocref{chap:%d}' % c,
+                          'Compute the value, using Equation \\ref{eq:%s-1}.' % sid if p['equations'] else '']
+                for a in range(1, p['aboxes'] + 1):
+                    lines += ['',
+                              '\\edXabox{type="numerical" expect="%d.%d" tolerance="0.01"}' % (q, a)]
+                lines += ['\\end{edXproblem}',
+                          '']
+            lines += ['\\end{edXsection}',
+                      '']
+        lines += ['\\end{edXchapter}',
+                  '']
+    lines += ['\\end{edXcourse}',
+              '\\end{document}',
+              '']
+    return '\n'.join(lines)
+
+
+def write_course(dirname, fn='synthetic.tex', **params):
+    '''
+    Write synthetic course tex file (and the image it uses) into dirname; return tex filename.
+    '''
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    with open(os.path.join(dirname, fn), 'w') as fp:
+        fp.write(make_course(**params))
+    imfn = os.path.join(os.path.dirname(__file__), 'testtex', IMAGE_FN)
+    shutil.copy(imfn, os.path.join(dirname, IMAGE_FN))
+    return fn
+
+
+def convert_course(dirname, fn, **l2e_args):
+    '''
+    Convert a course with profiling on; the output of the conversion goes to log.txt.
+    Returns the latex2edx instance, whose profiler has the measurements.
+    '''
+    from .main import latex2edx
+    cwd = os.getcwd()
+    try:
+        os.chdir(dirname)
+        with open('log.txt', 'w') as logfp, contextlib.redirect_stdout(logfp):
+            c = latex2edx(fn, output_dir='course', profile=True, **l2e_args)
+            c.convert()
+            c.profiler.stop()
+    finally:
+        os.chdir(cwd)
+    return c
+
+
+def scaling_exponent(sizes, times):
+    '''
+    Least squares slope of log(time) against log(size), over the larger half of the sizes
+    (where fixed costs matter least), or None if it can't be estimated.
+    '''
+    pts = sorted([(n, t) for (n, t) in zip(sizes, times) if t > 0])
+    pts = [(math.log(n), math.log(t)) for (n, t) in pts[(len(pts) - 1) // 2:]]
+    if len(pts) < 2 or max(times) < MIN_TIME:
+        return None
+    mx = sum([x for (x, y) in pts]) / len(pts)
+    my = sum([y for (x, y) in pts]) / len(pts)
+    sxx = sum([(x - mx) ** 2 for (x, y) in pts])
+    if sxx == 0:
+        return None
+    return sum([(x - mx) * (y - my) for (x, y) in pts]) / sxx
+
+
+def run_benchmark(sizes, workdir, vary='chapters', params=None, verbose=True, **l2e_args):
+    '''
+    Generate and convert synthetic courses, with the parameter named by vary set to each
+    of sizes (the other parameters are from params, or DEFAULT_PARAMS).  Returns results dict.
+    '''
+    base = dict(DEFAULT_PARAMS, **(params or {}))
+    if vary not in base:
+        raise Exception("Unknown benchmark parameter %s (should be one of %s)" % (vary, ', '.join(base)))
+    runs = []
+    for n in sizes:
+        p = dict(base, **{vary: n})
+        dirname = os.path.join(workdir, '%s_%d' % (vary, n))
+        fn = write_course(dirname, **p)
+        t0 = time.perf_counter()
+        c = convert_course(dirname, fn, **l2e_args)
+        wall = time.perf_counter() - t0
+        peak = max([rec['peak_memory'] or 0 for rec in c.profiler.records.values()] or [0])
+        runs.append(OrderedDict([('size', n),
+                                 ('params', p),
+                                 ('wall', wall),
+                                 ('peak_memory', peak),
+                                 ('records', c.profiler.sorted_records())]))
+        if verbose:
+            print("[latex2edx.benchmark] %s=%d: %.2f sec, peak %.1f MB" % (vary, n, wall, peak / 1.0e6))
+
+    scaling = OrderedDict()
+    names = OrderedDict((rec['name'], rec['kind']) for run in runs for rec in run['records'])
+    for name, kind in names.items():
+        times = [run_time(run, name) for run in runs]
+        scaling[name] = OrderedDict([('kind', kind),
+                                     ('wall', times),
+                                     ('exponent', scaling_exponent(sizes, times))])
+    return OrderedDict([('vary', vary),
+                        ('sizes', list(sizes)),
+                        ('runs', runs),
+                        ('scaling', scaling)])
+
+
+def run_time(run, name):
+    for rec in run['records']:
+        if rec['name'] == name:
+            return rec['wall']
+    return 0.0
+
+
+def superlinear_stages(results):
+    '''
+    Return list of names of stages (and filters) which scale superlinearly with size.
+    '''
+    return [name for (name, sc) in results['scaling'].items()
+            if sc['exponent'] is not None and sc['exponent'] > SUPERLINEAR_EXPONENT]
+
+
+def report(results):
+    '''
+    Return text table of time per stage at each size, with scaling exponents.
+    '''
+    sizes = results['sizes']
+    lines = ["%-44s %-7s" % ('stage / filter (%s =)' % results['vary'], 'kind') +
+             ''.join(["%9d" % n for n in sizes]) + "  exponent"]
+    lines.append('-' * len(lines[0]))
+    order = sorted(results['scaling'].items(), key=lambda x: x[1]['wall'][-1], reverse=True)
+    for name, sc in order:
+        if sc['exponent'] is None:
+            expo = '-'
+        else:
+            expo = '%.2f' % sc['exponent']
+            if sc['exponent'] > SUPERLINEAR_EXPONENT:
+                expo += '  SUPERLINEAR'
+        lines.append("%-44s %-7s" % (name[:44], sc['kind']) + ''.join(["%9.3f" % t for t in sc['wall']]) +
+                     "  " + expo)
+    lines.append("%-44s %-7s" % ('total', '') + ''.join(["%9.3f" % run['wall'] for run in results['runs']]))
+    lines.append("%-44s %-7s" % ('peak memory (MB)', '') +
+                 ''.join(["%9.1f" % (run['peak_memory'] / 1.0e6) for run in results['runs']]))
+    return '\n'.join(lines)
+
+
+def compare(old, new, threshold=1.2):
+    '''
+    Return text comparison of two benchmark results, giving new/old time ratios for each
+    stage at the sizes both have; ratios above threshold are flagged.
+    '''
+    sizes = [n for n in new['sizes'] if n in old['sizes']]
+    lines = ["%-44s" % 'stage / filter (new/old time)' + ''.join(["%9d" % n for n in sizes])]
+    lines.append('-' * len(lines[0]))
+    for name, sc in new['scaling'].items():
+        osc = old['scaling'].get(name)
+        if osc is None:
+            continue
+        ratios = []
+        flag = ''
+        for n in sizes:
+            t_old = osc['wall'][old['sizes'].index(n)]
+            t_new = sc['wall'][new['sizes'].index(n)]
+            if t_old < MIN_TIME and t_new < MIN_TIME:
+                ratios.append('%9s' % '-')
+                continue
+            ratio = t_new / max(t_old, 1.0e-9)
+            ratios.append('%9.2f' % ratio)
+            if ratio > threshold:
+                flag = '  SLOWER'
+        lines.append("%-44s" % name[:44] + ''.join(ratios) + flag)
+    return '\n'.join(lines)
+
+
+def CommandLine():
+    parser = optparse.OptionParser(usage="usage: %prog [options]")
+    parser.add_option("--sizes",
+                      dest="sizes",
+                      default="1,2,4,8",
+                      help="comma separated list of sizes of the parameter being varied",)
+    parser.add_option("--vary",
+                      dest="vary",
+                      default="chapters",
+                      help="course parameter to vary: one of %s" % ', '.join(DEFAULT_PARAMS),)
+    for name, val in DEFAULT_PARAMS.items():
+        parser.add_option("--%s" % name,
+                          dest=name,
+                          default=val, type="int",
+                          help="number of %s (default %d)" % (name, val),)
+    parser.add_option("-w", "--workdir",
+                      dest="workdir",
+                      default="latex2edx_benchmark",
+                      help="directory in which to generate and convert the synthetic courses",)
+    parser.add_option("-o", "--output",
+                      dest="output",
+                      default="latex2edx_benchmark.json",
+                      help="filename for JSON benchmark results",)
+    parser.add_option("--compare",
+                      dest="compare",
+                      default="",
+                      help="JSON results of a previous benchmark run, to compare against",)
+    (opts, args) = parser.parse_args()
+
+    sizes = [int(x) for x in opts.sizes.split(',')]
+    params = dict((name, getattr(opts, name)) for name in DEFAULT_PARAMS)
+    results = run_benchmark(sizes, opts.workdir, vary=opts.vary, params=params)
+    print(report(results))
+    slow = superlinear_stages(results)
+    if slow:
+        print("Superlinear stages: %s" % ', '.join(slow))
+    with open(opts.output, 'w') as fp:
+        fp.write(json.dumps(results, indent=2))
+    print("Benchmark results written to %s" % opts.output)
+    if opts.compare:
+        with open(opts.compare) as fp:
+            print(compare(json.load(fp), results))
+
+
+if __name__ == '__main__':
+    CommandLine()
@@ -0,0 +1,335 @@
+'''
+Build cache for incremental latex2edx rebuilds.
+
+Rendering LaTeX with plasTeX is the most expensive stage of a latex2edx build.
+For incremental rebuilds, the (top-level) edXchapter environments of the
+LaTeX source are rendered separately, and the XHTML for each one is stored in
+a cache directory, keyed by a hash of:
+
+  - the preamble (everything before the first chapter) and the trailer
+  - the chapter's LaTeX source, including the files it \\input's
+  - the state at the start of the chapter: plasTeX counters (e.g. edXchapter,
+    equation, figure) and the answer box default configuration
+  - the latex2edx version, and the contents of the edXpsl macro package and
+    the templates used for rendering (see renderer_dependencies)
+
+Each rendering starts plasTeX's generated element ids from 1; the ids are
+renumbered when the chapters are put together, so that the result is the
+same as that of rendering the whole document at once.
+
+Unchanged chapters are then taken from the cache, and only changed chapters
+are rendered again.  The chapter XHTML fragments are stitched back together
+into one document, which goes through the XML fix filters as a whole, so that
+cross-cutting processing (reference numbering in handle_refs, url_name
+assignment, the ToC index) sees the complete course.
+
+Documents which cannot safely be split (e.g. defining macros or footnotes
+inside chapters) are cached as a whole.
+
+The cache also records hashes of the course files written by the export, so
+that unchanged files are not written again.
+'''
+
+import glob
+import hashlib
+import json
+import os
+import re
+
+from lxml import etree
+
+try:
+    from path import path	# needs path.py
+except Exception as err:
+    from path import Path as path
+
+CACHE_VERSION = '1'
+
+CHAPTER_BEGIN = re.compile(r'^\s*\\begin\{edXchapter\*?\}')
+CHAPTER_END = re.compile(r'^\s*\\end\{edXchapter\*?\}')
+
+# LaTeX commands whose effect carries over from one chapter to the next, beyond counters
+GLOBAL_STATE_COMMANDS = re.compile(r'\\(newcommand|renewcommand|providecommand|def|gdef|edef|let|'
+                                   r'newenvironment|renewenvironment|DeclareMathOperator|newcounter|'
+                                   r'footnote)(?![a-zA-Z])')
+
+INPUT_COMMAND = re.compile(r'\\input\{([^}]+)\}')
+
+TRAILER_LINE = re.compile(r'^(\\end\{[^}]+\}\s*)+$')
+
+
+def hash_strings(*args):
+    sha = hashlib.sha1()
+    for arg in args:
+        if not isinstance(arg, str):
+            arg = json.dumps(arg, sort_keys=True, default=str)
+        sha.update(arg.encode('utf8'))
+        sha.update(b'\0')
+    return sha.hexdigest()
+
+
+def input_dependencies(text, seen=None):
+    '''
+    Return list of [filename, sha1, uses_global_state] for files \\input by the
+    LaTeX text, recursively.  Files are looked up the same way as by the edXpsl
+    \\input macro (name, or name.tex).
+    '''
+    if seen is None:
+        seen = set()
+    deps = []
+    for name in INPUT_COMMAND.findall(text):
+        name = name.strip()
+        fn = name if os.path.exists(name) else name + '.tex'
+        if fn in seen:
+            continue
+        seen.add(fn)
+        if not os.path.exists(fn):
+            deps.append([fn, None, False])
+            continue
+        with open(fn, 'rb') as fp:
+            data = fp.read().decode('utf8', 'replace')
+        deps.append([fn, hashlib.sha1(data.encode('utf8')).hexdigest(), bool(GLOBAL_STATE_COMMANDS.search(data))])
+        deps += input_dependencies(data, seen)
+    return deps
+
+
+def renderer_dependencies():
+    '''
+    Return list of [filename, sha1] for the plasTeX python packages (plastexpy/*.py) and templates
+    (render/*.zpts) used for rendering, with filenames relative to the latex2edx package directory.
+    '''
+    mydir = os.path.dirname(os.path.abspath(__file__))
+    deps = []
+    for pattern in ['plastexpy/*.py', 'render/*.zpts']:
+        for fn in sorted(glob.glob(os.path.join(mydir, pattern))):
+            with open(fn, 'rb') as fp:
+                deps.append([os.path.relpath(fn, mydir), hashlib.sha1(fp.read()).hexdigest()])
+    return deps
+
+
+def split_chapters(latex_string):
+    '''
+    Split LaTeX source at top-level \\begin{edXchapter} lines.
+
+    Returns (preamble, chunks, trailer), where preamble is the text before the
+    first chapter, trailer is the text after the last \\end{edXchapter}, and
+    chunks is a list of (linenum, text), one per chapter, each starting with a
+    \\begin{edXchapter} line (linenum is its zero-based line number).
+
+    Returns None if there are no chapters, or the chapter environments can't be
+    reliably identified.
+    '''
+    lines = latex_string.split('\n')
+    starts = [k for k, line in enumerate(lines) if CHAPTER_BEGIN.match(line)]
+    ends = [k for k, line in enumerate(lines) if CHAPTER_END.match(line)]
+    if not starts or len(starts) != len(ends):
+        return None
+    for start, end in zip(starts, ends):
+        if end < start:
+            return None
+    for end, nextstart in zip(ends, starts[1:]):
+        if nextstart < end:
+            return None		# nested chapters
+    chunks = []
+    for k, start in enumerate(starts):
+        if k + 1 < len(starts):
+            stop = starts[k + 1]
+        else:
+            stop = ends[-1] + 1
+        chunks.append((start, '\n'.join(lines[start:stop])))
+    preamble = '\n'.join(lines[:starts[0]])
+    trailer = '\n'.join(lines[ends[-1] + 1:])
+    return preamble, chunks, trailer
+
+
+def unsplittable_reason(split, chunk_deps):
+    '''
+    Return reason why the chapters of split LaTeX source cannot be rendered
+    separately, or None if they can.  chunk_deps gives the input_dependencies
+    of each chunk.
+    '''
+    if split is None:
+        return "no top-level edXchapter environments found"
+    preamble, chunks, trailer = split
+    if '\\edXabox' in preamble or '\\edXabox' in trailer:
+        return "answer boxes outside of chapters"
+    for line in trailer.split('\n'):
+        line = line.split('%', 1)[0].strip()
+        if line and not TRAILER_LINE.match(line):
+            return "content after the last chapter"
+    for (linenum, chunk), deps in zip(chunks, chunk_deps):
+        if GLOBAL_STATE_COMMANDS.search(chunk) or any(dep[2] for dep in deps):
+            return "macro definitions or footnotes in the chapter starting on line %d" % (linenum + 1)
+    return None
+
+
+def chunk_source(preamble, linenum, chunk, trailer, counters=None, line_drift=0):
+    '''
+    Construct the LaTeX source for rendering one chapter on its own.
+
+    Comment lines are used to pad the chapter to the line number where it is in
+    the full source, so that linenum attributes come out the same.  The last
+    padding line sets the counters to their values at the start of the chapter.
+
+    plasTeX miscounts lines after some constructs (e.g. equations); line_drift is
+    the number of extra lines counted in the earlier chapters, which are added
+    to the padding, so that linenum attributes are the same as for the full source.
+    Returns None if there is no room for the padding.
+    '''
+    npre = preamble.count('\n') + 1
+    padding = ['%'] * (linenum - npre + line_drift)
+    if counters and not padding:
+        return None
+    if counters:
+        padding[-1] = ''.join(['\\setcounter{%s}{%d}' % (name, value)
+                               for (name, value) in counters]) + '%'
+    return '\n'.join([preamble] + padding + [chunk, trailer])
+
+
+def counter_state(document):
+    '''
+    Return list of [name, value] for all the plasTeX counters of document,
+    ordered so that counters come after the counters which reset them
+    (since \\setcounter resets dependent counters).
+    '''
+    counters = document.context.counters
+
+    def depth(counter):
+        nhop = 0
+        while counter.resetby and counter.resetby in counters and nhop < 20:
+            counter = counters[counter.resetby]
+            nhop += 1
+        return nhop
+
+    state = [(depth(cnt), name, cnt.value) for (name, cnt) in counters.items()]
+    return [[name, value] for (dep, name, value) in sorted(state)]
+
+
+class IdGenerator(object):
+    '''
+    Replacement for plasTeX's global generator of element ids (a0000000001, a0000000002, ...),
+    which keeps track of the next id number, so that parts of a document can be rendered
+    separately, and their ids renumbered to be the same as for a whole document rendering.
+    '''
+
+    def __init__(self, next_id=1):
+        self.next_id = next_id
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.next_id += 1
+        return 'a%.10d' % (self.next_id - 1)
+
+
+GENERATED_ID = re.compile(r'\ba(\d{10})\b')
+
+
+def renumber_ids(text, offset, nbase=0, base_offset=0):
+    '''
+    Shift the numbers of plasTeX generated ids in text: ids numbered up to nbase by
+    base_offset, and later ids by offset.
+    '''
+    def shift(m):
+        num = int(m.group(1))
+        return 'a%.10d' % (num + (base_offset if num <= nbase else offset))
+    return GENERATED_ID.sub(shift, text)
+
+
+def course_children(xhtml):
+    '''
+    Return (xml, course, list of serialized children of course) for rendered XHTML,
+    or None if there is no course element.
+    '''
+    xml = etree.fromstring(xhtml)
+    course = xml.find('.//course')
+    if course is None:
+        return None
+    return xml, course, [etree.tostring(child, encoding='unicode', with_tail=True) for child in course]
+
+
+def extract_chapters(xhtml, prefix):
+    '''
+    Return the serialized elements of course in the rendered XHTML of one chapter, which come
+    after the given prefix (list of serialized elements from the preamble), or None if the
+    rendered XHTML doesn't start with the prefix.
+    '''
+    ret = course_children(xhtml)
+    if ret is None:
+        return None
+    children = ret[2]
+    if children[:len(prefix)] != prefix:
+        return None
+    return ''.join(children[len(prefix):])
+
+
+def stitch_chapters(base, fragments):
+    '''
+    Append chapter fragments to the course in the base document (rendered from
+    just the preamble and trailer).  Returns serialized XHTML.
+    '''
+    xml = etree.fromstring(base)
+    course = xml.find('.//course')
+    for fragment in fragments:
+        course.extend(list(etree.fromstring('<fragment>%s</fragment>' % fragment)))
+    return etree.tostring(xml, encoding='unicode')
+
+
+class BuildCache(object):
+    '''
+    Directory of cached rendering results, stored as JSON files named by
+    their key (a hash of everything that went into them).
+    '''
+
+    def __init__(self, cache_dir, verbose=False):
+        self.dir = path(cache_dir)
+        self.verbose = verbose
+        if not os.path.exists(self.dir / 'units'):
+            os.makedirs(self.dir / 'units')
+        self.reused = []		# descriptions of cache entries used
+        self.rendered = []		# descriptions of cache entries (re)computed
+        self.output_hashes_fn = self.dir / 'output_hashes.json'
+        self.output_hashes = {}
+        if os.path.exists(self.output_hashes_fn):
+            with open(self.output_hashes_fn) as fp:
+                self.output_hashes = json.load(fp)
+
+    def entry_fn(self, key):
+        return self.dir / 'units' / (key + '.json')
+
+    def get(self, key):
+        '''
+        Return cache entry (a dict) for key, or None if not cached.
+        '''
+        fn = self.entry_fn(key)
+        if not os.path.exists(fn):
+            return None
+        try:
+            with open(fn) as fp:
+                return json.load(fp)
+        except Exception as err:
+            print("[buildcache] Warning: ignoring unreadable cache entry %s, err=%s" % (fn, err))
+            return None
+
+    def put(self, key, entry):
+        fn = self.entry_fn(key)
+        tmpfn = fn + '.tmp'
+        with open(tmpfn, 'w') as fp:
+            json.dump(entry, fp)
+        os.replace(tmpfn, fn)
+
+    def note(self, what, reused):
+        if reused:
+            self.reused.append(what)
+        else:
+            self.rendered.append(what)
+        if self.verbose:
+            print("[buildcache] %s %s" % ('reusing' if reused else 'rendering', what))
+
+    def summary(self):
+        return "%d reused, %d rendered" % (len(self.reused), len(self.rendered))
+
+    def save_output_hashes(self):
+        with open(self.output_hashes_fn, 'w') as fp:
+            json.dump(self.output_hashes, fp, indent=1, sort_keys=True)
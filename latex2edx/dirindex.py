@@ -0,0 +1,80 @@
+'''
+Index of the files in a directory tree.
+
+Importing a course from an edX XML directory checks whether a file exists for
+each descriptor (and html or problem filename) in the course.  For a large
+course, these are thousands of stat calls, which are slow on network
+filesystems.  A DirectoryIndex lists the whole tree once (with os.scandir,
+which gets the file types from the directory listing), so that each check is
+a set lookup.
+
+The size and modification time of each file are recorded too, and make up
+the signature of the tree, which changes if any file is added, removed, or
+modified; this is used as the key of XBundle's import cache.
+'''
+
+import hashlib
+import json
+import os
+
+
+class DirectoryIndex(object):
+    '''
+    Set of the files under directory root, by relative path (with / separators).
+    '''
+
+    def __init__(self, root, exclude=None):
+        '''
+        exclude: optional list of files (eg a cache file) left out of the index.
+        '''
+        self.root = os.path.abspath(root)
+        self.files = {}			# {relative path: (size, mtime in ns)}
+        seen = set()			# real paths of directories listed, in case of symlink loops
+        stack = ['']
+        while stack:
+            rel = stack.pop()
+            dirname = os.path.join(self.root, rel)
+            real = os.path.realpath(dirname)
+            if real in seen:
+                continue
+            seen.add(real)
+            try:
+                entries = list(os.scandir(dirname))
+            except OSError:
+                continue
+            for entry in entries:
+                name = rel + '/' + entry.name if rel else entry.name
+                try:
+                    if entry.is_dir():
+                        stack.append(name)
+                    elif entry.is_file():
+                        st = entry.stat()
+                        self.files[name] = (st.st_size, st.st_mtime_ns)
+                except OSError:
+                    continue
+        for fn in exclude or []:
+            self.files.pop(self.relpath(fn), None)
+
+    def relpath(self, fn):
+        return os.path.relpath(os.path.abspath(fn), self.root).replace(os.sep, '/')
+
+    def __contains__(self, rel):
+        '''
+        rel is a path relative to root, eg "html/intro.html".
+        '''
+        return os.path.normpath(rel).replace(os.sep, '/') in self.files
+
+    def __len__(self):
+        return len(self.files)
+
+    def exists(self, fn):
+        '''
+        Return True if fn (a path, absolute or relative to the current directory) is in the index.
+        '''
+        return self.relpath(fn) in self.files
+
+    def signature(self):
+        '''
+        Return a hash of the paths, sizes, and modification times of all the files.
+        '''
+        return hashlib.sha1(json.dumps(sorted(self.files.items())).encode('utf8')).hexdigest()
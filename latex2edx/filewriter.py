@@ -0,0 +1,334 @@
+'''
+Writer for the files of an exported course.
+
+Exporting a course writes thousands of small files.  When the output
+directory is on a network filesystem, the time taken by each open and write
+dominates the export, so a FileWriter hands the writes to a bounded pool of
+threads, while the caller (e.g. XBundle.write_xml_file) carries on
+serializing the next file.  Directories known to exist are remembered, so
+they are checked and made only once.
+
+Each file is written to a temporary file in the same directory, which is then
+renamed, so that readers (and an interrupted build) never see a partly
+written file.
+
+A file whose content is unchanged is not written again, so its timestamp is
+kept, and tools which watch or sync the course directory see only real
+changes.  Files are compared by size, and then by sha1 hash; if the hashes of
+the files written by a previous build are given (e.g. from the BuildCache), an
+unchanged file is recognized from its hash, without reading it, as long as its
+size and modification time are still those recorded with the hash (so a file
+edited or replaced since is written again).
+
+The sha1 hash of each file written (or found unchanged) is recorded, along
+with its source location (e.g. "course.tex:42"), and write_manifest() saves
+these as a JSON manifest, keyed by path relative to the output directory.
+Files which the caller knows to be unchanged, without making their content
+again, are recorded by keep().
+
+A TarWriter instead streams the files into a compressed tar archive (e.g.
+course.tar.gz, ready for import into Open edX), so that the course files are
+never written to (and read back from) the filesystem.
+
+Errors in the writer threads are collected; wait() waits for all pending
+writes, and raises a FileWriteError listing any that failed.  With a single
+job, files are written directly, and errors raised immediately.  close() (or
+shutdown(), e.g. after an error) stops the threads, at the end of a build.
+'''
+
+import hashlib
+import io
+import json
+import os
+import tarfile
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class FileWriteError(Exception):
+    '''
+    Raised by FileWriter.wait when some files could not be written.
+    '''
+
+    def __init__(self, errors):
+        self.errors = errors		# list of (filename, exception)
+        msg = "[filewriter] failed to write %d files:\n" % len(errors)
+        msg += '\n'.join("    %s: %s" % (fn, err) for (fn, err) in errors[:10])
+        if len(errors) > 10:
+            msg += "\n    ..."
+        Exception.__init__(self, msg)
+
+
+class FileWriter(object):
+    '''
+    Write files atomically, using up to jobs threads (if jobs > 1; else directly).
+    '''
+
+    def __init__(self, jobs=1, hashes=None):
+        '''
+        hashes: optional dict of [sha1 hash, size, mtime in ns] of files written by a previous build, keyed by
+                absolute path; it is updated for the files written.
+        '''
+        self.jobs = jobs
+        self.hashes = hashes
+        self.dirs = set()		# directories known to exist
+        self.manifest = {}		# {filename: {'sha1': hash, 'source': source location}}
+        self.nwritten = 0
+        self.nunchanged = 0		# number of files not written since unchanged
+        self.submitted = []		# [(filename, future)] for writes submitted to the pool since the last wait
+        self.pending = {}		# {filename: future} for the last write of each file
+        self.lock = threading.Lock()
+        self.pool = None		# made when first needed, if jobs > 1
+        if jobs > 1:
+            self.slots = threading.BoundedSemaphore(4 * jobs)	# limit on writes queued, with their data
+
+    def mkdir(self, dirname):
+        '''
+        Make directory dirname (and its parents) if it does not already exist.
+        '''
+        dirname = str(dirname)
+        if dirname not in self.dirs:
+            os.makedirs(dirname, exist_ok=True)
+            self.dirs.add(dirname)
+
+    def write(self, fn, data, source=None):
+        '''
+        Write data (bytes or str) to file fn, which is replaced if it exists, unless its
+        content is unchanged.  The directory of fn should already exist.
+        source is the location recorded for fn in the manifest (e.g. "course.tex:42").
+        '''
+        fn = str(fn)
+        if isinstance(data, str):
+            data = data.encode('utf8')
+        sha1 = hashlib.sha1(data).hexdigest()
+        self.manifest[fn] = {'sha1': sha1, 'source': source}
+        if self.known_hash(fn) == sha1:
+            with self.lock:
+                self.nunchanged += 1
+            return
+        if self.jobs <= 1:
+            self.write_file(fn, data, sha1)
+            return
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers=self.jobs)
+        previous = self.pending.get(fn)
+        if previous is not None:		# keep writes to the same file in order
+            previous.exception()
+        self.slots.acquire()
+        future = self.pool.submit(self.write_file, fn, data, sha1)
+        self.submitted.append((fn, future))
+        self.pending[fn] = future
+        future.add_done_callback(lambda f: self.slots.release())
+
+    def write_file(self, fn, data, sha1):
+        if self.unchanged(fn, data, sha1):
+            with self.lock:
+                self.nunchanged += 1
+            self.record_hash(fn, sha1)
+            return
+        tmpfn = '%s.%d-%d.tmp' % (fn, os.getpid(), threading.get_ident())
+        try:
+            with open(tmpfn, 'wb') as fp:
+                fp.write(data)
+            os.replace(tmpfn, fn)
+        except Exception:
+            if os.path.exists(tmpfn):
+                os.unlink(tmpfn)
+            raise
+        with self.lock:
+            self.nwritten += 1
+        self.record_hash(fn, sha1)
+
+    def known_hash(self, fn):
+        '''
+        Return the sha1 hash of file fn recorded in self.hashes, or None if not known, or if
+        fn has been changed (or removed) since, as seen from its size and modification time.
+        '''
+        if self.hashes is None:
+            return None
+        entry = self.hashes.get(os.path.abspath(fn))
+        if not isinstance(entry, list) or len(entry) != 3:
+            return None
+        try:
+            st = os.stat(fn)
+        except OSError:
+            return None
+        if [st.st_size, st.st_mtime_ns] != entry[1:]:
+            return None
+        return entry[0]
+
+    def record_hash(self, fn, sha1):
+        '''
+        Record in self.hashes the sha1 hash of file fn (just written, or found unchanged), with its size and mtime.
+        '''
+        if self.hashes is None:
+            return
+        st = os.stat(fn)
+        with self.lock:
+            self.hashes[os.path.abspath(fn)] = [sha1, st.st_size, st.st_mtime_ns]
+
+    def unchanged(self, fn, data, sha1):
+        '''
+        Return True if file fn exists with content data (whose sha1 hash is given).
+        '''
+        try:
+            if os.path.getsize(fn) != len(data):
+                return False
+            with open(fn, 'rb') as fp:
+                return hashlib.sha1(fp.read()).hexdigest() == sha1
+        except OSError:
+            return False
+
+    def keep(self, fn, source=None):
+        '''
+        Record file fn, written by a previous build and known to be unchanged, as if it were written
+        again (e.g. in the manifest), reading it only if its hash is not known.  Return False (and
+        record nothing) if fn does not exist.
+        '''
+        fn = str(fn)
+        if not os.path.exists(fn):
+            return False
+        sha1 = self.known_hash(fn)
+        if sha1 is None:
+            with open(fn, 'rb') as fp:
+                sha1 = hashlib.sha1(fp.read()).hexdigest()
+            self.record_hash(fn, sha1)
+        self.manifest[fn] = {'sha1': sha1, 'source': source}
+        with self.lock:
+            self.nunchanged += 1
+        return True
+
+    def remove(self, fn):
+        '''
+        Remove file fn (once any pending write to it is done), and drop it from the manifest.
+        '''
+        fn = str(fn)
+        previous = self.pending.get(fn)
+        if previous is not None:
+            previous.exception()
+        os.unlink(fn)
+        self.manifest.pop(fn, None)
+
+    def write_manifest(self, fn, root):
+        '''
+        Write the manifest of files under directory root to JSON file fn, as
+        {path relative to root: {"sha1": hash, "source": source location}}.
+        '''
+        self.wait()
+        root = os.path.abspath(root)
+        manifest = {}
+        for (ofn, entry) in self.manifest.items():
+            ofn = os.path.abspath(ofn)
+            if ofn.startswith(root + os.sep) and ofn != os.path.abspath(fn):
+                manifest[os.path.relpath(ofn, root)] = entry
+        self.write(fn, json.dumps(manifest, indent=1, sort_keys=True) + '\n')
+        self.manifest.pop(str(fn), None)
+        self.wait()
+
+    def wait(self):
+        '''
+        Wait for all pending writes to finish, and raise FileWriteError if any failed.
+        '''
+        (submitted, self.submitted, self.pending) = (self.submitted, [], {})
+        errors = [(fn, future.exception()) for (fn, future) in submitted]
+        errors = [(fn, err) for (fn, err) in errors if err is not None]
+        if errors:
+            raise FileWriteError(errors)
+
+    def close(self):
+        '''
+        Wait for all pending writes (raising FileWriteError if any failed), and stop the writer threads.
+        '''
+        try:
+            self.wait()
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        '''
+        Stop the writer threads, once the writes submitted are done; they are started again if needed.
+        '''
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+
+
+def tar_mode(tarfn):
+    '''
+    Return the tarfile mode for writing tarfn, compressed according to its extension.
+    '''
+    for (ext, mode) in [('.gz', 'w:gz'), ('.tgz', 'w:gz'), ('.bz2', 'w:bz2'), ('.xz', 'w:xz')]:
+        if tarfn.endswith(ext):
+            return mode
+    return 'w'
+
+
+class TarWriter(FileWriter):
+    '''
+    Write files into tar archive tarfn, instead of to the filesystem.  Files are
+    given by their paths under directory root (which need not exist), and are
+    stored under directory prefix in the archive.  On close, the files in
+    static_dirs (directories under root, eg made by external tools, like images)
+    are also added, unless already written.
+    '''
+
+    def __init__(self, tarfn, root, prefix='course', static_dirs=None):
+        FileWriter.__init__(self)
+        self.tarfn = str(tarfn)
+        self.root = os.path.abspath(root)
+        self.prefix = prefix
+        self.static_dirs = static_dirs or []
+        self.members = set()
+        self.mtime = int(time.time())
+        self.tar = None				# opened on first write
+        self.closed = False
+
+    def open(self):
+        if self.tar is None:
+            self.tar = tarfile.open(self.tarfn, tar_mode(self.tarfn))
+        return self.tar
+
+    def mkdir(self, dirname):
+        pass
+
+    def arcname(self, fn):
+        rel = os.path.relpath(os.path.abspath(fn), self.root)
+        if rel == os.pardir or rel.startswith(os.pardir + os.sep):
+            raise Exception("[filewriter] cannot write %s to tar archive, since not in %s" % (fn, self.root))
+        return '/'.join([self.prefix] + rel.split(os.sep))
+
+    def write_file(self, fn, data, sha1):
+        info = tarfile.TarInfo(self.arcname(fn))
+        info.size = len(data)
+        info.mtime = self.mtime
+        info.mode = 0o644
+        self.open().addfile(info, io.BytesIO(data))
+        self.members.add(info.name)
+        self.nwritten += 1
+
+    def keep(self, fn, source=None):
+        return False			# the file is not in the archive unless written
+
+    def remove(self, fn):
+        raise Exception("[filewriter] cannot remove %s from tar archive %s" % (fn, self.tarfn))
+
+    def close(self):
+        '''
+        Add the files in static_dirs not already written, and finish the archive.
+        '''
+        if self.closed:
+            return
+        tar = self.open()
+        for sdir in self.static_dirs:
+            for (dirpath, dirnames, filenames) in os.walk(os.path.join(self.root, sdir)):
+                dirnames.sort()
+                for fn in sorted(filenames):
+                    fn = os.path.join(dirpath, fn)
+                    name = self.arcname(fn)
+                    if name not in self.members:
+                        tar.add(fn, arcname=name, recursive=False)
+                        self.members.add(name)
+        tar.close()
+        self.closed = True
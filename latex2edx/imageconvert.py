@@ -0,0 +1,275 @@
+'''
+Conversion of PDF figures to PNG images, for \\includegraphics.
+
+edX pages can't show PDF files, so MyRenderer.fix_image uses PNG images made
+from them (one per page), by ImageMagick, next to the PDF file.  Converting a
+large PDF at high density takes seconds, so for a course with many figures,
+the conversions are done before rendering: all \\includegraphics targets in
+the LaTeX source (and the files it \\input's) are collected, and the PDFs
+needing conversion are converted in a pool of processes.
+
+The PNG images made are also kept in a cache directory (if given), keyed by a
+hash of the PDF file contents, the density, and the scale, so that a figure
+is never converted again for a later build, or for another copy of the same
+PDF file.
+'''
+
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+
+DENSITY = 800		# dpi for rasterizing PDF files
+
+INCLUDEGRAPHICS = re.compile(r'\\includegraphics\s*(?:\[([^\]]*)\])?\s*\{([^}]+)\}')
+INPUT_COMMAND = re.compile(r'\\input\{([^}]+)\}')
+
+
+def image_style(style):
+    '''
+    Return (width, attribs) for the style (options) of an includegraphics, where width is in pixels,
+    and attribs is a CSS style string made from the other options.
+    '''
+    width = 400
+    attribs = []
+    sms = style.split(',')
+    for sm in sms:
+        w = re.search(r'width=([0-9\.]+)(.*)', sm)
+        if w:
+            widtype = w.group(2)
+            width = float(w.group(1))
+            if 'in' in widtype:
+                width = width * 110
+            elif 'cm' in widtype:
+                width = width * 110 / 2.54
+            if '\\textwidth' in widtype:
+                width = width * 770
+            width = int(width)
+            if width==0:
+                width = 400
+        else:
+            sm = sm.strip().replace('=', ':')
+            attribs.append(sm)
+    return width, ';'.join(attribs)
+
+
+def image_scale(width):
+    '''
+    Size (in pixels) of the box a PDF is scaled to fit, for an image shown with the given width.
+    '''
+    return width if width > 400 else 400
+
+
+def find_images(latex_string, seen=None):
+    '''
+    Return list of (options, filename) for the \\includegraphics commands in latex_string,
+    and in the files it \\input's (looked up as name, or name.tex), recursively.
+    '''
+    if seen is None:
+        seen = set()
+    images = [(opts or '', fn.strip()) for (opts, fn) in INCLUDEGRAPHICS.findall(latex_string)]
+    for name in INPUT_COMMAND.findall(latex_string):
+        name = name.strip()
+        fn = name if os.path.exists(name) else name + '.tex'
+        if fn in seen or not os.path.exists(fn):
+            continue
+        seen.add(fn)
+        with open(fn, errors='replace') as fp:
+            images += find_images(fp.read(), seen)
+    return images
+
+
+def replace_file(fn, make):
+    '''
+    Make file fn (e.g. in a cache directory shared by several builds) by calling make(tmpfn), for
+    a new temporary file tmpfn in the same directory, which is then renamed to fn.
+    '''
+    fd, tmpfn = tempfile.mkstemp(dir=os.path.dirname(fn) or '.', suffix=os.path.splitext(fn)[1])
+    os.close(fd)
+    try:
+        os.chmod(tmpfn, 0o644)		# as for a file made with the usual umask, not private
+        make(tmpfn)
+        os.replace(tmpfn, fn)
+    finally:
+        if os.path.exists(tmpfn):
+            os.unlink(tmpfn)
+
+
+def pdf_pages(pdffn):
+    '''
+    Return number of pages of PDF file (1 if unknown, e.g. if pdfinfo is not installed).
+    '''
+    try:
+        out = subprocess.run(['pdfinfo', pdffn], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                             universal_newlines=True).stdout
+        return int(re.search(r'^Pages:\s*(\d+)', out, re.M).group(1))
+    except Exception:
+        return 1
+
+
+def png_names(fnbase, npages):
+    '''
+    Names (without .png) of the PNG images made from PDF file fnbase.pdf, as ImageMagick names them.
+    '''
+    if npages > 1:
+        return ['%s-%d' % (fnbase, x) for x in range(npages)]
+    return [fnbase]
+
+
+def convert_pdf(job):
+    '''
+    Convert job['pdf'] to PNG image(s) job['png'] (-0.png, -1.png, ... for multi-page PDFs), using ImageMagick.
+    Returns the names of the images made (without .png).  Used in worker processes.
+    '''
+    cmd = ['convert', '-density', str(job['density']), job['pdf'], '-scale', '{dim}x{dim}'.format(dim=job['dim']),
+           job['png'] + '.png']
+    try:
+        subprocess.call(cmd)
+    except Exception as err:
+        print("[imageconvert] Error!  Failed to run %s, err=%s" % (' '.join(cmd), err))
+    return [x for x in png_names(job['png'], job['npages']) if os.path.exists(x + '.png')]
+
+
+class ImageConverter(object):
+    '''
+    Converts PDF figures to PNG images, using a cache directory (if given) and a pool of processes.
+    '''
+
+    def __init__(self, cache_dir='', processes=0, density=DENSITY, verbose=False):
+        '''
+        cache_dir = directory for PNG images made, keyed by (PDF hash, density, scale); not cached if empty
+        processes = number of processes for converting images in parallel (0 for one per CPU)
+        '''
+        self.cache_dir = cache_dir
+        self.processes = processes
+        self.density = density
+        self.verbose = verbose
+        self.converted = []	# PDF files converted
+        self.reused = []	# PDF files whose images were taken from the cache
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def key(self, pdffn, dim):
+        sha = hashlib.sha1()
+        with open(pdffn, 'rb') as fp:
+            for data in iter(lambda: fp.read(1 << 20), b''):
+                sha.update(data)
+        sha.update(('\0%s\0%s' % (self.density, dim)).encode('utf8'))
+        return sha.hexdigest()
+
+    def target(self, fn, dim, npages=None):
+        '''
+        Return conversion job (a dict) for PDF file fn.pdf scaled to dim, or None if its PNG images already exist.
+        '''
+        if npages is None:
+            npages = pdf_pages(fn + '.pdf')
+        if all(os.path.exists(x + '.png') for x in png_names(fn, npages)):
+            return None
+        return {'pdf': fn + '.pdf', 'png': fn, 'dim': dim, 'density': self.density, 'npages': npages,
+                'key': self.key(fn + '.pdf', dim) if self.cache_dir else None}
+
+    def cache_entry_fn(self, key):
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def from_cache(self, job):
+        '''
+        Copy the cached PNG images for job into place.  Returns list of image names, or None if not cached.
+        '''
+        if not job['key'] or not os.path.exists(self.cache_entry_fn(job['key'])):
+            return None
+        with open(self.cache_entry_fn(job['key'])) as fp:
+            entry = json.load(fp)
+        cached = png_names(os.path.join(self.cache_dir, job['key']), entry['npages'])
+        if not all(os.path.exists(x + '.png') for x in cached):
+            return None
+        fnset = png_names(job['png'], entry['npages'])
+        for src, dst in zip(cached, fnset):
+            shutil.copy(src + '.png', dst + '.png')
+        self.reused.append(job['pdf'])
+        return fnset
+
+    def to_cache(self, job, fnset):
+        '''
+        Store the PNG images made for job in the cache.
+        '''
+        if not job['key'] or not fnset:
+            return
+        cached = png_names(os.path.join(self.cache_dir, job['key']), len(fnset))
+        for src, dst in zip(fnset, cached):
+            replace_file(dst + '.png', lambda tmpfn: shutil.copyfile(src + '.png', tmpfn))
+
+        def write_entry(tmpfn):
+            with open(tmpfn, 'w') as fp:
+                json.dump({'npages': len(fnset), 'pdf': job['pdf'], 'dim': job['dim'], 'density': job['density']},
+                          fp)
+        replace_file(self.cache_entry_fn(job['key']), write_entry)
+
+    def finish(self, job, fnset):
+        self.converted.append(job['pdf'])
+        self.to_cache(job, fnset)
+        if self.verbose:
+            print("[imageconvert] converted %s to %s" % (job['pdf'], fnset))
+
+    def convert(self, fn, dim):
+        '''
+        Make PNG image(s) from PDF file fn.pdf, scaled to fit in dim x dim pixels, unless they already exist.
+        Returns the names of the images (without .png), one per page.
+        '''
+        npages = pdf_pages(fn + '.pdf')
+        if npages > 1:
+            print("--> %d page PDF, fnset=%s" % (npages, png_names(fn, npages)))
+        job = self.target(fn, dim, npages)
+        if job is None:
+            return png_names(fn, npages)
+        fnset = self.from_cache(job)
+        if fnset is None:
+            fnset = convert_pdf(job)
+            self.finish(job, fnset)
+        return fnset or png_names(fn, job['npages'])
+
+    def convert_all(self, images):
+        '''
+        Convert the PDF files for list of (options, filename) images, as found by find_images, in parallel.
+        Images are looked up as by MyRenderer.fix_image: PDF files are only converted if there is no
+        file with the name as given, or with .png added.  Identical PDF files (with the same scale) are
+        converted only once.
+        '''
+        jobs = []
+        done = set()
+        for (opts, fn) in images:
+            if fn in done or os.path.exists(fn) or os.path.exists(fn + '.png') or not os.path.exists(fn + '.pdf'):
+                continue
+            done.add(fn)
+            job = self.target(fn, image_scale(image_style(opts)[0]))
+            if job is not None and self.from_cache(job) is None:
+                jobs.append(job)
+        if not jobs:
+            return
+
+        unique = {}		# key for PDF contents and scale: jobs for it
+        for job in jobs:
+            unique.setdefault(job['key'] or self.key(job['pdf'], job['dim']), []).append(job)
+        todo = [same[0] for same in unique.values()]
+        nproc = min(self.processes or multiprocessing.cpu_count(), len(todo))
+        if multiprocessing.current_process().daemon:	# e.g. in a batch worker, which can't start a pool
+            nproc = 1
+        print("[imageconvert] Converting %d PDF files to PNG, using %d processes" % (len(todo), nproc))
+        if nproc > 1:
+            with multiprocessing.Pool(nproc) as pool:
+                results = pool.map(convert_pdf, todo, chunksize=1)
+        else:
+            results = [convert_pdf(job) for job in todo]
+
+        for same, fnset in zip(unique.values(), results):
+            self.finish(same[0], fnset)
+            for job in same[1:]:		# copies of the same PDF file
+                for src, dst in zip(fnset, png_names(job['png'], len(fnset))):
+                    shutil.copy(src + '.png', dst + '.png')
+                self.reused.append(job['pdf'])
+
+    def summary(self):
+        return "%d PDF files converted, %d reused" % (len(self.converted), len(self.reused))
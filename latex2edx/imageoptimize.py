@@ -0,0 +1,181 @@
+'''
+Responsive, recompressed variants of course images.
+
+Figures are often much larger (e.g. 4000 pixel wide screenshots) than the
+width they are shown at, and learners (e.g. on mobile) download them in full.
+When image optimisation is on, MyRenderer.fix_image puts into the static
+directory, for each PNG or JPEG image:
+
+  - the image itself, with PNG images recompressed losslessly (if smaller)
+  - variants scaled down to the width the image is shown at, and to twice
+    that (for high density screens), if smaller than the image
+  - optionally, WebP versions of all of these (lossless for PNG images)
+
+and the <img> gets srcset and sizes attributes listing them, so that browsers
+download the smallest image good enough for the screen; WebP versions are
+given by a <source> in a <picture>.  Browsers without srcset support use the
+src, which is the (recompressed) full size image, as before.
+
+The files made are kept in a cache directory, keyed by a hash of the image
+contents, the width shown, and the settings, so an unchanged figure is only
+processed once.  Needs Pillow; without it, images are copied as they are.
+'''
+
+import atexit
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from .imageconvert import replace_file
+
+try:
+    from PIL import Image	# needs Pillow
+    from PIL import features as pil_features
+except ImportError:
+    Image = None
+
+OPTIMIZER_VERSION = '1'
+SCALES = (1, 2)		# variants made, as multiples of the width shown
+RASTER_TYPES = {'.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg'}
+
+
+class ImageOptimizer(object):
+    '''
+    Makes recompressed and scaled variants of images, cached by content hash.
+    '''
+
+    def __init__(self, cache_dir='', webp=False, scales=SCALES, jpeg_quality=85, verbose=False):
+        '''
+        cache_dir = directory for the images made; if empty, a temporary directory is used (so not kept between builds)
+        webp      = if True, then also make WebP versions of the images (if Pillow supports WebP)
+        scales    = widths of the variants made, as multiples of the width an image is shown at
+        '''
+        if not cache_dir:
+            cache_dir = tempfile.mkdtemp(prefix='latex2edx_images_')
+            atexit.register(shutil.rmtree, cache_dir, True)
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.cache_dir = cache_dir
+        self.scales = list(scales)
+        self.jpeg_quality = jpeg_quality
+        self.verbose = verbose
+        self.available = Image is not None
+        if not self.available:
+            print("[imageoptimize] Warning: Pillow is not installed, so images are not optimized")
+        elif webp and not pil_features.check('webp'):
+            print("[imageoptimize] Warning: Pillow has no WebP support, so no WebP images are made")
+            webp = False
+        self.webp = webp
+        self.noptimized = 0
+        self.nreused = 0
+        self.nbytes_in = 0	# sizes of images optimized
+        self.nbytes_out = 0	# sizes of the full size images made from them
+
+    def settings(self):
+        return [OPTIMIZER_VERSION, self.available, self.scales, self.webp, self.jpeg_quality]
+
+    def key(self, fn, width):
+        sha = hashlib.sha1()
+        with open(fn, 'rb') as fp:
+            for data in iter(lambda: fp.read(1 << 20), b''):
+                sha.update(data)
+        sha.update(json.dumps([self.settings(), width]).encode('utf8'))
+        return sha.hexdigest()
+
+    def optimize(self, fn, width):
+        '''
+        Make the variants of image file fn, for showing it width pixels wide.  Returns dict with the key
+        (content hash) and list of files made, each [path, name, pixel width, mime type], where name is
+        for the static directory, and the first file is the full size image (with the name of fn).
+        Returns None if the image is not optimized (not PNG or JPEG, Pillow is missing, or it failed).
+        '''
+        if not self.available or os.path.splitext(fn)[1].lower() not in RASTER_TYPES:
+            return None
+        key = self.key(fn, width)
+        outdir = os.path.join(self.cache_dir, key)
+        entryfn = os.path.join(outdir, 'variants.json')
+        if os.path.exists(entryfn):
+            with open(entryfn) as fp:
+                entry = json.load(fp)
+            if all(os.path.exists(x[0]) for x in entry['files']):
+                self.nreused += 1
+                return entry
+        try:
+            files = self.make_variants(fn, width, outdir)
+        except Exception as err:
+            print("[imageoptimize] Error!  Cannot optimize image %s, so copying it as is, err=%s" % (fn, err))
+            return None
+        entry = {'key': key, 'files': files}
+
+        def write_entry(tmpfn):
+            with open(tmpfn, 'w') as fp:
+                json.dump(entry, fp)
+        replace_file(entryfn, write_entry)
+        self.noptimized += 1
+        self.nbytes_in += os.path.getsize(fn)
+        self.nbytes_out += os.path.getsize(files[0][0])
+        if self.verbose:
+            print("[imageoptimize] %s -> %s" % (fn, [x[1] for x in files]))
+        return entry
+
+    def make_variants(self, fn, width, outdir):
+        '''
+        Make the variants of image file fn in directory outdir; returns list of files, as for optimize.
+        '''
+        if not os.path.exists(outdir):
+            os.makedirs(outdir)
+        name = os.path.basename(fn)
+        stem, ext = os.path.splitext(name)
+        mime = RASTER_TYPES[ext.lower()]
+        img = Image.open(fn)
+        img.load()
+
+        full = os.path.join(outdir, name)
+        if mime == 'image/png':		# recompress losslessly, keeping the result only if smaller
+            info = dict((k, img.info[k]) for k in ['transparency', 'icc_profile', 'dpi'] if k in img.info)
+            replace_file(full, lambda tmpfn: self.recompress(img, fn, tmpfn, info))
+        else:
+            replace_file(full, lambda tmpfn: shutil.copyfile(fn, tmpfn))
+        files = [[full, name, img.width, mime]]
+
+        if img.mode not in ('RGB', 'RGBA', 'L'):	# e.g. palette images, which can't be scaled smoothly
+            img = img.convert('RGBA' if 'transparency' in img.info or 'A' in img.mode else 'RGB')
+        for w in sorted(set(int(width * scale) for scale in self.scales)):
+            if w <= 0 or w >= img.width * 0.9:		# no smaller than the full size image
+                continue
+            small = img.resize((w, max(1, int(round(img.height * w / img.width)))), Image.LANCZOS)
+            vname = '%s-%dw%s' % (stem, w, ext)
+            replace_file(os.path.join(outdir, vname), lambda tmpfn: self.save(small, tmpfn, mime))
+            files.append([os.path.join(outdir, vname), vname, w, mime])
+
+        if self.webp:
+            for (path, vname, w, vmime) in list(files):
+                wname = os.path.splitext(vname)[0] + '.webp'
+                replace_file(os.path.join(outdir, wname),
+                             lambda tmpfn: Image.open(path).save(tmpfn, 'WEBP', lossless=(mime == 'image/png'),
+                                                                 quality=self.jpeg_quality))
+                files.append([os.path.join(outdir, wname), wname, w, 'image/webp'])
+        return files
+
+    @staticmethod
+    def recompress(img, fn, tmpfn, info):
+        '''
+        Save PNG image img (read from file fn) losslessly recompressed to tmpfn, or copy fn there if that is smaller.
+        '''
+        img.save(tmpfn, 'PNG', optimize=True, **info)
+        if os.path.getsize(tmpfn) >= os.path.getsize(fn):
+            shutil.copyfile(fn, tmpfn)
+
+    def save(self, img, fn, mime):
+        if mime == 'image/png':
+            img.save(fn, 'PNG', optimize=True)
+        else:
+            if img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            img.save(fn, 'JPEG', quality=self.jpeg_quality, optimize=True, progressive=True)
+
+    def summary(self):
+        return "%d images optimized (%d -> %d bytes at full size), %d reused" % (
+            self.noptimized, self.nbytes_in, self.nbytes_out, self.nreused)
@@ -8,9 +8,8 @@ import re
 import py_compile
 import sys
 import tempfile
-import urllib.request, urllib.parse, urllib.error
+import urllib.parse
 from . import xbundle
-import pkg_resources
 
 try:
     from collections import OrderedDict
@@ -23,9 +22,16 @@ except Exception as err:
     from path import Path as path
 
 from lxml import etree
-from .plastexit import plastex2xhtml
-from .course_tests import AnswerBoxUnitTest, CourseUnitTestSet
-from .abox import split_args_with_quoted_strings
+from .xmlfilters import tag_filter, FilterDispatcher
+from .profiling import BuildProfiler
+from .buildcache import BuildCache, input_dependencies
+from .urlnames import UrlNameRegistry
+from .filewriter import FileWriter, TarWriter
+from .assetsync import AssetSync
+from .xbundlediff import unchanged_units
+
+# plastexit (plasTeX), course_tests (yaml) and abox are imported where needed,
+# to keep start-up fast for command line uses which do not convert LaTeX.
 
 # from logging import Logger
 
@@ -94,6 +100,9 @@ class latex2edx(object):
     DescriptorTags = ['course', 'chapter', 'sequential', 'vertical', 'html', 'problem', 'video',
                       'conditional', 'combinedopenended', 'randomize', 'discussion', 'lti']
 
+    AttribStringTags = ['problem', 'chapter', 'sequential', 'vertical', 'course', 'html', 'video',
+                        'discussion', 'edxdndtex', 'conditional', 'lti', 'split_test']
+
     def __init__(self,
                  fn,
                  fp=None,
@@ -119,35 +128,94 @@ class latex2edx(object):
                  add_timestamp=False,
                  timestamp_revision="",
                  timestamp_threshold=10,
+                 profile=False,
+                 build_cache='',
+                 render_processes=0,
+                 xmllint=False,
+                 jobs=1,
+                 output_tarball='',
+                 delta_from='',
+                 image_cache='',
+                 image_processes=0,
+                 optimize_images=False,
+                 webp_images=False,
                  ):
         '''
-        extra_xml_filters = list of functions acting on XML, applied to XHTML
+        extra_xml_filters = list of functions acting on XML, applied to XHTML.
+                            Functions decorated with tag_filter act on single elements,
+                            and are applied in the same tree walk as the built-in filters.
 
         output_cutset = `str` : set to filename to store output course unit tests for answer boxes.  These tests can be run using edxcut.
+
+        profile = `bool` : if True, record time and memory used by each stage and filter, in self.profiler (a BuildProfiler)
+
+        build_cache = `str` : directory for the incremental build cache; if given, only chapters changed since the
+                      last build are rendered by plastex, and unchanged course files are not written again.
+
+        render_processes = `int` : if > 1, render the chapters of the document in parallel, using this many processes.
+
+        xmllint = `bool` : if True, format the XML files written by running xmllint, as done by earlier versions
+                  (the output is the same, but slower).
+
+        jobs = `int` : number of threads used to write the course files (e.g. 8 or more for network filesystems).
+
+        output_tarball = `str` : if given, write the course files into this compressed tar archive (e.g. course.tar.gz,
+                         for import into Open edX), instead of to output_dir.  Images (and other files made by external
+                         tools) are still made in output_dir/static, and added to the archive.
+
+        delta_from = `str` : xbundle file saved by the previous build into output_dir (e.g. the output xbundle file itself,
+                     which is read before being replaced); descriptors whose content and parent are the same as in it
+                     are not formatted and written again, if their files are still there.
+
+        image_cache = `str` : directory for caching PNG images converted from PDF figures, keyed by the PDF contents
+                      (defaults to the images directory of the build cache, if using one).
+
+        image_processes = `int` : number of processes for converting PDF figures to PNG in parallel (0 for one per CPU).
+
+        optimize_images = `bool` : if True, then recompress PNG images losslessly, and make variants of images scaled to
+                          the width shown (and twice that), given in srcset; cached in the image cache (needs Pillow).
+
+        webp_images = `bool` : if True (with optimize_images), then also make WebP variants of images.
         '''
+        self.profiler = BuildProfiler(enabled=profile)
+
+        self.source_files = []		# files read by the XML filters, e.g. for \edXinclude
+        self.build_cache = None
+        if build_cache and output_cutset:
+            print("[latex2edx] Not using build cache, since course unit tests need all answer boxes to be rendered")
+        elif build_cache:
+            self.build_cache = BuildCache(build_cache, verbose=verbose)
 
         if not output_dir:
             output_dir = os.path.abspath('.')
         self.output_dir = path(output_dir)
         imdir = self.output_dir / 'static/images'
+        self.assets = AssetSync(verbose=verbose)	# copies images etc. to static, once per build
 
         if do_images:  # make directories only if do_images
-            if not os.path.exists(self.output_dir):
-                os.mkdir(self.output_dir)
-            if not os.path.exists(self.output_dir / 'static'):
-                os.mkdir(self.output_dir / 'static')
-            if not os.path.exists(imdir):
-                os.mkdir(imdir)
+            self.assets.mkdir(imdir)
 
+        if not image_cache and self.build_cache is not None:
+            image_cache = self.build_cache.dir / 'images'
+
+        from .plastexit import plastex2xhtml
         self.p2x = plastex2xhtml(fn, fp=fp, extra_filters=extra_filters,
                                  latex_string=latex_string,
                                  add_wrap=add_wrap,
                                  verbose=verbose,
                                  imdir=imdir,
                                  imurl=imurl,
+                                 profiler=self.profiler,
+                                 build_cache=self.build_cache,
+                                 render_processes=render_processes,
+                                 image_cache=image_cache,
+                                 image_processes=image_processes,
+                                 assets=self.assets,
+                                 optimize_images=optimize_images,
+                                 webp_images=webp_images,
                                  )
-        self.p2x.convert()
-        self.xhtml = self.p2x.xhtml
+        with self.profiler.measure('plastex2xhtml'):
+            self.p2x.convert()
         self.do_merge = do_merge
         self.update_policy = update_policy
         self.suppress_policy = suppress_policy
@@ -163,6 +231,20 @@ class latex2edx(object):
         self.add_timestamp = add_timestamp
         self.timestamp_revision = timestamp_revision
         self.timestamp_threshold = timestamp_threshold
+        self.xmllint = xmllint
+        self.jobs = jobs
+        self.output_tarball = output_tarball
+        self.delta_from = delta_from
+        if output_tarball:
+            if do_merge:
+                print("[latex2edx] Not merging chapters into existing course, since writing tar archive")
+                self.do_merge = False
+            if delta_from:
+                print("[latex2edx] Exporting all descriptors, since writing tar archive")
+                self.delta_from = ''
+            self.writer = TarWriter(output_tarball, self.output_dir, static_dirs=['static', 'policies'])
+        else:
+            self.writer = FileWriter(jobs, hashes=self.output_hashes)	# shared by all files written, for the manifest
 
         if output_fn is None or not output_fn:
             if fn.endswith('.tex'):
@@ -183,7 +265,7 @@ class latex2edx(object):
                             self.process_showhide,
                             self.process_edxxml,
                             self.process_dndtex,  # must come before process_include
-                            self.process_include,
+                            self.process_include,  # barrier: included XML is seen by later filters
                             self.process_includepy,
                             self.process_video,
                             self.process_lti,
@@ -201,7 +283,7 @@ class latex2edx(object):
         if self.output_cutset:
             self.fix_filters.append(self.generate_course_unit_tests)
 
-        self.URLNAMES = []
+        self.URLNAMES = UrlNameRegistry()	# url_names in use, shared with the XBundle exporters
 
     def save_xml(self):
         '''
@@ -216,7 +298,8 @@ class latex2edx(object):
         Also save the initial XML as the xbundle file
         '''
         self.save_xml()
-        xb = xbundle.XBundle(force_studio_format=(not self.suppress_verticals), keep_urls=True)
+        xb = xbundle.XBundle(force_studio_format=(not self.suppress_verticals), keep_urls=True,
+                             url_names=self.URLNAMES, xmllint=self.xmllint, writer=self.writer)
         xb.dir = self.output_dir
 
         tags = ['sequential', 'problem', 'html', 'video']
@@ -228,8 +311,8 @@ class latex2edx(object):
             nhtml = len(seq.findall('.//html'))
             print("--> exporting sequential %s (%d problem, %d html)" % (seq.get('display_name', '<unknown display_name>'),
                                                                          nprob, nhtml))
-            xb.add_descriptors(seq)
             xb.export_xml_to_directory(seq, dowrite=True)
+        xb.writer.wait()
 
     def export_units_only(self):
         '''
@@ -237,7 +320,8 @@ class latex2edx(object):
         Also save the initial XML as the xbundle file
         '''
         self.save_xml()
-        xb = xbundle.XBundle(force_studio_format=(not self.suppress_verticals), keep_urls=True)
+        xb = xbundle.XBundle(force_studio_format=(not self.suppress_verticals), keep_urls=True,
+                             url_names=self.URLNAMES, xmllint=self.xmllint, writer=self.writer)
         xb.dir = self.output_dir
 
         tags = ['problem', 'html', 'video']
@@ -250,28 +334,66 @@ class latex2edx(object):
                                                              self.get_filename_and_linenum(unit),
                                                              unit.get('url_name', '<unknown>'),
                                                              ))
-                xb.add_descriptors(unit)
                 xb.export_xml_to_directory(unit, dowrite=True)
+        xb.writer.wait()
+
+    @property
+    def output_hashes(self):
+        '''
+        dict of hashes of course files written by the last build, if using the build cache, else None
+        '''
+        if self.build_cache is None:
+            return None
+        return self.build_cache.output_hashes
+
+    def save_output_hashes(self):
+        if self.build_cache is not None:
+            self.build_cache.save_output_hashes()
+
+    def watched_files(self):
+        '''
+        Return list of the source files used by the last conversion: the tex file, files it \\input's,
+        images, and files included by \\edXinclude, \\edXincludepy, and \\edXdndtex.
+        '''
+        files = [self.p2x.input_fn]
+        if self.p2x.latex_string is not None:
+            files += [dep[0] for dep in input_dependencies(self.p2x.latex_string)]
+        for imfn in self.p2x.renderer.imfnset:
+            files.append(imfn)
+            pdffn = re.sub(r'(-\d+)?\.png$', '.pdf', imfn)	# png images may be made from pdf files
+            if pdffn != imfn and os.path.exists(pdffn):
+                files.append(pdffn)
+        files += self.source_files
+        return list(OrderedDict.fromkeys(files))
+
+    @property
+    def xhtml(self):
+        return self.p2x.xhtml
 
     @property
     def xml(self):
         '''
-        Compute our XML representation by parsing the XHTML from plastex into XML, then running it through
-        all the fix_filters.
+        Compute our XML representation from the XHTML from plastex (rendered directly to XML, or parsed),
+        then run it through all the fix_filters.
 
         Cache result, so we only do the computation once.
 
         Returns a string (giving the filter-processed XML representation)
         '''
         if self.the_xml is None:
+            xml = self.p2x.xml	# rendered directly to XML, if possible
             try:
-                xml = etree.fromstring(self.xhtml)
+                if xml is None:
+                    with self.profiler.measure('parse xhtml'):
+                        xml = etree.fromstring(self.xhtml)
             except Exception as err:
                 print(("Error!  Failed to convert xhtml string into proper XML, err=%s" % str(err)))
                 print(("xhtml string = %s" % self.xhtml))
                 raise
-            for filter in self.fix_filters:
-                filter(xml)
+            self.ncustom_html = 0	# counted by process_custom_html
+            with self.profiler.measure('fix_filters'):
+                FilterDispatcher(self.fix_filters, profiler=self.profiler).run(xml)
+            print(("Processed %s custom HTML stanzas" % self.ncustom_html))
             self.the_xml = xml
         return self.the_xml
 
@@ -280,38 +402,100 @@ class latex2edx(object):
         Convert xhtml to xbundle and then xbundle to directory of XML files.
         if self.do_merge then do not overwrite course files; attempt to merge them.
         '''
+        try:
+            return self.convert_output()
+        finally:
+            self.writer.shutdown()		# stop the writer threads, however the build ended
+            self.profiler.stop()		# and memory tracing, if profiling
+
+    def convert_output(self):
         if self.section_only and self.xml_only:
             print("Saving XML to file %s" % self.output_fn)
             return self.save_xml()
 
         if self.section_only:
             # if section_only then only export edXsections (sequentials)
-            return self.export_sections_only()
+            with self.profiler.measure('export sections'):
+                self.export_sections_only()
+            self.finish_output()
+            return self.save_output_hashes()
 
         if self.units_only:
-            return self.export_units_only()
+            with self.profiler.measure('export units'):
+                self.export_units_only()
+            self.finish_output()
+            return self.save_output_hashes()
 
         self.xhtml2xbundle()
-        self.xb.save(self.output_fn)
+        previous = None
+        if self.delta_from and not self.xml_only:
+            previous = self.load_previous_xbundle()
+        with self.profiler.measure('save xbundle'):
+            self.xb.save(self.output_fn)
         print("xbundle generated (%s): " % self.output_fn)
+        if previous is not None:
+            with self.profiler.measure('delta from previous xbundle'):
+                self.set_unchanged_units(previous)
         tags = ['chapter', 'sequential', 'problem', 'html', 'video', 'lti']
         for tag in tags:
             print("    %s: %d" % (tag, len(self.xb.course.findall('.//%s' % tag))))
         if self.xml_only:
             print("Saved xbundle XML to file %s" % self.output_fn)
             return
-        self.xb.export_to_directory(self.output_dir, xml_only=True)
-        print("Course exported to %s/" % self.output_dir)
-
+        with self.profiler.measure('export to directory'):
+            self.xb.export_to_directory(self.output_dir, xml_only=True)
         if self.do_merge and self.xb.overwrite_files:
             self.merge_course()
+        self.finish_output()
+        self.save_output_hashes()
+
+    def load_previous_xbundle(self):
+        '''
+        Return the course of the xbundle file self.delta_from, or None if there is no such file.
+        '''
+        if not os.path.exists(self.delta_from):
+            print("[latex2edx] No previous xbundle %s, so exporting all descriptors" % self.delta_from)
+            return None
+        with open(self.delta_from, 'rb') as fp:
+            return etree.parse(fp).getroot().find('course')
+
+    def set_unchanged_units(self, previous):
+        '''
+        Set the descriptors of self.xb which need not be exported again, since they are the same as
+        in course previous, as read from its xbundle file (and so compared with the new xbundle file,
+        as read back, with the same formatting).
+        '''
+        with open(self.output_fn, 'rb') as fp:
+            course = etree.parse(fp).getroot().find('course')
+        xb = self.xb
+        xb.unchanged_units = unchanged_units(previous, course, descriptor_tags=xb.DescriptorTags,
+                                             keep_together_tags=xb.KeepTogetherTags,
+                                             force_studio_format=xb.force_studio_format)
+        print("    %d descriptors unchanged since %s" % (len(xb.unchanged_units), self.delta_from))
+
+    def finish_output(self):
+        '''
+        Write manifest.json, giving the sha1 hash and source location of each file written, and
+        finish writing the course files (and the tar archive, if used).
+        '''
+        self.writer.write_manifest(self.output_dir / 'manifest.json', self.output_dir)
+        self.writer.close()
+        if self.output_tarball:
+            print("Course written to tar archive %s" % self.output_tarball)
+        else:
+            print("Course exported to %s/" % self.output_dir)
+        print("    %d files written, %d unchanged files not rewritten" % (self.writer.nwritten,
+                                                                           self.writer.nunchanged))
+        print("    %s" % self.assets.summary())
+        if self.p2x.image_optimizer is not None:
+            print("    %s" % self.p2x.image_optimizer.summary())
 
     def merge_course(self):
         print("    merging files %s" % self.xb.overwrite_files)
         for fn in self.xb.overwrite_files:
             if str(fn).endswith('course.xml.new'):
                 # course.xml shouldn't need merging
-                os.unlink(fn)
+                self.writer.remove(fn)
             else:
                 with open(fn) as cfp:
                     newcourse = etree.parse(cfp).getroot()
@@ -326,8 +510,9 @@ class latex2edx(object):
                     oldcourse.append(chapter)  # wasn't in old course, move it there
                     newchapters.append(chapter.get('url_name'))
                 self.xb.write_xml_file(oldfn, oldcourse, force_overwrite=True)
-                os.unlink(fn)
+                self.writer.remove(fn)
                 print("    added new chapters %s" % newchapters)
+        self.xb.writer.wait()
 
     def xhtml2xbundle(self):
         '''
@@ -337,7 +522,8 @@ class latex2edx(object):
         xml = self.xml
         no_overwrite = ['course'] if self.do_merge else []
         xb = xbundle.XBundle(force_studio_format=(not self.suppress_verticals), keep_urls=True,
-                             no_overwrite=no_overwrite)
+                             no_overwrite=no_overwrite, url_names=self.URLNAMES,
+                             xmllint=self.xmllint, writer=self.writer)
         xb.KeepTogetherTags = ['sequential', 'vertical', 'conditional']
         course = xml.find('.//course')
         if course is not None:
@@ -387,7 +573,7 @@ class latex2edx(object):
             policydir = self.output_dir / 'policies' / semester
             if not policydir.exists():
                 print("--> Creating directory %s" % policydir)
-                os.system('mkdir -p "%s"' % policydir)
+                self.assets.mkdir(policydir)
             policyfile = policydir / 'policy.json'
             if not policyfile.exists():
                 print("--> No existing policy.json, creating default")
@@ -437,62 +623,93 @@ class latex2edx(object):
                 for sequential in chapter.findall('.//sequential'):
                     suppress_policy_settings(sequential)
 
-    @staticmethod
-    def fix_table(tree):
+    @tag_filter('table')
+    def fix_table(self, table):
         '''
         Force tables to have table-layout: auto, no borders on table data
         '''
-        for table in tree.findall('.//table'):
-            table.set('style', 'table-layout:auto')
-            for td in table.findall('.//td'):
-                newstyle = td.get('style', '')
-                if newstyle:
-                    newstyle += '; '
-                newstyle += 'border:none'
-                td.set('style', newstyle)
+        table.set('style', 'table-layout:auto')
+        for td in table.findall('.//td'):
+            newstyle = td.get('style', '')
+            if newstyle:
+                newstyle += '; '
+            newstyle += 'border:none'
+            td.set('style', newstyle)
 
-    @staticmethod
-    def fix_table_p(tree):
+    @tag_filter('table')
+    def fix_table_p(self, table):
         '''
         Force "tabular" tables to not have <p> as top-level within <td>.
         Those <p> mess up table spacing.
         '''
-        for table in tree.findall('.//table[@class="tabular"]'):
-            for td in table.findall('.//td'):
-                if not len(td):
-                    continue
-                tdtop = td[0]
-                if tdtop.tag == 'p':
-                    for elem in tdtop:
-                        tdtop.addprevious(elem)
-                td.text = (td.text or '') + tdtop.text
-                td.remove(tdtop)
+        if table.get('class') != 'tabular':
+            return
+        for td in table.findall('.//td'):
+            if not len(td):
+                continue
+            tdtop = td[0]
+            if tdtop.tag == 'p':
+                for elem in tdtop:
+                    tdtop.addprevious(elem)
+            td.text = (td.text or '') + tdtop.text
+            td.remove(tdtop)
 
-    @staticmethod
-    def fix_latex_minipage_div(tree):
+    @tag_filter('div')
+    def fix_latex_minipage_div(self, div):
         '''
         latex minipages turn into things like <div style="width:216.81pt" class="minipage">...</div>
         but inline math inside does not render properly.  So change div to text.
         '''
-        for div in tree.findall('.//div[@class="minipage"]'):
+        if div.get('class') == 'minipage':
             div.tag = 'text'
 
-    def set_tmploc(self, tree, locstr):
+    @staticmethod
+    def index_ref_elements(tree, containers, locs):
         '''
-        Create a tmploc attribute (if none exists) for the elements:
+        Find, in one traversal, the elements:
           tocref, toclabel, ref, label, index,
           table class="equation", table class="eqnarray",
           div class="figure"
-        so as to later be able to reference these items by addressing their
-        location.
+        and record the location of each in locs (dict of element: location
+        string), so as to later be able to reference these items by addressing
+        their location.  An element's location is that of its nearest ancestor
+        in containers (chapters, sequentials, verticals, and the course),
+        unless locs already has one for it (section header labels).
+
+        Returns dict of lists of the elements found, in document order, keyed
+        by 'tocref', 'label' (labels and toclabels), 'ref', 'index', 'equation',
+        and 'figure'.
+        '''
+        found = dict((key, []) for key in ['tocref', 'label', 'ref', 'index', 'equation', 'figure'])
+        for elem in tree.iter('tocref', 'toclabel', 'label', 'ref', 'index', 'table', 'div'):
+            key = elem.tag
+            if key == 'table':
+                if elem.get('class') not in ['equation', 'eqnarray']:
+                    continue
+                key = 'equation'
+            elif key == 'div':
+                if elem.get('class') != 'figure':
+                    continue
+                key = 'figure'
+            elif key == 'toclabel':
+                key = 'label'
+            found[key].append(elem)
+            if elem not in locs:
+                for parent in elem.iterancestors():
+                    if parent in containers:
+                        locs[elem] = containers[parent]
+                        break
+        return found
+
+    @staticmethod
+    def in_tree(elem, tree):
+        '''
+        Return True if elem has not been removed from tree (directly, or with an ancestor).
         '''
-        for elem in tree.xpath('.//tocref|.//toclabel|.//label|'
-                               './/table[@class="equation"]|'
-                               './/table[@class="eqnarray"]|'
-                               './/div[@class="figure"]|'
-                               './/ref|.//index'):
-            if elem.get('tmploc') is None:
-                elem.set('tmploc', locstr)
+        top = elem
+        for top in elem.iterancestors():
+            pass
+        return top is tree
 
     def handle_refs(self, tree):
         '''
@@ -509,9 +726,12 @@ class latex2edx(object):
         if course is None:
             return
         cnumber = course.get('number')
-        # EVH: Navigate course and set a 'tmploc' attribute with location for desired items
+        # EVH: Navigate course and record locations of the chapters, sequentials and verticals,
+        # from which to get the location for desired items
         maplist = []  # ['loc. str.']
         mapdict = {}  # {'location str.':['URL','display_name','refnum']}
+        containers = {}  # {element: 'loc. str.'}
+        locs = {}  # {element: 'loc. str.'} for desired items
         chapnum = 0
         chapref = seqref = vertref = '0'
         for chapter in tree.findall('.//chapter'):
@@ -530,7 +750,7 @@ class latex2edx(object):
                 chapter.find('./p/toclabel'), chapter.find('./toclabel')]
             for label in labels:
                 if label is not None:
-                    label.set('tmploc', locstr + '.0')
+                    locs[label] = locstr + '.0'
             seqnum = 0
             for child1 in chapter:
                 if child1.tag == 'p' and (child1.find('./') is not None):
@@ -554,7 +774,7 @@ class latex2edx(object):
                     seq.find('./p/toclabel'), seq.find('./toclabel')]
                 for label in labels:
                     if label is not None:
-                        label.set('tmploc', locstr + '.0')
+                        locs[label] = locstr + '.0'
                 if seqnum == 1:
                     mapdict['{}'.format(chapnum)][0] = (
                         '{}/{}/1'.format(chapurl, sequrl))
@@ -581,20 +801,21 @@ class latex2edx(object):
                         vert.find('./p/toclabel'), vert.find('./toclabel')]
                     for label in labels:
                         if label is not None:
-                            label.set('tmploc', locstr + '.0')
-                    self.set_tmploc(vert, locstr)
+                            locs[label] = locstr + '.0'
+                    containers[vert] = locstr
                 locstr = '.'.join(locstr.split('.')[:-1])
-                self.set_tmploc(seq, locstr)
+                containers[seq] = locstr
             locstr = '.'.join(locstr.split('.')[:-1])
-            self.set_tmploc(chapter, locstr)
-        # EVH 01-13-15: tmploc assignment added at course level
-        self.set_tmploc(course, '0')
+            containers[chapter] = locstr
+        # EVH 01-13-15: location assignment added at course level
+        containers[course] = '0'
         mapdict['0'] = ['#', cnumber, '0']
+        found = self.index_ref_elements(tree, containers, locs)
         # EVH: Handle figure references. Search for labels and build dictionary
         figdict = {}  # {'figlabel':'fignum'}
         figattrib = {}  # {'figlabel':{'attrib':'value'}}
-        for fig in tree.findall('.//div[@class="figure"]'):
-            locstr = fig.attrib.pop('tmploc')
+        for fig in found['figure']:
+            locstr = locs[fig]
             # Retrieve Figure number if it is captioned
             caption = fig.find('.//div[@class="caption"]/b')
             if caption is not None:
@@ -650,8 +871,8 @@ class latex2edx(object):
         tocrefdict = {}  # {'tocref':[['locstr'],['parent name']]}
         labelcnt = {}  # {'labeltag':cnt}
         chapref = '0'
-        for label in tree.xpath('.//label|//toclabel'):
-            locstr = label.get('tmploc')
+        for label in [x for x in found['label'] if self.in_tree(x, tree)]:
+            locstr = locs.get(label)
             if not locstr:
                 continue
             if locstr.split('.')[-1] == '0':
@@ -701,9 +922,10 @@ class latex2edx(object):
                 plabel = plabel.getparent()
             plabel.text = ptext
             plabel.remove(label)
-        for tocref in tree.findall('.//tocref'):
+        taglists = []
+        for tocref in [x for x in found['tocref'] if self.in_tree(x, tree)]:
             tagref = tocref.text
-            locstr = tocref.get('tmploc')
+            locstr = locs.get(tocref)
             paref = tocref.getparent()
             paref.text += tocref.tail
             paref.remove(tocref)
@@ -742,10 +964,11 @@ class latex2edx(object):
                 taglist = etree.Element('p', id='taglist', tmploc=locstr,
                                         tags=tagref)
                 paref.insert(0, taglist)
+                taglists.append(taglist)
             else:
                 taglist.set('tags', taglist.get('tags') + ',' + tagref)
         # EVH: Parse taglist to create ToC button links at the top of each vert
-        for taglist in tree.findall(".//p[@id='taglist']"):
+        for taglist in taglists:
             locstr = taglist.get('tmploc')
             tags = taglist.get('tags').split(',')
             for tocref in tags:
@@ -877,14 +1100,10 @@ class latex2edx(object):
             tocbody.append(toctable)
         if len(tocdict) != 0:
             print("Writing ToC index content...")
-            if not os.path.exists(self.output_dir):
-                os.mkdir(self.output_dir)
-            if not os.path.exists(self.output_dir / 'tabs'):
-                os.mkdir(self.output_dir / 'tabs')
-            tocf = open(self.output_dir / 'tabs' / 'tocindex.html', 'w')
-            tocf.write(etree.tostring(
-                toctree, method='html', pretty_print=True).decode())
-            tocf.close()
+            self.writer.mkdir(self.output_dir / 'tabs')
+            self.writer.write(self.output_dir / 'tabs' / 'tocindex.html',
+                              etree.tostring(toctree, method='html', pretty_print=True),
+                              source=self.p2x.input_fn)
 
         class MissingLabel(Exception):
             '''
@@ -917,10 +1136,9 @@ class latex2edx(object):
         eqnattrib = {}  # {'eqnlabel':{'attrib':'value'}}
         chapref = '0'
         eqncnt = 0
-        for table in tree.xpath('.//table[@class="equation"]|'
-                                './/table[@class="eqnarray"]'):
-            if 'tmploc' in table.attrib:
-                locstr = table.attrib.pop('tmploc')
+        for table in [x for x in found['equation'] if self.in_tree(x, tree)]:
+            if table in locs:
+                locstr = locs[table]
             if not locstr:
                 continue
             locref = mapdict[locstr][2]
@@ -1005,8 +1223,8 @@ class latex2edx(object):
         # EVH: Build keymap dictionary for keywords specified by the \index
         # command
         keymap = {}  # {keyword: [[URL], [display_name]]}
-        for indexref in tree.findall('.//index'):
-            locstr = indexref.get('tmploc')
+        for indexref in [x for x in found['index'] if self.in_tree(x, tree)]:
+            locstr = locs.get(indexref)
             keyref = indexref.text
             if keyref in keymap:
                 keymap[keyref][0].append(mapdict[locstr][0])
@@ -1018,11 +1236,11 @@ class latex2edx(object):
             p.remove(indexref)
 
         # EVH: Find and replace references everywhere with ref number and link
-        for aref in tree.findall('.//ref'):
+        for aref in [x for x in found['ref'] if self.in_tree(x, tree)]:
             reflabel = aref.text
-            if not 'tmploc' in aref.attrib:
+            if aref not in locs:
                 continue
-            locstr = aref.attrib.pop('tmploc')
+            locstr = locs[aref]
             if self.popup_flag:
                 relurl = ''
             else:
@@ -1055,16 +1273,14 @@ class latex2edx(object):
                            'label: {}'.format(str(referr))))
 
         if len(keymap) != 0:
-            if not os.path.exists(self.output_dir):
-                os.mkdir(self.output_dir)
-            if not os.path.exists(self.output_dir / 'static'):
-                os.mkdir(self.output_dir / 'static')
+            self.writer.mkdir(self.output_dir / 'static')
             print("Writing key_map.json to static/ ...")
-            kwjson = open(self.output_dir / 'static' / 'key_map.json', 'w')
-            kwjson.write(json.dumps(keymap, default=lambda o: o.__dict__))
-            kwjson.close()
+            self.writer.write(self.output_dir / 'static' / 'key_map.json',
+                              json.dumps(keymap, default=lambda o: o.__dict__),
+                              source=self.p2x.input_fn)
 
-    def process_askta(self, tree):
+    @tag_filter('askta')
+    def process_askta(self, askta):
         '''
         add "Ask TA!" links
         arguments are taken as space delimited settings
@@ -1092,101 +1308,101 @@ class latex2edx(object):
                                'url_base': 'https://edx.org',
                                }
 
-        for askta in tree.findall('.//askta'):
-            text = askta.text
-            args = {}
-            if text:
-                argset = split_args_with_quoted_strings(text)
-                try:
-                    args = dict([x.split('=', 1) for x in argset])
-                    for arg in args:
-                        args[arg] = self.stripquotes(args[arg], checkinternal=True)
-                except Exception as err:
-                    print("Error %s" % err)
-                    print("Failed in parsing args to edXaskta = %s" % text)
-                    raise
-                if 'settings' in args:
-                    args.pop('settings')
-                    self.askta_data.update(args)
-                    print("askTA settings updated: %s" % self.askta_data)
-                    # remove this element from xml tree
-                    # self.remove_parent_p(askta)
-                    p = askta.getparent()
-                    p.remove(askta)
-                    if p.tag=='p' and not p.text.strip():	# remove extra <p> if present
-                        pp = p.getparent()
-                        pp.remove(p)
-                    continue
-
-            # generate button link, something like this:
-            #   <input style="float:right" class="check Check" type="button" value="Ask TA!" onclick="SendMail();"/>
-            # <script type="text/javascript">
-            # var amp = String.fromCharCode(38);
-            # function SendMail() {
-            #          var link = "mailto:me@example.com"
-            #             + "?cc=myCCaddress@example.com"
-            #             + amp + "subject=" + escape("This is my subject")
-            #             + amp + "body=";
-            #          window.open(link,'AskTA', "height=500,width=700");
-            # }
-            # </script>
-
-            data = {}
-            data.update(self.askta_data)
-            data.update(args)
-
-            display_name = ''
-            url_name = ''
-            for parent in askta.xpath('ancestor::*')[::-1]:
-                display_name = parent.get('display_name', '')
-                if display_name:
-                    url_name = parent.get('url_name')
-                    break
-
-            data['subject'] = data['subject'].format(name=display_name)
-            data['body'] = data['body'].format(url_name=url_name, **data)
-
-            self.askta_data['cnt'] += 1
-            smfn = 'SendMail_%d' % self.askta_data['cnt']
-
-            askta.tag = 'span'
-            askta.text = ''
-
-            atin = etree.SubElement(askta, 'input')
-            atin.set('style', 'float:right')
-            atin.set('class', 'check Check')
-            atin.set('value', data['label'])
-            atin.set('type', 'button')
-            atin.set('onclick', '%s();' % smfn)
-
-            for attrib in special_attribs:
-                data.pop(attrib)
-
-            atlid = 'aturl_%s' % self.askta_data['cnt']
-            atlink = etree.SubElement(askta, 'a')
-            atlink.set('style', 'display:none')
-            atlink.set('href', '/course/jump_to_id')
-            atlink.set('id', atlid)
-
-            mailto = 'mailto:%s' % data['to']
-            data.pop('to')
-            body = data.pop('body')
-            mailto += '?' + urllib.parse.urlencode(data)
-            mailto += '&' + urllib.parse.urlencode({'body': body})
-
-            jscode = ('\nfunction %s() {\n'
-                      '    var cu = encodeURI(window.location.origin + $("#%s").attr("href"));\n'
-                      '    var link = "%s";\n'
-                      '    link = link.replace("COURSE_URL", cu);\n'
-                      '    link = link.replace(/&/g, String.fromCharCode(38));\n'
-                      '    console.log(link);\n'
-                      '    Logger.log("askta",{link:link});\n'
-                      '    window.open(link, "AskTA", "height=500,width=700"); \n'
-                      '}') % (smfn, atlid, mailto)
-
-            script = etree.SubElement(askta, 'script')
-            script.set('type', 'text/javascript')
-            script.text = jscode
+        text = askta.text
+        args = {}
+        if text:
+            from .abox import split_args_with_quoted_strings
+            argset = split_args_with_quoted_strings(text)
+            try:
+                args = dict([x.split('=', 1) for x in argset])
+                for arg in args:
+                    args[arg] = self.stripquotes(args[arg], checkinternal=True)
+            except Exception as err:
+                print("Error %s" % err)
+                print("Failed in parsing args to edXaskta = %s" % text)
+                raise
+            if 'settings' in args:
+                args.pop('settings')
+                self.askta_data.update(args)
+                print("askTA settings updated: %s" % self.askta_data)
+                # remove this element from xml tree
+                # self.remove_parent_p(askta)
+                p = askta.getparent()
+                p.remove(askta)
+                if p.tag=='p' and not p.text.strip():	# remove extra <p> if present
+                    pp = p.getparent()
+                    pp.remove(p)
+                return
+
+        # generate button link, something like this:
+        #   <input style="float:right" class="check Check" type="button" value="Ask TA!" onclick="SendMail();"/>
+        # <script type="text/javascript">
+        # var amp = String.fromCharCode(38);
+        # function SendMail() {
+        #          var link = "mailto:me@example.com"
+        #             + "?cc=myCCaddress@example.com"
+        #             + amp + "subject=" + escape("This is my subject")
+        #             + amp + "body=";
+        #          window.open(link,'AskTA', "height=500,width=700");
+        # }
+        # </script>
+
+        data = {}
+        data.update(self.askta_data)
+        data.update(args)
+
+        display_name = ''
+        url_name = ''
+        for parent in askta.xpath('ancestor::*')[::-1]:
+            display_name = parent.get('display_name', '')
+            if display_name:
+                url_name = parent.get('url_name')
+                break
+
+        data['subject'] = data['subject'].format(name=display_name)
+        data['body'] = data['body'].format(url_name=url_name, **data)
+
+        self.askta_data['cnt'] += 1
+        smfn = 'SendMail_%d' % self.askta_data['cnt']
+
+        askta.tag = 'span'
+        askta.text = ''
+
+        atin = etree.SubElement(askta, 'input')
+        atin.set('style', 'float:right')
+        atin.set('class', 'check Check')
+        atin.set('value', data['label'])
+        atin.set('type', 'button')
+        atin.set('onclick', '%s();' % smfn)
+
+        for attrib in special_attribs:
+            data.pop(attrib)
+
+        atlid = 'aturl_%s' % self.askta_data['cnt']
+        atlink = etree.SubElement(askta, 'a')
+        atlink.set('style', 'display:none')
+        atlink.set('href', '/course/jump_to_id')
+        atlink.set('id', atlid)
+
+        mailto = 'mailto:%s' % data['to']
+        data.pop('to')
+        body = data.pop('body')
+        mailto += '?' + urllib.parse.urlencode(data)
+        mailto += '&' + urllib.parse.urlencode({'body': body})
+
+        jscode = ('\nfunction %s() {\n'
+                  '    var cu = encodeURI(window.location.origin + $("#%s").attr("href"));\n'
+                  '    var link = "%s";\n'
+                  '    link = link.replace("COURSE_URL", cu);\n'
+                  '    link = link.replace(/&/g, String.fromCharCode(38));\n'
+                  '    console.log(link);\n'
+                  '    Logger.log("askta",{link:link});\n'
+                  '    window.open(link, "AskTA", "height=500,width=700"); \n'
+                  '}') % (smfn, atlid, mailto)
+
+        script = etree.SubElement(askta, 'script')
+        script.set('type', 'text/javascript')
+        script.text = jscode
 
     @staticmethod
     def stripquotes(x, checkinternal=False):
@@ -1220,27 +1436,27 @@ class latex2edx(object):
         print(("Added timestamp to %d html pages (skipped %s)" % (nadd, nskip)))
         print(("    timestamp = '%s'" % stamp))
 
-    def process_edxcite(self, tree):
+    @tag_filter('edxcite')
+    def process_edxcite(self, edxcite):
         '''
         Add citation link visible on mouse hoover.
         '''
         if not hasattr(self, 'edxcitenum'):
             self.edxcitenum = 0
-        for edxcite in tree.findall('.//edxcite'):
-            self.edxcitenum += 1
-            ref = edxcite.get('ref', None)
-            if ref is None or not ref:
-                ref = '[%d]' % self.edxcitenum
-            text = edxcite.text
-            exc = etree.Element('a')
-            edxcite.addnext(exc)
-            sup = etree.SubElement(exc, 'sup')
-            sup.text = ref
-            exc.set('href', '#')
-            exc.set('title', text)
-            # print "  --> %s" % etree.tostring(exc)
-            p = edxcite.getparent()
-            p.remove(edxcite)
+        self.edxcitenum += 1
+        ref = edxcite.get('ref', None)
+        if ref is None or not ref:
+            ref = '[%d]' % self.edxcitenum
+        text = edxcite.text
+        exc = etree.Element('a')
+        edxcite.addnext(exc)
+        sup = etree.SubElement(exc, 'sup')
+        sup.text = ref
+        exc.set('href', '#')
+        exc.set('title', text)
+        # print "  --> %s" % etree.tostring(exc)
+        p = edxcite.getparent()
+        p.remove(edxcite)
 
     @staticmethod
     def remove_parent_p(xml):
@@ -1282,92 +1498,92 @@ class latex2edx(object):
                     p.text = xml.tail
         p.remove(todrop)
 
-    def process_edxxml(self, tree):
+    @tag_filter('edxxml')
+    def process_edxxml(self, edxxml):
         '''
         move content of edXxml into body
         If edXxml is within a <p> then drop the <p>.  This allows edXxml to be used for discussion and video.
         '''
-        for edxxml in tree.findall('.//edxxml'):
-            self.remove_parent_p(edxxml)
+        self.remove_parent_p(edxxml)
 
-    def process_video(self, tree):
+    @tag_filter('video')
+    def process_video(self, video):
         '''
         If the "youtubeid" begins with "http" then make the video an html5 video.
         '''
-        for video in tree.findall('.//video'):
-            ytid = video.get('youtube_id_1_0')
-            if ytid.startswith('http'):
-                video.set('html5_sources', '["%s"]' % ytid)
-                video.set('youtube_id_1_0', '')
-                vsource = etree.Element('source')
-                vsource.set('src', ytid)
-                video.append(vsource)
+        ytid = video.get('youtube_id_1_0')
+        if ytid.startswith('http'):
+            video.set('html5_sources', '["%s"]' % ytid)
+            video.set('youtube_id_1_0', '')
+            vsource = etree.Element('source')
+            vsource.set('src', ytid)
+            video.append(vsource)
 
-    def process_lti(self, tree):
+    @tag_filter('lti')
+    def process_lti(self, lti):
         '''
         For LTI elements, any custom_* attributes should be moved into a special single
         "custom_parameters" attribute.
         '''
-        for lti in tree.findall('.//lti'):
-            cplist = []
-            for key, val in list(lti.attrib.items()):
-                if key.startswith('custom_'):
-                    cplist.append("%s=%s" % (key[7:], val))  # strip "custom_" prefix
-                    lti.attrib.pop(key)
-            if cplist:
-                lti.set('custom_parameters', '[%s]' % ', '.join(['"' + x + '"' for x in cplist]))
-            if self.verbose:
-                print("    lti %s, cp=%s" % (lti, lti.get('custom_parameters')))
+        cplist = []
+        for key, val in list(lti.attrib.items()):
+            if key.startswith('custom_'):
+                cplist.append("%s=%s" % (key[7:], val))  # strip "custom_" prefix
+                lti.attrib.pop(key)
+        if cplist:
+            lti.set('custom_parameters', '[%s]' % ', '.join(['"' + x + '"' for x in cplist]))
+        if self.verbose:
+            print("    lti %s, cp=%s" % (lti, lti.get('custom_parameters')))
 
-    def process_split_test(self, tree):
+    @tag_filter('split_test')
+    def process_split_test(self, st):
         '''
         For split_test elements, take all group_id_to_child<#>=gid attributes and combine them into a dict of the form { '<#>': gid, ...}
         and set JSONified string of that dict as the group_id_to_child attribute value.
         '''
-        for st in tree.findall('.//split_test'):
-            gilist = {}
-            for key, val in list(st.attrib.items()):
-                if key.startswith('group_id_to_child'):
-                    gk = key.split('group_id_to_child')[-1]
-                    gilist[gk] = val
-                    st.attrib.pop(key)
-            if gilist:
-                st.set('group_id_to_child', json.dumps(gilist))
-
-            # remove parent <p> if it exists
-            parent = st.getparent()
-            pp = parent.getparent()
-            if parent.tag == 'p' and not parent.text.strip() and pp is not None:
-                parent.addprevious(st)
-                pp.remove(parent)
+        gilist = {}
+        for key, val in list(st.attrib.items()):
+            if key.startswith('group_id_to_child'):
+                gk = key.split('group_id_to_child')[-1]
+                gilist[gk] = val
+                st.attrib.pop(key)
+        if gilist:
+            st.set('group_id_to_child', json.dumps(gilist))
 
-            if self.verbose:
-                print("    split_test %s, group_id_to_child=%s" % (st, st.get('group_id_to_child')))
+        # remove parent <p> if it exists
+        parent = st.getparent()
+        pp = parent.getparent()
+        if parent.tag == 'p' and not parent.text.strip() and pp is not None:
+            parent.addprevious(st)
+            pp.remove(parent)
 
-    def process_marginote(self, tree):
+        if self.verbose:
+            print("    split_test %s, group_id_to_child=%s" % (st, st.get('group_id_to_child')))
+
+    @tag_filter('marginote')
+    def process_marginote(self, mn):
         '''
         \marginote[options]{note}{anchor text}
         --> <marginote options><desc>note</desc> anchor text</marginote>
         '''
-        for mn in tree.findall('.//marginote'):
-            mn.tag = "span"
-            mn.set('class', "marginote")
-            desc = mn.find(".//desc")
-            if desc is None:
-                raise Exception("Oops, missing note text in marginote=%s" % etree.tostring(mn))
-            desc.tag = "span"
-            desc.set('class', 'marginote_desc')
-            desc.set('style', "display:none")
-            if self.verbose:
-                print(("    marginote %s" % (mn)))
-
-            # insert <script> tag for marginote javascript, if not already in this container
-            par = self.find_container_root(mn, "marginote")
-            if not par.findall('.//script[@src="/static/marginotes.js"]'):
-                par.append(etree.Element("script", 
-                                        {'type': 'text/javascript',
-                                         'src': '/static/marginotes.js'}))
-                self.copy_to_static("marginotes.js", 'marginotes JavaScript')
+        mn.tag = "span"
+        mn.set('class', "marginote")
+        desc = mn.find(".//desc")
+        if desc is None:
+            raise Exception("Oops, missing note text in marginote=%s" % etree.tostring(mn))
+        desc.tag = "span"
+        desc.set('class', 'marginote_desc')
+        desc.set('style', "display:none")
+        if self.verbose:
+            print(("    marginote %s" % (mn)))
+
+        # insert <script> tag for marginote javascript, if not already in this container
+        par = self.find_container_root(mn, "marginote")
+        if not par.findall('.//script[@src="/static/marginotes.js"]'):
+            par.append(etree.Element("script", 
+                                    {'type': 'text/javascript',
+                                     'src': '/static/marginotes.js'}))
+            self.copy_to_static("marginotes.js", 'marginotes JavaScript')
 
     def find_container_root(self, elem, name="current_element"):
         '''
@@ -1394,129 +1610,135 @@ class latex2edx(object):
         Ensure that the static files directory exists.
         '''
         staticdir = self.output_dir / 'static'
-        if not os.path.exists(staticdir):
-            if not os.path.exists(self.output_dir):
-                os.mkdir(self.output_dir)
-            os.mkdir(staticdir)
-        if not os.path.exists(staticdir / resource_fn):
-            l2ejs = pkg_resources.resource_filename(__name__, resource_fn)
-            cmd = 'cp {} {}/'.format(l2ejs, staticdir)
-            print('----> Copying {}: {}'.format(description, cmd))
-            sys.stdout.flush()
-            os.system(cmd)
-
-    def process_showhide(self, tree):
-        for showhide in tree.findall('.//edxshowhide'):
-            desc = showhide.get('description', '')
-            oneup = showhide.getparent()
-            newsh = etree.SubElement(oneup, 'div', {'class': 'hideshowbox'})
-            sub1 = etree.SubElement(newsh, 'h4',
-                                    {'onclick': 'hideshow(this);',
-                                     'style': 'margin: 0px'})
-            sub1.text = desc
-            etree.SubElement(sub1, 'span',
-                             {'class': 'icon-caret-down toggleimage'})
-            newsh.append(showhide)
-            showhide.tag = 'div'  # change edxshowhide tag
-            if 'description' in showhide.attrib:
-                showhide.attrib.pop('description')  # remove description
-            showhide.set('class', 'hideshowcontent')
-            sub2 = etree.SubElement(newsh, 'p',
-                                    {'class': 'hideshowbottom',
-                                     'onclick': 'hideshow(this);',
-                                     'style': 'margin: 0px'})
-            subsub2 = etree.SubElement(sub2, 'a',
-                                       {'href': 'javascript: {return false;}'})
-            subsub2.text = 'Show'
-            try:
-                par = self.find_container_root(newsh, "showhide")
-            except Exception as err:
-                print("Failed to find container root for showhide %s\n --> err: %s" % (etree.tostring(showhide), err))
-                raise
-
-            scriptforsh = etree.Element('SCRIPT',
-                                        {'type': 'text/javascript',
-                                         'src': '/static/latex2edx.js'})
-            styleforsh = etree.Element('LINK',
-                                       {'type': 'text/css',
-                                        'rel': 'stylesheet',
-                                        'href': '/static/latex2edx.css'})
-            if len(par.findall('.//SCRIPT[@src="/static/latex2edx.js"]')) == 0:
-                par.append(scriptforsh)
-                par.append(styleforsh)
-                self.copy_to_static("latex2edx.js", 'showhide JavaScript')
-                self.copy_to_static("latex2edx.css", 'showhide CSS')
+        self.writer.mkdir(staticdir)
+        if str(staticdir / resource_fn) in self.writer.manifest:
+            return
+        if self.writer.keep(staticdir / resource_fn):		# already there (maybe customized), so kept as is
+            return
+        import importlib.resources
+        print('----> Copying {} {} to {}/'.format(description, resource_fn, staticdir))
+        sys.stdout.flush()
+        data = (importlib.resources.files(__package__) / resource_fn).read_bytes()
+        self.writer.write(staticdir / resource_fn, data)
+
+    @tag_filter('edxshowhide')
+    def process_showhide(self, showhide):
+        desc = showhide.get('description', '')
+        oneup = showhide.getparent()
+        newsh = etree.SubElement(oneup, 'div', {'class': 'hideshowbox'})
+        sub1 = etree.SubElement(newsh, 'h4',
+                                {'onclick': 'hideshow(this);',
+                                 'style': 'margin: 0px'})
+        sub1.text = desc
+        etree.SubElement(sub1, 'span',
+                         {'class': 'icon-caret-down toggleimage'})
+        newsh.append(showhide)
+        showhide.tag = 'div'  # change edxshowhide tag
+        if 'description' in showhide.attrib:
+            showhide.attrib.pop('description')  # remove description
+        showhide.set('class', 'hideshowcontent')
+        sub2 = etree.SubElement(newsh, 'p',
+                                {'class': 'hideshowbottom',
+                                 'onclick': 'hideshow(this);',
+                                 'style': 'margin: 0px'})
+        subsub2 = etree.SubElement(sub2, 'a',
+                                   {'href': 'javascript: {return false;}'})
+        subsub2.text = 'Show'
+        try:
+            par = self.find_container_root(newsh, "showhide")
+        except Exception as err:
+            print("Failed to find container root for showhide %s\n --> err: %s" % (etree.tostring(showhide), err))
+            raise
+
+        scriptforsh = etree.Element('SCRIPT',
+                                    {'type': 'text/javascript',
+                                     'src': '/static/latex2edx.js'})
+        styleforsh = etree.Element('LINK',
+                                   {'type': 'text/css',
+                                    'rel': 'stylesheet',
+                                    'href': '/static/latex2edx.css'})
+        if len(par.findall('.//SCRIPT[@src="/static/latex2edx.js"]')) == 0:
+            par.append(scriptforsh)
+            par.append(styleforsh)
+            self.copy_to_static("latex2edx.js", 'showhide JavaScript')
+            self.copy_to_static("latex2edx.css", 'showhide CSS')
+
+    @tag_filter('edxinclude', barrier=True)
+    def process_include(self, include):
+        '''
+        Include XML file.
+        '''
+        self.include_file(include)
+
+    @tag_filter('edxincludepy')
+    def process_includepy(self, include):
+        '''
+        Handle \edXincludepy{script_file.py} inclusion of python scripts.
+        '''
+        self.include_file(include, do_python=True)
 
-    def process_include(self, tree, do_python=False):
+    def include_file(self, include, do_python=False):
         '''
-        Include XML or python file.
+        Include XML or python file, replacing the include element.
 
         For python files, wrap inside <script><![CDATA[ ... ]]></script>
         '''
-        tag = './/edxinclude'
         cmd = 'edXinclude'
         if do_python:
-            tag += 'py'
             cmd += "py"
-        for include in tree.findall(tag):
-            incfn = include.text
-            linenum = include.get('linenum', '<unavailable>')
-            texfn = include.get('filename', '<unavailable>')
-            if incfn is None:
-                print("Error: %s must specify file to include!" % cmd)
-                raise Exception(self.standard_error_msg(include))
-            incfn = incfn.strip()
-            if not os.path.exists(incfn):
-                print("Error: include file %s does not exist!" % incfn)
-                raise Exception(self.standard_error_msg(include))
-            try:
-                with open(incfn) as ifp:
-                    incdata = ifp.read()
-            except Exception as err:
-                print("Error %s: cannot open include file %s to read" % (err, incfn))
-                raise Exception(self.standard_error_msg(include))
-
-            # if python script, then check its syntax
-            if do_python:
-                try:
-                    py_compile.compile(incfn, doraise=True)
-                except Exception as err:
-                    print("Error in python script %s! Err=%s" % (incfn, err))
-                    print("Aborting!")
-                    raise Exception(self.standard_error_msg(include))
+        incfn = include.text
+        linenum = include.get('linenum', '<unavailable>')
+        texfn = include.get('filename', '<unavailable>')
+        if incfn is None:
+            print("Error: %s must specify file to include!" % cmd)
+            raise Exception(self.standard_error_msg(include))
+        incfn = incfn.strip()
+        self.source_files.append(incfn)
+        if not os.path.exists(incfn):
+            print("Error: include file %s does not exist!" % incfn)
+            raise Exception(self.standard_error_msg(include))
+        try:
+            with open(incfn) as ifp:
+                incdata = ifp.read()
+        except Exception as err:
+            print("Error %s: cannot open include file %s to read" % (err, incfn))
+            raise Exception(self.standard_error_msg(include))
 
+        # if python script, then check its syntax
+        if do_python:
             try:
-                if do_python:
-                    incxml = etree.fromstring('<script><![CDATA[\n%s\n]]></script>' % incdata)
-                else:
-                    incxml = etree.fromstring(incdata)
+                py_compile.compile(incfn, doraise=True)
             except Exception as err:
-                print("Error %s parsing XML for include file %s" % (err, incfn))
-                print("See tex file %s line %s" % (texfn, linenum))
+                print("Error in python script %s! Err=%s" % (incfn, err))
+                print("Aborting!")
                 raise Exception(self.standard_error_msg(include))
 
-        # remove parent <p> if it exists
-            parent = include.getparent()
-            pp = parent.getparent()
-            if parent.tag == 'p' and not parent.text.strip() and pp is not None:
-                parent.addprevious(include)
-                pp.remove(parent)
-
-            print("--> including file %s at line %s" % (incfn, linenum))
-            if incxml.tag == 'html' and len(incxml) > 0:  # strip out outer <html> container
-                for k in incxml:
-                    include.addprevious(k)
+        try:
+            if do_python:
+                incxml = etree.fromstring('<script><![CDATA[\n%s\n]]></script>' % incdata)
             else:
-                include.addprevious(incxml)
-            p = include.getparent()
-            if p is not None:
-                p.remove(include)
+                incxml = etree.fromstring(incdata)
+        except Exception as err:
+            print("Error %s parsing XML for include file %s" % (err, incfn))
+            print("See tex file %s line %s" % (texfn, linenum))
+            raise Exception(self.standard_error_msg(include))
 
-    def process_includepy(self, tree):
-        '''
-        Handle \edXincludepy{script_file.py} inclusion of python scripts.
-        '''
-        self.process_include(tree, do_python=True)
+        # remove parent <p> if it exists
+        parent = include.getparent()
+        pp = parent.getparent()
+        if parent.tag == 'p' and not parent.text.strip() and pp is not None:
+            parent.addprevious(include)
+            pp.remove(parent)
+
+        print("--> including file %s at line %s" % (incfn, linenum))
+        if incxml.tag == 'html' and len(incxml) > 0:  # strip out outer <html> container
+            for k in incxml:
+                include.addprevious(k)
+        else:
+            include.addprevious(incxml)
+        p = include.getparent()
+        if p is not None:
+            p.remove(include)
 
     @staticmethod
     def get_filename_and_linenum(elem):
@@ -1528,90 +1750,89 @@ class latex2edx(object):
         msg = "Error processing element %s in %s" % (elem.tag, self.get_filename_and_linenum(elem))
         return msg
 
-    def process_dndtex(self, tree):
+    @tag_filter('edxdndtex')
+    def process_dndtex(self, dndxml):
         '''
         Handle \edXdndtex{dnd_file.tex} inclusion of latex2dnd tex inputs.
         The file may also be a dnd_file.dndspec
         '''
-        tag = './/edxdndtex'
-        for dndxml in tree.findall(tag):
-            dndfn = dndxml.text
-            linenum = dndxml.get('linenum', '<unavailable>')
-            texfn = dndxml.get('filename', '<unavailable>')
-            if dndfn is None:
-                print("Error: %s must specify dnd tex filename!" % tag)  # EVH changed 'cmd' to 'tag'
-                print("See tex file %s line %s" % (texfn, linenum))
-                raise
-            dndfn = dndfn.strip()
-            if not (dndfn.endswith('.tex') or dndfn.endswith('.dndspec')):
-                print("Error: dnd file %s should be a .tex or a .dndspec file!" % dndfn)
-                print("See tex file %s line %s" % (texfn, linenum))
-                raise
-            if not os.path.exists(dndfn):
-                print("Error: dnd tex file %s does not exist!" % dndfn)
-                print("See tex file %s line %s" % (texfn, linenum))
-                raise
-            try:
-                with open(dndfn) as dfp:
-                    dndsrc = dfp.read()
-            except Exception as err:
-                print("Error %s: cannot open dnd tex / dndpec file %s to read" % (err, dndfn))
-                print("See tex file %s line %s" % (texfn, linenum))
-                raise
-
-            # Use latex2dnd to compile dnd tex into edX XML.
-            #
-            # For dndfile.tex, at least two files must be produced: dndfile_dnd.xml and
-            # dndfile_dnd.png
-            #
-            # we copy all the *.png files to static/images/<dndfile>/
-            #
-            # run latex2dnd only when the dndfile_dnd.xml file is older than dndfile.tex
-
-            fnb = os.path.basename(dndfn)
-            fnpre = fnb.rsplit('.', 1)[0]
-            fndir = path(os.path.dirname(dndfn))
-            xmlfn = fndir / (fnpre + '_dnd.xml')
-
-            run_latex2dnd = False
-            if not os.path.exists(xmlfn):
+        tag = 'edxdndtex'
+        dndfn = dndxml.text
+        linenum = dndxml.get('linenum', '<unavailable>')
+        texfn = dndxml.get('filename', '<unavailable>')
+        if dndfn is None:
+            print("Error: %s must specify dnd tex filename!" % tag)  # EVH changed 'cmd' to 'tag'
+            print("See tex file %s line %s" % (texfn, linenum))
+            raise
+        dndfn = dndfn.strip()
+        self.source_files.append(dndfn)
+        if not (dndfn.endswith('.tex') or dndfn.endswith('.dndspec')):
+            print("Error: dnd file %s should be a .tex or a .dndspec file!" % dndfn)
+            print("See tex file %s line %s" % (texfn, linenum))
+            raise
+        if not os.path.exists(dndfn):
+            print("Error: dnd tex file %s does not exist!" % dndfn)
+            print("See tex file %s line %s" % (texfn, linenum))
+            raise
+        try:
+            with open(dndfn) as dfp:
+                dndsrc = dfp.read()
+        except Exception as err:
+            print("Error %s: cannot open dnd tex / dndpec file %s to read" % (err, dndfn))
+            print("See tex file %s line %s" % (texfn, linenum))
+            raise
+
+        # Use latex2dnd to compile dnd tex into edX XML.
+        #
+        # For dndfile.tex, at least two files must be produced: dndfile_dnd.xml and
+        # dndfile_dnd.png
+        #
+        # we copy all the *.png files to static/images/<dndfile>/
+        #
+        # run latex2dnd only when the dndfile_dnd.xml file is older than dndfile.tex
+
+        fnb = os.path.basename(dndfn)
+        fnpre = fnb.rsplit('.', 1)[0]
+        fndir = path(os.path.dirname(dndfn))
+        xmlfn = fndir / (fnpre + '_dnd.xml')
+
+        run_latex2dnd = False
+        if not os.path.exists(xmlfn):
+            run_latex2dnd = True
+        if not run_latex2dnd:
+            dndmt = os.path.getmtime(dndfn)
+            xmlmt = os.path.getmtime(xmlfn)
+            if dndmt > xmlmt:
                 run_latex2dnd = True
-            if not run_latex2dnd:
-                dndmt = os.path.getmtime(dndfn)
-                xmlmt = os.path.getmtime(xmlfn)
-                if dndmt > xmlmt:
-                    run_latex2dnd = True
-            if run_latex2dnd:
-                options = ''
-                if dndxml.get('can_reuse', 'False').lower().strip() != 'false':
-                    options += '-C'
-                cmd = 'cd "%s"; latex2dnd --cleanup -r %s -v %s %s' % (fndir, dndxml.get('resolution', 210), options, fnb)
-                print("--> Running %s" % cmd)
-                sys.stdout.flush()
-                status = os.system(cmd)
-                if status:
-                    print("Oops - latex2dnd apparently failed - aborting!")
-                    raise Exception("Oops - latex2dnd apparently failed - aborting!")
-                imdir = self.output_dir / ('static/images/%s' % fnpre)
-                os.system('mkdir -p %s' % imdir)
-                cmd = "cp %s/%s*.png %s/" % (fndir, fnpre, imdir)
-                print("----> Copying dnd images: %s" % cmd)
-                sys.stdout.flush()
-                status = os.system(cmd)
-                if status:
-                    print("Oops - copying images from latex2dnd apparently failed - aborting!")
-                    raise Exception("Oops - latex2dnd apparently failed - aborting!")
-            else:
-                print("--> latex2dnd XML file %s is up to date: %s" % (xmlfn, fnpre))
+        if run_latex2dnd:
+            options = ''
+            if dndxml.get('can_reuse', 'False').lower().strip() != 'false':
+                options += '-C'
+            cmd = 'cd "%s"; latex2dnd --cleanup -r %s -v %s %s' % (fndir, dndxml.get('resolution', 210), options, fnb)
+            print("--> Running %s" % cmd)
+            sys.stdout.flush()
+            status = os.system(cmd)
+            if status:
+                print("Oops - latex2dnd apparently failed - aborting!")
+                raise Exception("Oops - latex2dnd apparently failed - aborting!")
+            imdir = self.output_dir / ('static/images/%s' % fnpre)
+            print("----> Copying dnd images: %s/%s*.png to %s/" % (fndir, fnpre, imdir))
+            sys.stdout.flush()
+            if not self.assets.copy_files(fndir / (fnpre + '*.png'), imdir):
+                print("Oops - copying images from latex2dnd apparently failed - aborting!")
+                raise Exception("Oops - latex2dnd apparently failed - aborting!")
+        else:
+            print("--> latex2dnd XML file %s is up to date: %s" % (xmlfn, fnpre))
 
-            # change dndtex tag to become include
-            # change filename to become dndfile_dnd.xml
-            # this will trigger an include of that XML in process_include, which happens after this filter
+        # change dndtex tag to become include
+        # change filename to become dndfile_dnd.xml
+        # this will trigger an include of that XML in process_include, which happens after this filter
 
-            dndxml.tag = 'edxinclude'
-            dndxml.text = xmlfn
+        dndxml.tag = 'edxinclude'
+        dndxml.text = xmlfn
 
-    def process_general_hint_system(self, tree):
+    @tag_filter('problem')
+    def process_general_hint_system(self, problem):
         '''
         Include general_hint_system.py script for problems which have hints specified.
         '''
@@ -1622,44 +1843,45 @@ class latex2edx(object):
         # find all instances of <edx_general_hint_system />,
         # but at most one per problem
 
-        for problem in tree.findall('.//problem'):
-            isdone = False
-            for eghs in problem.findall('.//edx_general_hint_system'):
-                with open(ghsfn) as gfp:
-                    incxml = etree.fromstring('<script><![CDATA[\n%s\n]]></script>' % gfp.read())
-                if not isdone:
-                    eghs.addprevious(incxml)
-                    # print "  added eghs to problem %s" % problem.get('url_name')
-                    isdone = True
-                p = eghs.getparent()
-                p.remove(eghs)
+        isdone = False
+        for eghs in problem.findall('.//edx_general_hint_system'):
+            with open(ghsfn) as gfp:
+                incxml = etree.fromstring('<script><![CDATA[\n%s\n]]></script>' % gfp.read())
+            if not isdone:
+                eghs.addprevious(incxml)
+                # print "  added eghs to problem %s" % problem.get('url_name')
+                isdone = True
+            p = eghs.getparent()
+            p.remove(eghs)
 
-    def check_all_python_scripts(self, tree):
+    @tag_filter('script')
+    def check_all_python_scripts(self, script):
         '''
         Run syntax check on all python scripts
         '''
-        for script in tree.findall('.//script[@type="text/python"]'):
-            pyfile = tempfile.NamedTemporaryFile(mode='w', delete=False)
-            if script.text is None:
-                print("Warning: empty script!")
-                print("Script location: %s" % etree.tostring(script))
-                continue
-            try:
-                pyfile.write(script.text)
-            except Exception as err:
-                print("Error checking python script %s" % script.text)
-                print(str(err))
-                print("Script location: %s" % etree.tostring(script))
-                continue
-            pyfile.close()
-            try:
-                py_compile.compile(pyfile.name, doraise=True)
-            except Exception as err:
-                print("Error in python script %s! Err=%s" % (pyfile.name, err))
-                print("Script location: %s" % etree.tostring(script))
-                print("Aborting!")
-                raise Exception(self.standard_error_msg(script))
-            os.unlink(pyfile.name)
+        if script.get('type') != 'text/python':
+            return
+        pyfile = tempfile.NamedTemporaryFile(mode='w', delete=False)
+        if script.text is None:
+            print("Warning: empty script!")
+            print("Script location: %s" % etree.tostring(script))
+            return
+        try:
+            pyfile.write(script.text)
+        except Exception as err:
+            print("Error checking python script %s" % script.text)
+            print(str(err))
+            print("Script location: %s" % etree.tostring(script))
+            return
+        pyfile.close()
+        try:
+            py_compile.compile(pyfile.name, doraise=True)
+        except Exception as err:
+            print("Error in python script %s! Err=%s" % (pyfile.name, err))
+            print("Script location: %s" % etree.tostring(script))
+            print("Aborting!")
+            raise Exception(self.standard_error_msg(script))
+        os.unlink(pyfile.name)
 
     def generate_course_unit_tests(self, xml):
         '''
@@ -1676,6 +1898,7 @@ class latex2edx(object):
         responsetags = ['customresponse', 'optionresponse', 'multiplechoiceresponse', 
                         'choiceresponse', 'numericalresponse', 'formularesponse',
                         'stringresponse', 'symbolicresponse']
+        from .course_tests import AnswerBoxUnitTest, CourseUnitTestSet
         cutset = CourseUnitTestSet()
         for problem in xml.findall('.//problem'):
             dn = problem.get('display_name')
@@ -1797,10 +2020,7 @@ class latex2edx(object):
             s = s.replace('/', ':')
         if s in self.URLNAMES and not s.endswith(tag):
             s = '%s_%s' % (tag, s)
-        while s in self.URLNAMES:
-            s += 'x'
-        self.URLNAMES.append(s)
-        return s
+        return self.URLNAMES.add_unique(s)
 
     @staticmethod
     def do_attrib_string(elem):
@@ -1811,6 +2031,7 @@ class latex2edx(object):
         '''
         attrib_string = elem.get('attrib_string', '')
         if attrib_string:
+            from .abox import split_args_with_quoted_strings
             attrib_list = split_args_with_quoted_strings(attrib_string)
             if len(attrib_list) == 1 & len(attrib_list[0].split('=')) == 1:  # a single number n is interpreted as weight="n"
                 elem.set('weight', attrib_list[0])
@@ -1826,49 +2047,69 @@ class latex2edx(object):
         if 'attrib_string' in list(elem.keys()):
             elem.attrib.pop('attrib_string')  # remove attrib_string
 
-    def fix_attrib_string(self, xml):
+    @tag_filter(*AttribStringTags)
+    def fix_attrib_string(self, elem):
         '''
         Convert attrib_string in <problem>, <chapter>, etc. to attributes, intelligently.
         '''
-        TAGS = ['problem', 'chapter', 'sequential', 'vertical', 'course', 'html', 'video', 'discussion', 'edxdndtex',
-                'conditional', 'lti', 'split_test']
-        for tag in TAGS:
-            for elem in xml.findall('.//%s' % tag):
-                self.do_attrib_string(elem)
+        self.do_attrib_string(elem)
 
-    def process_custom_html(self, tree):
+    @tag_filter('customhtml')
+    def process_custom_html(self, ch):
         '''
         Handle \begin{html}{tag}[attribs] ... \end{html}
         '''
-        cnt = 0
-        for ch in tree.findall(".//customhtml"):
-            tag = ch.get("tag")
-            if not tag:
-                raise Exception("Oops, empty tag specified in custom html %s" % etree.tostring(ch))
-            ch.tag = tag
-            ch.attrib.pop("tag")
-            self.do_attrib_string(ch)
-            cnt += 1
-        print(("Processed %s custom HTML stanzas" % cnt))
+        tag = ch.get("tag")
+        if not tag:
+            raise Exception("Oops, empty tag specified in custom html %s" % etree.tostring(ch))
+        ch.tag = tag
+        ch.attrib.pop("tag")
+        self.do_attrib_string(ch)
+        self.ncustom_html += 1
 
-    def fix_xhtml_descriptor_in_p(self, xml):
+    @tag_filter(*DescriptorTags)
+    def fix_xhtml_descriptor_in_p(self, elem):
         '''
         Sometimes have <sequential><p><problem>...</problem></p></sequential>
         Have to remove contaiing <p>
         This happens for problem, chapter, sequential, html, any DescriptorTag
         '''
-        for tag in self.DescriptorTags:
-            for elem in xml.findall('.//%s' % tag):
-                parent = elem.getparent()
-                if parent.tag == 'p':
-                    for pcont in parent:
-                        parent.addprevious(pcont)  # move each element in <p> up before <p>
-                    parent.getparent().remove(parent)  # remove the <p>
+        parent = elem.getparent()
+        if parent.tag == 'p':
+            for pcont in parent:
+                parent.addprevious(pcont)  # move each element in <p> up before <p>
+            parent.getparent().remove(parent)  # remove the <p>
+
+
+def load_config_file(config_file):
+    '''
+    Load local configuration file, if it exists, updating DEFAULT_CONFIG.
+    Returns list of extra xml filters given by the configuration file.
+    '''
+    extra_xml_filters = []
+    if os.path.exists(config_file):
+        import imp
+        # prepend the config file's directory to the path to allow local imports inside it
+        sys.path.insert(0, os.path.dirname(config_file))
+        cf = imp.load_source('config_file', config_file)
+        DEFAULT_CONFIG.update(getattr(cf, 'local_config', {}))
+        extra_xml_filters.extend(getattr(cf, 'extra_xml_filters', []))
+    return extra_xml_filters
+
+
+def get_version():
+    '''
+    Return installed version of latex2edx (from the package metadata).
+    '''
+    try:
+        from importlib.metadata import version
+        return version("latex2edx")
+    except Exception:
+        return "unknown"
 
 
 def CommandLine():
-    import pkg_resources  # part of setuptools
-    version = pkg_resources.require("latex2edx")[0].version
+    version = get_version()
     parser = optparse.OptionParser(usage="usage: %prog [options] filename.tex",
                                    version="%prog version " + version)
     parser.add_option('-v', '--verbose',
@@ -1958,43 +2199,134 @@ def CommandLine():
                       dest="output_cutset",
                       default="",
                       help="filename in which to output answer box unit test set (YAML format) for the course, made for testing with edxcut",)
+    parser.add_option("--build-cache",
+                      dest="build_cache",
+                      default="",
+                      help="directory for incremental build cache: only re-render chapters which changed since the last build",)
+    parser.add_option("--render-processes",
+                      dest="render_processes",
+                      default=0, type="int",
+                      help="number of processes to use for rendering chapters in parallel",)
+    parser.add_option("--watch",
+                      dest="watch",
+                      default=False, action="store_true",
+                      help="keep running, and rebuild whenever the tex file or any file it uses changes",)
+    parser.add_option("--watch-interval",
+                      dest="watch_interval",
+                      default=1.0, type="float",
+                      help="seconds between checks for changed files (used with --watch)",)
+    parser.add_option("--profile",
+                      action="store_true",
+                      dest="profile",
+                      default=False,
+                      help="report time and peak memory used by each conversion stage and filter",)
+    parser.add_option("--profile-output",
+                      action="store",
+                      dest="profile_output",
+                      default="latex2edx_profile.json",
+                      help="filename for JSON profile report (used with --profile)",)
+    parser.add_option("--xmllint",
+                      action="store_true",
+                      dest="xmllint",
+                      help="format output XML files by running xmllint, instead of the (equivalent) built-in formatter",)
+    parser.add_option("-j", "--jobs",
+                      dest="jobs",
+                      default=1, type="int",
+                      help="number of threads to use for writing course files (more helps on network filesystems)",)
+    parser.add_option("--output-tarball",
+                      dest="output_tarball",
+                      default="",
+                      help="write course files into this compressed tar archive (e.g. course.tar.gz), instead of the output directory",)
+    parser.add_option("--delta-from",
+                      dest="delta_from",
+                      default="",
+                      help="xbundle file from the previous build (e.g. the output xbundle): only export descriptors changed since then",)
+    parser.add_option("--image-cache",
+                      dest="image_cache",
+                      default="",
+                      help="directory for caching PNG images converted from PDF figures (default: in the build cache directory)",)
+    parser.add_option("--image-processes",
+                      dest="image_processes",
+                      default=0, type="int",
+                      help="number of processes to use for converting PDF figures to PNG (default: one per CPU)",)
+    parser.add_option("--optimize-images",
+                      dest="optimize_images",
+                      default=False, action="store_true",
+                      help="recompress images, and add scaled variants of them for small screens (srcset), cached in the image cache",)
+    parser.add_option("--webp-images",
+                      dest="webp_images",
+                      default=False, action="store_true",
+                      help="also add WebP variants of images (used with --optimize-images)",)
+    parser.add_option("--batch",
+                      dest="batch",
+                      default="",
+                      help="YAML manifest file listing many conversion jobs to run (tex file and options for each)",)
+    parser.add_option("--batch-processes",
+                      dest="batch_processes",
+                      default=0, type="int",
+                      help="number of processes to use for running batch jobs in parallel (used with --batch)",)
     (opts, args) = parser.parse_args()
 
+    if opts.batch:
+        from .batch import convert_batch, load_manifest, summary
+        results = convert_batch(load_manifest(opts.batch), processes=opts.batch_processes)
+        print(summary(results))
+        if not all(res.ok for res in results):
+            sys.exit(1)
+        return
+
     if len(args) < 1:
         print('latex2edx: wrong number of arguments')
         parser.print_help()
         sys.exit(-2)
     fn = args[0]
 
-    config = DEFAULT_CONFIG
-    extra_xml_filters = []
-    # load local configuration file if available
-    if os.path.exists(opts.config_file):
-        import imp
-        # prepend the config file's directory to the path to allow local imports inside it
-        sys.path.insert(0, os.path.dirname(opts.config_file))
-        cf = imp.load_source('config_file', opts.config_file)
-        config.update(getattr(cf, 'local_config', {}))
-        extra_xml_filters.extend(getattr(cf, 'extra_xml_filters', []))
-
-    c = latex2edx(fn, verbose=opts.verbose, output_fn=opts.output_fn,
-                  output_dir=opts.output_dir,
-                  do_merge=opts.merge,
-                  update_policy=opts.update_policy,
-                  suppress_policy=opts.suppress_policy,
-                  suppress_verticals=opts.suppress_verticals,
-                  section_only=opts.section_only,
-                  add_wrap=opts.add_wrap,
-                  xml_only=opts.xml_only,
-                  units_only=opts.units_only,
-                  popup_flag=opts.popups,
-                  allow_dirs=opts.allow_dirs,
-                  output_cutset=opts.output_cutset,
-                  extra_xml_filters=extra_xml_filters,
-                  add_timestamp=opts.timestamp,
-                  timestamp_revision=opts.timestamp_revision,
-                  timestamp_threshold=opts.timestamp_threshold,
-                  )
+    extra_xml_filters = load_config_file(opts.config_file)
+
+    def make_converter():
+        return latex2edx(fn, verbose=opts.verbose, output_fn=opts.output_fn,
+                         output_dir=opts.output_dir,
+                         do_merge=opts.merge,
+                         update_policy=opts.update_policy,
+                         suppress_policy=opts.suppress_policy,
+                         suppress_verticals=opts.suppress_verticals,
+                         section_only=opts.section_only,
+                         add_wrap=opts.add_wrap,
+                         xml_only=opts.xml_only,
+                         units_only=opts.units_only,
+                         popup_flag=opts.popups,
+                         allow_dirs=opts.allow_dirs,
+                         output_cutset=opts.output_cutset,
+                         extra_xml_filters=extra_xml_filters,
+                         add_timestamp=opts.timestamp,
+                         timestamp_revision=opts.timestamp_revision,
+                         timestamp_threshold=opts.timestamp_threshold,
+                         profile=opts.profile,
+                         build_cache=opts.build_cache,
+                         render_processes=opts.render_processes,
+                         xmllint=opts.xmllint,
+                         jobs=opts.jobs,
+                         output_tarball=opts.output_tarball,
+                         delta_from=opts.delta_from,
+                         image_cache=opts.image_cache,
+                         image_processes=opts.image_processes,
+                         optimize_images=opts.optimize_images,
+                         webp_images=opts.webp_images,
+                         )
+
+    def report_profile(c):
+        if opts.profile:
+            print(c.profiler.report())
+            c.profiler.save_json(opts.profile_output)
+            print("Profile report written to %s" % opts.profile_output)
+
+    if opts.watch:
+        from .watch import Watcher
+        Watcher(make_converter, [fn], interval=opts.watch_interval, on_build=report_profile).run()
+        return
+
+    c = make_converter()
     c.convert()
+    report_profile(c)
 
 
@@ -2,33 +2,58 @@ import sys
 import os
 import re
 import codecs
+import copy
+import multiprocessing
+import pickle
 from logging import CRITICAL, DEBUG, INFO 
 try:
     from collections import OrderedDict
 except:
     from ordereddict import OrderedDict
     
+import plasTeX
 from plasTeX.Renderers import XHTML
 from plasTeX.TeX import TeX
 from plasTeX.Renderers.PageTemplate import Renderer as _Renderer
 from plasTeX.Config import config as plasTeXconfig
 from xml.sax.saxutils import escape, unescape
 from .abox import AnswerBox, split_args_with_quoted_strings
+from .assetsync import AssetSync
+from .imageconvert import ImageConverter, find_images, image_scale, image_style
+from .imageoptimize import ImageOptimizer
+from .profiling import BuildProfiler
+from .textfilters import TextFilters
+from . import __version__
+from . import buildcache
+from . import xhtmltree
+from .xmlfilters import FilterDispatcher, tag_filter
 from io import StringIO
+from lxml import etree
 
 class MyRenderer(XHTML.Renderer):
     """
     PlasTeX class for rendering the latex document into XHTML + edX tags
     """
-    def __init__(self, imdir='', imurl='', extra_filters=None, abox=None, imurl_fmt=None, verbose=False):
+    def __init__(self, imdir='', imurl='', extra_filters=None, abox=None, imurl_fmt=None, verbose=False,
+                 profiler=None, xml_tree=False, image_converter=None, assets=None, image_optimizer=None,
+                 defer_copies=False):
         '''
         imdir = directory where images should be stored
         imurl = url base for web base location of images
         imurl_fmt = image url format expression - defaults to "/static/{imurl}/{fnbase}"
         
         abox = (class) use this instead of AnswerBox, if provided
+        profiler = (BuildProfiler) records time spent in post-processing, if provided
+        xml_tree = if True, then render to an XML tree (self.xml) instead of a string (self.xhtml),
+                   unless there are extra_filters (which act on the string)
+        image_converter = (ImageConverter) converts PDF images to PNG, if provided
+        assets = (AssetSync) copies images to imdir, if provided (e.g. shared with latex2edx)
+        image_optimizer = (ImageOptimizer) makes recompressed and responsive variants of images, if provided
+        defer_copies = if True, then images are not copied to imdir, but listed in self.imcopies, for the
+                       caller to copy (e.g. when rendering in another process, without the build's assets)
         '''
         XHTML.Renderer.__init__(self)
+        self.profiler = profiler or BuildProfiler(enabled=False)
         self.imdir = imdir
         self.imurl = imurl
         self.imurl_fmt = imurl_fmt or "/static/{imurl}/{fnbase}"
@@ -37,6 +62,15 @@ class MyRenderer(XHTML.Renderer):
         self.answer_box_objects = {}	# tracks AnswerBox objects, using their xmlstr repr as keys
         self.abox_config = {}	# used by AnswerBox to store state, like default config parameters
         self.abox_class = abox or AnswerBox
+        self.image_converter = image_converter or ImageConverter(processes=1, verbose=verbose)
+        self.assets = assets or AssetSync(verbose=verbose)
+        self.image_optimizer = image_optimizer
+        self.imoptimized = []	# [filename, width, key] for images with variants made by image_optimizer
+        self.defer_copies = defer_copies
+        self.imcopies = []	# [source, destination] for image copies deferred
+        self.xml_tree = xml_tree
+        self.xhtml = None
+        self.xml = None
 
         # setup filters
         self.filters = OrderedDict()
@@ -50,9 +84,17 @@ class MyRenderer(XHTML.Renderer):
         self.filters[self.filter_fix_abox_match_with_linenum] = self.filter_fix_abox_with_linenum
         self.filters[self.filter_fix_image_match] = self.filter_fix_image
         self.filters[self.filter_fix_edxxml_match] = self.filter_fix_edxxml
+        self.own_filters = list(self.filters.items())
+
+        # for rendering to an XML tree: filters making text are applied to the XHTML as it is parsed,
+        # and the others to the elements of the tree
+        text_only = [self.filter_fix_math, self.filter_fix_displaymath, self.filter_fix_displaymathverbatim]
+        self.piece_filters = TextFilters([(pattern, func) for (pattern, func) in self.own_filters if func in text_only])
+        self.tree_filters = [self.tree_fix_abox, self.tree_fix_image, self.tree_fix_edxxml]
 
         if extra_filters is not None:
             self.filters.update(extra_filters)
+        self.compiled_filters = None	# (filters, TextFilters for them)
 
     filter_fix_edxxml_match = '(?s)<edxxml>\\\\edXxml{(.*?)}</edxxml>'
 
@@ -123,95 +165,97 @@ class MyRenderer(XHTML.Renderer):
     filter_fix_image_match = '<includegraphics style="(.*?)">(.*?)</includegraphics>'
 
     def filter_fix_image(self, m):
-        width = 400
-        attribs = []
         print("[do_image] m=%s" % repr(m.groups()))
-        style = m.group(1)
-        sms = style.split(',')
-        for sm in sms:
-            w = re.search('width=([0-9\.]+)(.*)',sm)
-            if w:
-                widtype = w.group(2)
-                width = float(w.group(1))
-                if 'in' in widtype:
-                    width = width * 110
-                elif 'cm' in widtype:
-                    width = width * 110 / 2.54
-                if '\\textwidth' in widtype:
-                    width = width * 770
-                width = int(width)
-                if width==0:
-                    width = 400
-            else:
-                sm = sm.strip().replace('=', ':')
-                attribs.append(sm)
-        attribs = ';'.join(attribs)
-        if attribs:
-            attribs = 'style="' + attribs + '"'
+        imghtml = ''
+        for (src, width, attribs, variants) in self.fix_image(m.group(1), m.group(2)):
+            if width is None:
+                imghtml += '<img src="%s" />' % src
+                continue
+            extra = ['style="%s"' % attribs] if attribs else []
+            if variants and variants['srcset']:
+                extra += ['srcset="%s"' % variants['srcset'], 'sizes="%s"' % variants['sizes']]
+            img = '<img src="%s" width="%d" %s/>' % (src, width, ' '.join(extra))
+            if variants and variants['webp']:
+                img = '<picture><source type="image/webp" srcset="%s" sizes="%s"/>%s</picture>' % (
+                    variants['webp'], variants['sizes'], img)
+            imghtml += img
+        return imghtml
+
+    def fix_image(self, style, fn):
+        '''
+        Copy image file fn (converting pdf to png, one file per page) to the image directory.
+        Returns list of (src, width, style, variants) for the <img> elements showing it, where width
+        is None and style is '' if the file is not found, and variants is as returned by sync_image.
+        style (the includegraphics options) and fn are XHTML text, as are the strings returned.
+        '''
+        width, attribs = image_style(style)
 
         def make_image_html(fn,k,attribs):
             self.imfnset.append(fn+k)
-            # if file doesn't exist in edX web directory, copy it there
-            fnbase = os.path.basename(fn)+k
-            wwwfn = '%s/%s' % (self.imdir,fnbase)
-            #if not os.path.exists('/home/WWW' + wwwfn):
-            if 1:
-                cmd = 'cp %s %s' % (fn+k,wwwfn)
-                os.system(cmd)
-                print(cmd)
-                os.system('chmod og+r %s' % wwwfn)
-            src = self.imurl_fmt.format(imurl=self.imurl, fnbase=fnbase)
-            return '<img src="%s" width="%d" %s/>' % (src, width, attribs)
-
-        fnset = [m.group(2)]
+            variants = self.sync_image(fn+k, width)
+            src = self.imurl_fmt.format(imurl=self.imurl, fnbase=os.path.basename(fn)+k)
+            return (src, width, attribs, variants)
+
+        fnset = [fn]
         fnsuftab = ['','.png','.pdf','.png','.jpg']
         for k in fnsuftab:
             for fn in fnset:
                 if os.path.exists(fn+k):
                     if k=='.pdf':		# convert pdf to png
-                        dim = width if width>400 else 400
-                        # see how many pages it is
-                        try:
-                            npages = int(os.popen('pdfinfo %s.pdf | grep Pages:' % fn).read()[6:].strip())
-                        except Exception as err:
-                            # print "npages error %s" % err
-                            npages = 1
-                        nfound = 0
-                        if npages>1:	# handle multi-page PDFs
-                            fnset = ['%s-%d' % (fn,x) for x in range(npages)]
-                            nfound = sum([ 1 if os.path.exists(x+'.png') else 0 for x in fnset])
-                            print("--> %d page PDF, fnset=%s (nfound=%d)" % (npages, fnset, nfound))
-                        if not nfound==npages:
-                            os.system('convert -density 800 {fn}.pdf -scale {dim}x{dim} {fn}.png'.format(fn=fn,dim=dim))
-                        if npages>1:	# handle multi-page PDFs
-                            fnset = ['%s-%d' % (fn,x) for x in range(npages)]
-                            print("--> %d page PDF, fnset=%s" % (npages, fnset))
-                        else:
-                            fnset = [fn]
-                        imghtml = ''
-                        for fn2 in fnset:
-                            imghtml += make_image_html(fn2, '.png', attribs)
-                        return imghtml
+                        fnset = self.image_converter.convert(fn, image_scale(width))
+                        return [make_image_html(fn2, '.png', attribs) for fn2 in fnset]
                     else:
-                        return make_image_html(fn, k, attribs)
+                        return [make_image_html(fn, k, attribs)]
                 
         fn = fnset[0]
         print('Cannot find image file %s' % fn)
-        return '<img src="NOTFOUND-%s" />' % fn
+        return [('NOTFOUND-%s' % fn, None, '', None)]
+
+    def sync_image(self, fn, width):
+        '''
+        Copy image file fn to the image directory (unless it is already there), along with its
+        variants, if optimizing images.  Returns None if there are no variants, else dict with
+        srcset, sizes, and webp (the srcset of WebP variants, if any) for showing it width pixels wide.
+        '''
+        optimized = None
+        if self.image_optimizer is not None:
+            optimized = self.image_optimizer.optimize(fn, width)
+        if optimized is None:
+            self.copy_image(fn, '%s/%s' % (self.imdir, os.path.basename(fn)))
+            return None
+        self.imoptimized.append([fn, width, optimized['key']])
+        srcsets = {False: [], True: []}		# is webp: [(width, url and width)]
+        for (path, name, w, mime) in optimized['files']:
+            self.copy_image(path, '%s/%s' % (self.imdir, name))
+            url = self.imurl_fmt.format(imurl=self.imurl, fnbase=name).replace(' ', '%20')
+            srcsets[mime == 'image/webp'].append((w, '%s %dw' % (url, w)))
+        if len(optimized['files']) == 1:
+            return None
+        srcset, webp = [', '.join(x[1] for x in sorted(srcsets[k])) for k in [False, True]]
+        return {'srcset': srcset if len(srcsets[False]) > 1 else '',
+                'sizes': '(max-width: %dpx) 100vw, %dpx' % (width, width),
+                'webp': webp}
+
+    def copy_image(self, src, dst):
+        if self.defer_copies:
+            self.imcopies.append([src, dst])
+        else:
+            self.assets.copy(src, dst)
 
     filter_fix_abox_match = r'(?s)<abox(|linenum="\d+" filename="[^>]+")>(.*?)</abox>'
 
     def filter_fix_abox(self, m):
-        abox = self.abox_class(m.group(1), config=self.abox_config, verbose=self.verbose)
-        self.answer_box_objects[abox.xmlstr_just_code] = abox
-        return abox.xmlstr
+        return self.make_abox(m.group(1)).xmlstr
 
     filter_fix_abox_match_with_linenum = r'(?s)<abox (linenum="\d+" filename="[^>]+")>(.*?)</abox>'
 
     def filter_fix_abox_with_linenum(self, m):
-        abox = self.abox_class(m.group(2), config=self.abox_config, context=m.group(1), verbose=self.verbose)
+        return self.make_abox(m.group(2), context=m.group(1)).xmlstr
+
+    def make_abox(self, aboxstr, context=None):
+        abox = self.abox_class(aboxstr, config=self.abox_config, context=context, verbose=self.verbose)
         self.answer_box_objects[abox.xmlstr_just_code] = abox
-        return abox.xmlstr
+        return abox
 
     @staticmethod
     def fix_unicode(stxt):
@@ -228,16 +272,137 @@ class MyRenderer(XHTML.Renderer):
                 print("Error in rendering (fix unicode): ", str(err)[:1000])
         return stxt
 
+    def text_filters(self):
+        '''
+        Return TextFilters for self.filters (made again if self.filters has been changed).
+        '''
+        filters = list(self.filters.items())
+        if self.compiled_filters is None or self.compiled_filters[0] != filters:
+            self.compiled_filters = (filters, TextFilters(filters))
+        return self.compiled_filters[1]
+
+    def match_filter(self, elem, funcs, fix=None):
+        '''
+        Return (function, match) for the first of our own text filters, using one of the given
+        functions, which matches all of elem (as XHTML text, passed through fix), or None.
+        '''
+        stxt = xhtmltree.element_source(elem, fix)
+        for (pattern, func) in self.own_filters:
+            if func in funcs:
+                m = re.fullmatch(pattern, stxt)
+                if m:
+                    return (func, m)
+        return None
+
+    @tag_filter('abox', barrier=True)
+    def tree_fix_abox(self, elem):
+        '''
+        Replace abox element by the XML made by its AnswerBox (which is moved into the tree, rather
+        than serialised and parsed again).
+        '''
+        found = self.match_filter(elem, [self.filter_fix_abox, self.filter_fix_abox_with_linenum], self.fix_unicode)
+        if found is None:
+            return
+        (func, m) = found
+        if func == self.filter_fix_abox:
+            abox = self.make_abox(m.group(1))
+        else:
+            abox = self.make_abox(m.group(2), context=m.group(1))
+        hint_extras = getattr(abox, 'hint_extras', '')
+        (text, elements) = xhtmltree.parse_fragment(xhtmltree.add_newlines_text(hint_extras)) if hint_extras else ('', [])
+        xhtmltree.replace_element(elem, text, elements + [abox.xml])
+        xhtmltree.add_newlines(abox.xml)
+
+    @tag_filter('includegraphics', barrier=True)
+    def tree_fix_image(self, elem):
+        found = self.match_filter(elem, [self.filter_fix_image])
+        if found is None:
+            return
+        m = found[1]
+        print("[do_image] m=%s" % repr(m.groups()))
+        images = []
+        for (src, width, attribs, variants) in self.fix_image(m.group(1), m.group(2)):
+            img = etree.Element('img', src=xhtmltree.source_text(src))
+            if width is not None:
+                img.set('width', str(width))
+            if attribs:
+                img.set('style', xhtmltree.source_text(attribs))
+            if variants and variants['srcset']:
+                img.set('srcset', xhtmltree.source_text(variants['srcset']))
+                img.set('sizes', variants['sizes'])
+            if variants and variants['webp']:
+                picture = etree.Element('picture')
+                etree.SubElement(picture, 'source', type='image/webp', srcset=xhtmltree.source_text(variants['webp']),
+                                 sizes=variants['sizes'])
+                picture.append(img)
+                img = picture
+            images.append(img)
+        xhtmltree.replace_element(elem, '', images)
+
+    @tag_filter('edxxml', barrier=True)
+    def tree_fix_edxxml(self, elem):
+        found = self.match_filter(elem, [self.filter_fix_edxxml], self.fix_unicode)
+        if found is None:
+            return
+        stxt = xhtmltree.add_newlines_text(found[0](found[1]))
+        try:
+            (text, elements) = xhtmltree.parse_fragment(stxt)
+        except Exception as err:
+            print("Error!  Failed to convert xhtml string into proper XML, err=%s" % str(err))
+            print("xhtml string = %s" % stxt)
+            raise
+        xhtmltree.replace_element(elem, text, elements)
+
+    def fix_xhtml_piece(self, stxt):
+        '''
+        Apply fix_unicode, the math filters, and the final replacements of postprocess_xhtml to
+        a piece of XHTML text, as it is parsed.
+        '''
+        stxt = self.piece_filters.sub(self.fix_unicode(stxt))
+        return xhtmltree.add_newlines_text(stxt).replace('&nbsp;', '&#160;')
+
+    def renders_tree(self, files, postProcess):
+        '''
+        True if the output file should be rendered to an XML tree, rather than a string.
+        '''
+        return (self.xml_tree and postProcess is None and len(files) == 1
+                and list(self.filters.items()) == self.own_filters
+                and self.abox_class is AnswerBox and not self.overridden_filters())
+
+    def overridden_filters(self):
+        '''
+        Names of the filter_fix_* methods overridden by a subclass (whose behavior the tree filters
+        don't have, so the string filters must be used).
+        '''
+        names = []
+        for name in dir(MyRenderer):
+            if name.startswith('filter_fix_') and not name.endswith('_match'):
+                owner = next(cls for cls in type(self).__mro__ if name in cls.__dict__)
+                if owner is not MyRenderer:
+                    names.append(name)
+        return names
+
     def processFileContent(self, document, stxt):
+        with self.profiler.measure('processFileContent'):
+            return self.postprocess_xhtml(document, stxt)
+
+    def postprocess_tree(self, document, stxt):
+        '''
+        Return the XML tree (a <document> element) for the XHTML from plasTeX, the same as
+        parsing the string made by postprocess_xhtml.
+        '''
+        stxt = XHTML.Renderer.processFileContent(self, document, stxt)
+        with self.profiler.measure('parse xhtml'):
+            xml = xhtmltree.parse_body(stxt, self.fix_xhtml_piece)
+        del stxt
+        FilterDispatcher(self.tree_filters).run(xml)
+        return xml
+
+    def postprocess_xhtml(self, document, stxt):
         stxt = XHTML.Renderer.processFileContent(self, document, stxt)
         stxt = self.fix_unicode(stxt)
 
-        for fmatch, filfun in self.filters.items():
-            try:
-                stxt = re.sub(fmatch, filfun, stxt)
-            except Exception as err:
-                print("Error in rendering %s: %s" % (str(filfun)[:1000], str(err)[:1000]))
-                raise
+        stxt = self.text_filters().sub(stxt)
 
         stxt = stxt.replace('<p>','<p>\n')
         stxt = stxt.replace('<li>','\n<li>')
@@ -252,8 +417,137 @@ class MyRenderer(XHTML.Renderer):
         return self.xhtml
 
     def cleanup(self, document, files, postProcess=None):
-        res = _Renderer.cleanup(self, document, files, postProcess=postProcess)
-        return res
+        if not self.renders_tree(files, postProcess):
+            self.xml = None
+            res = _Renderer.cleanup(self, document, files, postProcess=postProcess)
+            return res
+        # same as _Renderer.cleanup, but keeping the XML tree, and writing it to the file
+        self.xhtml = None
+        fn = files[0]
+        encoding = document.config['files']['output-encoding']
+        with self.profiler.measure('processFileContent'):
+            with codecs.open(fn, encoding=encoding, errors=self.encodingErrors) as fp:
+                self.xml = self.postprocess_tree(document, fp.read())
+        etree.ElementTree(self.xml).write(fn, encoding=encoding)
+
+
+def setup_plastex():
+    '''
+    Set the zpts templates path, and add our python plastex package directory to the python path.
+    '''
+    mydir = os.path.dirname(__file__)
+    zptspath = os.path.abspath(mydir + '/render')
+    os.environ['XHTMLTEMPLATES'] = zptspath
+
+    # print os.environ['XHTMLTEMPLATES']
+
+    plastexpydir = os.path.abspath(mydir + '/plastexpy')
+    if plastexpydir not in sys.path:
+        sys.path.append(plastexpydir)
+
+
+def make_tex(output_fn, verbose=False):
+    '''
+    Instantiate a TeX processor, configured for rendering to output_fn.
+    '''
+    tex = TeX()
+    tex.ownerDocument.config['files']['split-level'] = -100
+    tex.ownerDocument.config['files']['filename'] = output_fn
+    tex.ownerDocument.config['general']['theme'] = 'plain'
+    if not verbose:
+        tex.disableLogging()
+    return tex
+
+
+def render_latex_string(latex_string, input_fn, output_fn, renderer_args, abox_config=None, verbose=False,
+                        profiler=None, parse_only=False):
+    '''
+    Render latex_string using a new TeX processor and renderer, with answer boxes starting
+    from the given configuration.  Used for rendering parts of a document, possibly in
+    another process.  Element ids generated by plasTeX start from 1.
+
+    renderer_args = (imdir, imurl, extra_filters, abox, imurl_fmt, image_converter, image_optimizer), as for MyRenderer
+    parse_only    = if True, then only parse (e.g. to find the effect on counters)
+
+    Returns dict with the xhtml, the plasTeX counters at the end (list of [name, value]), counter
+    resetby relations, the answer box configuration at the end, the number of element ids
+    generated (nids), the number of lines plasTeX counted beyond those in latex_string
+    (line_drift), images used (imfnset), images optimized (imoptimized), image copies to
+    make (imcopies, since the images are not copied here), and answer_box_objects.
+    '''
+    profiler = profiler or BuildProfiler(enabled=False)
+    imdir, imurl, extra_filters, abox, imurl_fmt, image_converter, image_optimizer = renderer_args
+    plasTeX.idgen = buildcache.IdGenerator(1)
+    renderer = MyRenderer(imdir, imurl, extra_filters, abox, imurl_fmt=imurl_fmt, verbose=verbose,
+                          profiler=profiler, image_converter=image_converter, image_optimizer=image_optimizer,
+                          defer_copies=True)
+    renderer.abox_config = abox_config if abox_config is not None else {}
+    tex = make_tex(output_fn, verbose)
+    source = StringIO(latex_string)
+    source.name = input_fn
+    tex.input(source)
+    tokenizer = tex.inputs[-1][0]
+    with profiler.measure('plastex parse'):
+        document = tex.parse()
+    result = {'xhtml': None,
+              'counters': buildcache.counter_state(document),
+              'resetby': dict((name, cnt.resetby) for (name, cnt) in document.context.counters.items()),
+              'line_drift': tokenizer.lineNumber - (latex_string.count('\n') + 1),
+              }
+    if parse_only:
+        return result
+    with profiler.measure('plastex render'):
+        renderer.render(document)
+    result.update({'xhtml': renderer.xhtml,
+                   'abox_config': renderer.abox_config,
+                   'nids': plasTeX.idgen.next_id - 1,
+                   'imfnset': renderer.imfnset,
+                   'imoptimized': renderer.imoptimized,
+                   'imcopies': renderer.imcopies,
+                   'answer_box_objects': renderer.answer_box_objects,
+                   })
+    return result
+
+
+ABOX_CONFIG = re.compile(r'\\edXabox\{[^}]*type\s*=\s*["\']?config')
+
+
+def parallel_render_job(job):
+    '''
+    Call render_latex_string with the keyword arguments in job, in a worker process
+    (see plastex2xhtml.render_chapters_parallel).
+    '''
+    setup_plastex()
+    result = render_latex_string(**job)
+    if os.path.exists(job['output_fn']):
+        os.unlink(job['output_fn'])
+    return result
+
+
+def predict_counters(start, base, effect):
+    '''
+    Predict the counters at the end of a chapter, given the counters at its start, using
+    the result (effect) of parsing the chapter starting from the base (preamble) counters.
+    Counters which are reset in the chapter (because a counter they are reset by changed)
+    end with the same value as when starting from the base; others change by the same amount.
+    '''
+    start = dict(start)
+    base = dict(base)
+    end = dict(effect['counters'])
+    resetby = effect['resetby']
+
+    def was_reset(name, depth=0):
+        parent = resetby.get(name)
+        if not parent or parent not in end or depth > 20:
+            return False
+        return end[parent] != base.get(parent) or was_reset(parent, depth + 1)
+
+    counters = []
+    for name, value in effect['counters']:
+        if name in start and not was_reset(name):
+            value = start[name] + value - base.get(name, 0)
+        counters.append([name, value])
+    return counters
 
 
 class plastex2xhtml(object):
@@ -276,7 +570,15 @@ class plastex2xhtml(object):
                  fix_plastex_optarg_bug=True,
                  abox=None,
                  imurl_fmt=None,
-                 verbose=False):
+                 verbose=False,
+                 profiler=None,
+                 build_cache=None,
+                 render_processes=0,
+                 image_cache='',
+                 image_processes=0,
+                 assets=None,
+                 optimize_images=False,
+                 webp_images=False):
         '''
         fn            = tex filename (should end in .tex)
         imdir         = directory where images are to be stored
@@ -292,6 +594,15 @@ class plastex2xhtml(object):
         abox          = (class) use this in place of AnswerBox
         imurl_fmt     = (str) image url format expression
         verbose       = if True, then do verbose logging
+        profiler      = (BuildProfiler) records time and memory of parsing and rendering, if provided
+        build_cache   = (BuildCache) if provided, then render chapters incrementally, reusing cached XHTML
+        render_processes = if > 1, then render chapters in parallel, using this many processes
+        image_cache   = directory for caching PNG images converted from PDF figures, if given
+        image_processes = number of processes for converting PDF figures in parallel (0 for one per CPU)
+        assets        = (AssetSync) copies images to imdir, if provided
+        optimize_images = if True, then recompress images, and make scaled variants of them, for srcset
+                          (cached in image_cache, if given)
+        webp_images   = if True (and optimize_images), then also make WebP variants of images
         '''
 
         if fn.endswith('.tex'):
@@ -305,21 +616,30 @@ class plastex2xhtml(object):
         self.latex_string = latex_string
         self.add_wrap = add_wrap
         self.verbose = verbose
-        self.renderer = MyRenderer(imdir, imurl, extra_filters, abox, imurl_fmt=imurl_fmt, verbose=verbose)
+        self.profiler = profiler or BuildProfiler(enabled=False)
+        self.image_converter = ImageConverter(image_cache, processes=image_processes, verbose=verbose)
+        self.image_optimizer = None
+        if optimize_images:
+            self.image_optimizer = ImageOptimizer(os.path.join(image_cache, 'optimized') if image_cache else '',
+                                                  webp=webp_images, verbose=verbose)
+        self.renderer = MyRenderer(imdir, imurl, extra_filters, abox, imurl_fmt=imurl_fmt, verbose=verbose,
+                                   profiler=self.profiler, xml_tree=True, image_converter=self.image_converter,
+                                   assets=assets, image_optimizer=self.image_optimizer)
+        self.renderer_args = (imdir, imurl, extra_filters, abox, imurl_fmt, self.image_converter,
+                              self.image_optimizer)
         self.fix_plastex_optarg_bug = fix_plastex_optarg_bug
-
-        # Instantiate a TeX processor and parse the input text
-        tex = TeX()
-        tex.ownerDocument.config['files']['split-level'] = -100
-        tex.ownerDocument.config['files']['filename'] = self.output_fn
-        tex.ownerDocument.config['general']['theme'] = 'plain'
+        self.build_cache = build_cache
+        self.render_processes = render_processes
+        self.latex_prepared = False
 
         plasTeXconfig.add_section('logging')
         plasTeXconfig['logging'][''] = CRITICAL
 
-        self.tex = tex
-        if not self.verbose:
-            tex.disableLogging()
+        # Instantiate a TeX processor and parse the input text
+        self.tex = self.make_tex()
+
+    def make_tex(self):
+        return make_tex(self.output_fn, self.verbose)
 
     def convert(self):
         self.generate_xhtml()	# do conversion
@@ -331,17 +651,38 @@ class plastex2xhtml(object):
             print("Converting latex to XHTML using PlasTeX with custom edX macros")
             print("Source file: %s" % self.input_fn)
             print("=============================================================================")
-    
-        # set the zpts templates path
-        mydir = os.path.dirname(__file__)
-        zptspath = os.path.abspath(mydir + '/render')
-        os.environ['XHTMLTEMPLATES'] = zptspath
 
-        # print os.environ['XHTMLTEMPLATES']
+        self.prepare_latex()
+        self.convert_images()
+        if self.build_cache is not None or self.render_processes > 1:
+            return self.generate_xhtml_by_chapter()
 
-        # add our python plastex package directory to python path
-        plastexpydir = os.path.abspath(mydir + '/plastexpy')
-        sys.path.append(plastexpydir)
+        source = StringIO(self.latex_string)
+        source.name = self.input_fn
+        self.tex.input(source)
+        with self.profiler.measure('plastex parse'):
+            document = self.tex.parse()
+        
+        with self.profiler.measure('plastex render'):
+            self.renderer.render(document)
+
+        # print(self.renderer.xhtml) # DEBUG
+        if self.renderer.xml is not None:
+            with codecs.open(self.output_fn, encoding='utf8') as fp:
+                nlines = sum(1 for line in fp)
+        else:
+            nlines = len(self.renderer.xhtml.split('\n'))
+        print("XHTML generated (%s): %d lines" % (self.output_fn, nlines))
+        return self.renderer.xhtml
+
+    def prepare_latex(self):
+        '''
+        Set up plastex paths, read the input latex, and apply fixes and wrapper, as needed.
+        '''
+        setup_plastex()
+
+        if self.latex_prepared:
+            return self.latex_string
 
         # get the input latex file
         if self.latex_string is None:
@@ -360,21 +701,294 @@ class plastex2xhtml(object):
             PRE = """\\documentclass[12pt]{article}\n\\usepackage{edXpsl}\n\n\\begin{document}\n\n"""
             POST = "\n\n\\end{document}"
             self.latex_string = PRE + self.latex_string + POST
- 
-        source = StringIO(self.latex_string)
-        source.name = self.input_fn
-        self.tex.input(source)
-        document = self.tex.parse()
-        
-        self.renderer.render(document)
+        self.latex_prepared = True
+        return self.latex_string
 
-        # print(self.renderer.xhtml) # DEBUG
-        print("XHTML generated (%s): %d lines" % (self.output_fn, len(self.renderer.xhtml.split('\n'))))
-        return self.renderer.xhtml
+    def convert_images(self):
+        '''
+        Convert the PDF figures used by the LaTeX source to PNG images, in parallel, before rendering
+        (when MyRenderer.fix_image would otherwise convert them one at a time).
+        '''
+        with self.profiler.measure('convert images'):
+            self.image_converter.convert_all(find_images(self.latex_string))
+        if self.image_converter.converted or self.image_converter.reused:
+            print("[latex2edx] Images: %s" % self.image_converter.summary())
+
+    def render_latex(self, latex_string, abox_config=None, parse_only=False):
+        '''
+        Render latex_string in this process (see render_latex_string).
+        '''
+        return render_latex_string(latex_string, self.input_fn, self.output_fn, self.renderer_args,
+                                   abox_config, self.verbose, self.profiler, parse_only)
+
+    def copy_images(self, result):
+        '''
+        Copy the images used by a rendering to the image directory, with the build's assets.
+        '''
+        for (src, dst) in result['imcopies']:
+            self.renderer.assets.copy(src, dst)
+
+    def use_result(self, result):
+        '''
+        Copy images, and keep track of images and answer boxes, from a rendering used in the output.
+        '''
+        self.copy_images(result)
+        self.renderer.imfnset += result['imfnset']
+        self.renderer.imoptimized += result['imoptimized']
+        self.renderer.answer_box_objects.update(result['answer_box_objects'])
+
+    def cached_images_ok(self, entry, xhtml):
+        '''
+        Check that the images used by a cached rendering still exist, and sync them (and their
+        variants) to the image directory.  Images which were not found when rendering
+        may now exist, so a rendering with missing images is never reused, nor is one
+        showing variants of images which have changed since.
+        '''
+        if 'NOTFOUND-' in xhtml:
+            return False
+        for fn in entry.get('imfnset', []):
+            if not os.path.exists(fn):
+                return False
+        optimizer = self.renderer.image_optimizer
+        for (fn, width, key) in entry.get('imoptimized', []):
+            if optimizer is None or optimizer.key(fn, width) != key:
+                return False
+        optimized = set()
+        for (fn, width, key) in entry.get('imoptimized', []):
+            self.renderer.sync_image(fn, width)
+            optimized.add(fn)
+        for fn in entry.get('imfnset', []):
+            if fn not in optimized:
+                self.renderer.assets.copy(fn, os.path.join(self.renderer.imdir, os.path.basename(fn)))
+        self.renderer.imfnset += entry.get('imfnset', [])
+        return True
+
+    def cache_get(self, key, what, xhtml_field=None):
+        '''
+        Return build cache entry for key, or None if there is no build cache, or no usable entry.
+        '''
+        cache = self.build_cache
+        if cache is None:
+            return None
+        entry = cache.get(key)
+        if entry is not None and (xhtml_field is None or self.cached_images_ok(entry, entry[xhtml_field])):
+            cache.note(what, reused=True)
+            return entry
+        cache.note(what, reused=False)
+        return None
+
+    def cache_put(self, key, entry):
+        if self.build_cache is not None:
+            self.build_cache.put(key, entry)
+
+    def generate_xhtml_by_chapter(self):
+        '''
+        Generate XHTML by rendering each top-level edXchapter separately, and stitching
+        the results together.  Chapters are taken from the build cache if unchanged since
+        the last build, and rendered in parallel if render_processes > 1.  If the
+        document can't be split into chapters, then it is rendered (and cached) as a whole.
+        '''
+        latex = self.latex_string
+        filters = [[pattern, getattr(func, '__name__', '')] for (pattern, func) in self.renderer.filters.items()]
+        optimizer = self.image_optimizer.settings() if self.image_optimizer is not None else None
+        common = buildcache.hash_strings(buildcache.CACHE_VERSION, __version__, buildcache.renderer_dependencies(),
+                                         self.input_fn, self.renderer.imurl, self.renderer.imurl_fmt,
+                                         self.renderer.abox_class.__name__, filters, optimizer)
+
+        split = buildcache.split_chapters(latex)
+        chunk_deps = []
+        if split is not None:
+            chunk_deps = [buildcache.input_dependencies(chunk) for (linenum, chunk) in split[1]]
+        reason = buildcache.unsplittable_reason(split, chunk_deps)
+        idstart = int(next(plasTeX.idgen)[1:])	# continue numbering of generated ids from previous renderings
+        ret = None
+        if reason is None:
+            ret = self.render_chapters(common, split, chunk_deps, idstart - 1)
+            if ret is None:
+                reason = "chapters don't render separately"
+        if ret is None:
+            print("[latex2edx] Rendering whole document, not by chapter (%s)" % reason)
+            ret = self.render_document(common, latex, idstart - 1)
+        xhtml, nids = ret
+        plasTeX.idgen = buildcache.IdGenerator(idstart + nids)
+
+        self.renderer.xhtml = xhtml
+        with codecs.open(self.output_fn, 'w', encoding='utf8') as fp:
+            fp.write(xhtml)
+        msg = "XHTML generated (%s): %d lines" % (self.output_fn, len(xhtml.split('\n')))
+        if self.build_cache is not None:
+            msg += ", build cache: %s" % self.build_cache.summary()
+        print(msg)
+        return xhtml
+
+    def render_document(self, common, latex, idoffset):
+        '''
+        Render whole document, using the build cache if available.  Returns (xhtml, number of generated ids).
+        '''
+        key = buildcache.hash_strings(common, 'document', latex, buildcache.input_dependencies(latex))
+        entry = self.cache_get(key, 'document', 'xhtml')
+        if entry is None:
+            result = self.render_latex(latex, self.renderer.abox_config)
+            self.use_result(result)
+            entry = {'xhtml': result['xhtml'], 'nids': result['nids'], 'imfnset': result['imfnset'],
+                     'imoptimized': result['imoptimized'],
+                     'abox_config': result['abox_config']}
+            self.cache_put(key, entry)
+        self.renderer.abox_config = entry['abox_config']
+        return buildcache.renumber_ids(entry['xhtml'], idoffset), entry['nids']
+
+    def chapter_source(self, split, k, state, line_drift):
+        '''
+        LaTeX source for rendering chapter k of split source, starting from the given state.
+        '''
+        preamble, chunks, trailer = split
+        linenum, chunk = chunks[k]
+        return buildcache.chunk_source(preamble, linenum, chunk, trailer,
+                                       state['counters'] if k else None, line_drift)
+
+    def chapter_key(self, common, split, chunk_deps, k, state, line_drift):
+        preamble, chunks, trailer = split
+        linenum, chunk = chunks[k]
+        return buildcache.hash_strings(common, 'chapter', preamble, trailer, linenum, chunk, chunk_deps[k], state,
+                                       line_drift)
+
+    def render_chapters(self, common, split, chunk_deps, idoffset):
+        '''
+        Render document one chapter at a time, using the build cache if available.  Each
+        chapter is rendered with the preamble and trailer, starting from the counters and
+        answer box configuration left by the previous chapter.  Returns (xhtml, number
+        of generated ids), or None if the chapter renderings don't fit together.
+        '''
+        preamble, chunks, trailer = split
+
+        # the base document, with no chapters
+        key = buildcache.hash_strings(common, 'base', preamble, trailer, buildcache.input_dependencies(preamble))
+        base = self.cache_get(key, 'preamble')
+        if base is None:
+            result = self.render_latex(preamble + '\n' + trailer)
+            ret = buildcache.course_children(result['xhtml'])
+            if ret is None:
+                return None
+            self.copy_images(result)
+            base = {'xhtml': result['xhtml'], 'prefix': ret[2], 'nids': result['nids'],
+                    'line_drift': result['line_drift'], 'counters': result['counters']}
+            self.cache_put(key, base)
+
+        # ids generated for the preamble come first, then those for the chapters, in order
+        nbase = base['nids']
+        nids = nbase
+        line_drift = 0
+        state = {'counters': base['counters'], 'abox_config': {}}
+        fragments = []
+        predicted = None	# renderings done in parallel, from predicted starting states
+        for k in range(len(chunks)):
+            key = self.chapter_key(common, split, chunk_deps, k, state, line_drift)
+            entry = self.cache_get(key, 'chapter %d' % (k + 1), 'fragment')
+            if entry is None:
+                if predicted is None and self.render_processes > 1 and k < len(chunks) - 1:
+                    predicted = self.render_chapters_parallel(common, split, chunk_deps, k, state,
+                                                              line_drift, base)
+                start, result = (predicted or {}).get(k, (None, None))
+                if start != [state, line_drift]:
+                    if result is not None:
+                        print("[latex2edx] Chapter %d starting state was mispredicted; rendering again" % (k + 1))
+                    result = self.render_latex(self.chapter_source(split, k, state, line_drift),
+                                               copy.deepcopy(state['abox_config']))
+                fragment = buildcache.extract_chapters(result['xhtml'], base['prefix'])
+                if fragment is None:
+                    return None
+                self.use_result(result)
+                entry = {'fragment': fragment,
+                         'nids': result['nids'] - nbase,
+                         'line_drift': result['line_drift'] - base['line_drift'],
+                         'imfnset': result['imfnset'],
+                         'imoptimized': result['imoptimized'],
+                         'state': {'counters': result['counters'],
+                                   'abox_config': result['abox_config']}}
+                self.cache_put(key, entry)
+            fragments.append(buildcache.renumber_ids(entry['fragment'], idoffset + nids - nbase,
+                                                     nbase, idoffset))
+            nids += entry['nids']
+            line_drift += entry['line_drift']
+            state = entry['state']
+
+        self.renderer.abox_config = state['abox_config']
+        base_xhtml = buildcache.renumber_ids(base['xhtml'], idoffset)
+        return buildcache.stitch_chapters(base_xhtml, fragments), nids
+
+    def render_chapters_parallel(self, common, split, chunk_deps, kstart, state, line_drift, base):
+        '''
+        Render chapters kstart onwards in a pool of processes.  The state at the start of
+        each chapter depends on the chapters before it, so it is predicted: first the effect
+        of each chapter on the counters is found, by parsing (in parallel) each chapter on
+        its own, then each chapter is rendered (in parallel) from its predicted starting state.
+
+        Returns dict with key = chapter index, value = ([state, line_drift], result), where
+        state and line_drift are those predicted at the start of the chapter.  The caller
+        must check the predictions, as the chapters before are done.
+        '''
+        chapters = list(range(kstart, len(split[1])))
+        try:
+            pickle.dumps(self.renderer_args)
+        except Exception as err:
+            print("[latex2edx] Cannot render in parallel, since renderer arguments (e.g. extra_filters) "
+                  "cannot be sent to other processes: %s" % err)
+            return {}
+
+        def make_job(k, latex, abox_config, parse_only=False):
+            # plasTeX writes the XHTML to a file and reads it back, so each process needs its own file
+            output_fn = '%s.%d' % (self.output_fn, k)
+            return {'latex_string': latex, 'input_fn': self.input_fn, 'output_fn': output_fn,
+                    'renderer_args': self.renderer_args, 'abox_config': abox_config,
+                    'verbose': self.verbose, 'parse_only': parse_only}
+
+        base_state = {'counters': base['counters'], 'abox_config': {}}
+        nproc = min(self.render_processes, len(chapters))
+        with self.profiler.measure('parallel render'):
+            with multiprocessing.Pool(nproc) as pool:
+                # chapters setting answer box defaults are rendered, to find the new defaults
+                jobs = [make_job(k, self.chapter_source(split, k, base_state, 0), {},
+                                 parse_only=not ABOX_CONFIG.search(split[1][k][1]))
+                        for k in chapters[:-1]]
+                effects = pool.map(parallel_render_job, jobs, chunksize=1)
+
+                starts = [[state, line_drift]]
+                for k, effect in zip(chapters, effects):
+                    abox_config = copy.deepcopy(state['abox_config'])
+                    abox_config.update(effect.get('abox_config', {}))
+                    state = {'counters': predict_counters(state['counters'], base['counters'], effect),
+                             'abox_config': abox_config}
+                    line_drift += effect['line_drift'] - base['line_drift']
+                    starts.append([state, line_drift])
+
+                todo = []
+                for k, start in zip(chapters, starts):
+                    if self.build_cache is not None and os.path.exists(self.build_cache.entry_fn(
+                            self.chapter_key(common, split, chunk_deps, k, start[0], start[1]))):
+                        continue
+                    todo.append((k, start))
+                jobs = [make_job(k, self.chapter_source(split, k, start[0], start[1]),
+                                 copy.deepcopy(start[0]['abox_config'])) for (k, start) in todo]
+                results = pool.map(parallel_render_job, jobs, chunksize=1)
+        print("[latex2edx] Rendered %d chapters in parallel, using %d processes" % (len(todo), nproc))
+        return dict((k, (start, result)) for ((k, start), result) in zip(todo, results))
 
     @property
     def xhtml(self):
+        '''
+        The XHTML, as a string.  If it was rendered to an XML tree, then it is read from the output file.
+        '''
+        if self.renderer.xml is not None:
+            with codecs.open(self.output_fn, encoding='utf8') as fp:
+                return fp.read()
         return self.renderer.xhtml
+
+    @property
+    def xml(self):
+        '''
+        The rendered XML tree, or None if the XHTML was rendered as a string.
+        '''
+        return self.renderer.xml
     
     def do_fix_plastex_optarg_bug(self, texstring):
         '''
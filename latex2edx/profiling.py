@@ -0,0 +1,126 @@
+'''
+Timing and memory instrumentation for latex2edx builds.
+
+A BuildProfiler records wall time, CPU time, and peak memory (as traced by
+tracemalloc) for each stage of a build (plasTeX parsing and rendering, XHTML
+post-processing, XML parsing, export) and for each XML fix filter.  A
+disabled profiler (the default) makes measure() a no-op, so code can be
+instrumented unconditionally.
+
+The results are available as a text table (report), a dict (as_dict), or a
+JSON file (save_json), e.g. for tracking build performance in CI.  Memory
+tracing, started by the first measurement, is stopped by stop(), which is
+also done on reporting (and at the end of latex2edx.convert).
+'''
+
+import json
+import time
+import tracemalloc
+
+from contextlib import contextmanager
+
+try:
+    from collections import OrderedDict
+except:
+    from ordereddict import OrderedDict
+
+
+class BuildProfiler(object):
+    '''
+    Record wall time, CPU time and peak traced memory for named parts of a build.
+    Repeated measurements with the same name are accumulated.
+    '''
+
+    def __init__(self, enabled=True, trace_memory=True):
+        self.enabled = enabled
+        self.trace_memory = trace_memory and enabled
+        self.records = OrderedDict()
+        self.stack = []			# open measurements, each a dict with the peak memory of its children
+        self.started_tracemalloc = False
+
+    def start(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracemalloc = True
+
+    def stop(self):
+        '''
+        Stop memory tracing, if it was started by this profiler.
+        '''
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+            self.started_tracemalloc = False
+
+    def record(self, name, kind, wall, cpu, peak_memory=None, calls=1):
+        '''
+        Add a measurement for name, of the given kind (eg stage, filter, pass).
+        '''
+        rec = self.records.get(name)
+        if rec is None:
+            rec = OrderedDict(name=name, kind=kind, calls=0, wall=0.0, cpu=0.0, peak_memory=None)
+            self.records[name] = rec
+        rec['calls'] += calls
+        rec['wall'] += wall
+        rec['cpu'] += cpu
+        if peak_memory is not None:
+            rec['peak_memory'] = max(rec['peak_memory'] or 0, peak_memory)
+
+    @contextmanager
+    def measure(self, name, kind='stage'):
+        '''
+        Context manager measuring the enclosed code.  Measurements may be nested;
+        the peak memory of an outer measurement includes the peaks of the inner ones.
+        '''
+        if not self.enabled:
+            yield
+            return
+        self.start()
+        frame = {'peak': 0}
+        if self.trace_memory:
+            if self.stack:		# save parent's peak so far, before resetting the peak for this measurement
+                self.stack[-1]['peak'] = max(self.stack[-1]['peak'], tracemalloc.get_traced_memory()[1])
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+        self.stack.append(frame)
+        wall0 = time.perf_counter()
+        cpu0 = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall0
+            cpu = time.process_time() - cpu0
+            self.stack.pop()
+            peak = None
+            if self.trace_memory and tracemalloc.is_tracing():
+                peak = max(tracemalloc.get_traced_memory()[1], frame['peak'])
+                if self.stack:
+                    self.stack[-1]['peak'] = max(self.stack[-1]['peak'], peak)
+            self.record(name, kind, wall, cpu, peak)
+
+    def sorted_records(self):
+        return sorted(self.records.values(), key=lambda x: x['wall'], reverse=True)
+
+    def as_dict(self):
+        return OrderedDict(trace_memory=self.trace_memory,
+                           records=self.sorted_records())
+
+    def save_json(self, fn):
+        self.stop()
+        with open(fn, 'w') as fp:
+            fp.write(json.dumps(self.as_dict(), indent=2))
+
+    def report(self):
+        '''
+        Return text table of all measurements, sorted by decreasing wall time.  Stops memory tracing.
+        '''
+        self.stop()
+        lines = ["%-50s %-7s %7s %10s %10s %10s" % ('stage / filter', 'kind', 'calls', 'wall (s)', 'cpu (s)', 'peak (MB)'),
+                 '-' * 99]
+        for rec in self.sorted_records():
+            if rec['peak_memory'] is None:
+                peak = '-'
+            else:
+                peak = '%.1f' % (rec['peak_memory'] / 1.0e6)
+            lines.append("%-50s %-7s %7d %10.3f %10.3f %10s" % (rec['name'][:50], rec['kind'], rec['calls'],
+                                                                rec['wall'], rec['cpu'], peak))
+        return '\n'.join(lines)
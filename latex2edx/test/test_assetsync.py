@@ -0,0 +1,125 @@
+import os
+import shutil
+import unittest
+try:
+    from path import path	# needs path.py
+except Exception as err:
+    from path import Path as path
+
+import latex2edx as l2emod
+from latex2edx.assetsync import AssetSync
+from latex2edx.main import latex2edx
+from latex2edx.test.util import make_temp_directory
+
+
+class TestAssetSync(unittest.TestCase):
+
+    def write(self, fn, data):
+        with open(fn, 'w') as fp:
+            fp.write(data)
+
+    def test_copy(self):
+        with make_temp_directory() as tmdir:
+            os.chdir(tmdir)
+            os.mkdir('my figs')
+            os.mkdir('static')
+            self.write('my figs/a b.png', 'image a')
+            os.chmod('my figs/a b.png', 0o600)
+            assets = AssetSync()
+            self.assertTrue(assets.copy('my figs/a b.png', 'static'))
+            self.assertEqual(open('static/a b.png').read(), 'image a')
+            self.assertEqual(os.stat('static/a b.png').st_mode & 0o044, 0o044)
+            self.assertEqual(os.stat('my figs/a b.png').st_mode & 0o777, 0o600)	# source left alone
+            self.assertTrue(assets.copy('my figs/a b.png', 'static/a b.png'))
+            self.assertEqual((assets.ncopied + assets.ncloned, assets.nrepeated), (1, 1))
+
+            # a new build finds the file unchanged, and leaves it alone
+            assets = AssetSync()
+            mtime = os.path.getmtime('static/a b.png')
+            self.assertTrue(assets.copy('my figs/a b.png', 'static/a b.png'))
+            self.assertEqual(assets.nunchanged, 1)
+            self.assertEqual(os.path.getmtime('static/a b.png'), mtime)
+
+            # changed source is copied again
+            self.write('my figs/a b.png', 'image a, version 2')
+            self.assertTrue(AssetSync().copy('my figs/a b.png', 'static'))
+            self.assertEqual(open('static/a b.png').read(), 'image a, version 2')
+
+            self.assertFalse(assets.copy('missing.png', 'static'))
+            self.assertIn('1 failed', assets.summary())
+            self.assertEqual([fn for fn in os.listdir('static') if fn.endswith('.tmp')], [])
+
+    def test_links(self):
+        with make_temp_directory() as tmdir:
+            os.chdir(tmdir)
+            os.mkdir('static')
+            self.write('a.png', 'image a')
+            os.chmod('a.png', 0o644)
+            assets = AssetSync()
+            assets.copy('a.png', 'static')
+            self.assertEqual(assets.ncopied + assets.ncloned + assets.nlinked, 1)
+            if assets.nlinked:
+                self.assertTrue(os.path.samefile('a.png', 'static/a.png'))
+            assets = AssetSync(links=False)
+            assets.copy('a.png', 'static/b.png')
+            self.assertEqual(assets.ncopied, 1)
+            self.assertFalse(os.path.samefile('a.png', 'static/b.png'))
+            self.assertEqual(assets.nbytes, 7)
+
+    def test_copy_files(self):
+        with make_temp_directory() as tmdir:
+            os.chdir(tmdir)
+            for fn in ['q_dnd.png', 'q_dnd_label1.png', 'other.png', 'q.tex']:
+                self.write(fn, fn)
+            assets = AssetSync()
+            self.assertEqual(assets.copy_files(path(tmdir) / 'q*.png', 'static/images/q'), 2)
+            self.assertEqual(sorted(os.listdir('static/images/q')), ['q_dnd.png', 'q_dnd_label1.png'])
+            self.assertEqual(assets.copy_files('none*.png', 'static/images/q'), 0)
+
+    def test_image_used_twice(self):
+        '''
+        An image used several times in a course is copied once.
+        '''
+        testdir = path(l2emod.__file__).parent / 'testtex'
+        with make_temp_directory() as tmdir:
+            os.chdir(tmdir)
+            shutil.copy(testdir / 'example-image.png', 'fig.png')
+            self.write('test.tex', '\\begin{edXcourse}{1.00x}{1.00x Fall 2013}[url_name=2013_Fall]\n\n'
+                       '\\begin{edXchapter}{Unit 1}[url_name=unit1]\n\n'
+                       '\\begin{edXsection}{Intro}[url_name=intro]\n\n'
+                       '\\begin{edXtext}{Figure}[url_name=fig]\n'
+                       '\\includegraphics{fig} \\includegraphics[width=2in]{fig}\n'
+                       '\\end{edXtext}\n\\end{edXsection}\n\\end{edXchapter}\n\\end{edXcourse}\n')
+            l2e = latex2edx('test.tex', output_dir=tmdir, add_wrap=True)
+            l2e.convert()
+            self.assertEqual(l2e.assets.nrepeated, 1)
+            self.assertEqual(l2e.assets.ncopied + l2e.assets.ncloned + l2e.assets.nlinked, 1)
+            self.assertTrue(os.path.exists('static/images/fig.png'))
+
+    def test_parallel_render(self):
+        '''
+        Images used by chapters rendered in other processes are copied, and counted, by the build's AssetSync.
+        '''
+        testdir = path(l2emod.__file__).parent / 'testtex'
+        with make_temp_directory() as tmdir:
+            os.chdir(tmdir)
+            shutil.copy(testdir / 'example-image.png', 'fig.png')
+            chapters = ''.join('\\begin{edXchapter}{Unit %d}[url_name=unit%d]\n\n'
+                               '\\begin{edXsection}{Intro}[url_name=intro%d]\n\n'
+                               '\\begin{edXtext}{Figure}[url_name=fig%d]\n'
+                               '\\includegraphics{fig}\n'
+                               '\\end{edXtext}\n\\end{edXsection}\n\\end{edXchapter}\n\n' % (k, k, k, k)
+                               for k in range(3))
+            self.write('test.tex', '\\begin{edXcourse}{1.00x}{1.00x Fall 2013}[url_name=2013_Fall]\n\n' +
+                       chapters + '\\end{edXcourse}\n')
+            l2e = latex2edx('test.tex', output_dir=tmdir, add_wrap=True, build_cache=os.path.join(tmdir, 'bcache'),
+                            render_processes=3)
+            l2e.convert()
+            self.assertEqual(l2e.assets.ncopied + l2e.assets.ncloned + l2e.assets.nlinked, 1)
+            self.assertEqual(l2e.assets.nrepeated, 2)
+            self.assertTrue(os.path.exists('static/images/fig.png'))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
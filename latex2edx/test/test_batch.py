@@ -0,0 +1,70 @@
+import os
+import unittest
+try:
+    from path import path	# needs path.py
+except Exception as err:
+    from path import Path as path
+
+import latex2edx as l2emod
+from latex2edx.main import latex2edx
+from latex2edx.batch import convert_batch, load_manifest, summary
+from latex2edx.test.util import make_temp_directory
+
+
+class TestBatch(unittest.TestCase):
+
+    def make_variants(self, tmdir, names):
+        testdir = path(l2emod.__file__).parent / 'testtex'
+        for name in names:
+            os.mkdir('%s/%s' % (tmdir, name))
+            os.system('cp %s/* %s/%s' % (testdir, tmdir, name))
+
+    def test_batch_manifest(self):
+        with make_temp_directory() as tmdir:
+            os.chdir(tmdir)
+            self.make_variants(tmdir, ['fall', 'spring'])
+            with open('manifest.yaml', 'w') as fp:
+                fp.write('\n'.join(['defaults:',
+                                    '  output_dir: course',
+                                    'jobs:',
+                                    '  - tex: example1.tex',
+                                    '    dir: fall',
+                                    '  - tex: missing.tex',
+                                    '    dir: fall',
+                                    '  - tex: example1.tex',
+                                    '    dir: spring',
+                                    '    log: spring.log',
+                                    '']))
+            jobs = load_manifest('manifest.yaml')
+            self.assertEqual(jobs[2]['dir'], '%s/spring' % tmdir)
+            self.assertEqual(jobs[2]['output_dir'], 'course')
+
+            results = convert_batch(jobs)
+            self.assertEqual(os.getcwd(), tmdir)
+            self.assertEqual([res.ok for res in results], [True, False, True])
+            self.assertIn('missing.tex', results[1].error)
+            report = summary(results)
+            print(report)
+            self.assertIn('3 jobs, 2 succeeded, 1 failed', report)
+            self.assertTrue(os.path.exists('spring/spring.log'))
+
+            # batch output is the same as that of a separate run
+            os.chdir('%s/fall' % tmdir)
+            xbfn = '%s/fall/example1.xbundle' % tmdir
+            expected = open(xbfn).read()
+            latex2edx('example1.tex', output_dir='course').convert()
+            self.assertEqual(open(xbfn).read(), expected)
+            self.assertEqual(open('%s/spring/example1.xbundle' % tmdir).read(), expected)
+
+    def test_batch_pool(self):
+        with make_temp_directory() as tmdir:
+            os.chdir(tmdir)
+            self.make_variants(tmdir, ['a', 'b'])
+            jobs = [{'tex': 'example1.tex', 'dir': '%s/%s' % (tmdir, name)} for name in ['a', 'b']]
+            results = convert_batch(jobs, processes=2, defaults={'output_dir': 'course'})
+            self.assertEqual([res.ok for res in results], [True, True])
+            self.assertTrue(os.path.exists('%s/b/course/course.xml' % tmdir))
+
+
+if __name__ == '__main__':
+    unittest.main()
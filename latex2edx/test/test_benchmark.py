@@ -0,0 +1,45 @@
+import json
+import os
+import unittest
+
+from lxml import etree
+from latex2edx.benchmark import make_course, run_benchmark, report, compare, scaling_exponent, superlinear_stages
+from latex2edx.test.util import make_temp_directory
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_make_course(self):
+        tex = make_course(chapters=3, sections=2, problems=2, aboxes=3, equations=1, images=0)
+        self.assertEqual(tex.count('\\begin{edXchapter}'), 3)
+        self.assertEqual(tex.count('\\begin{edXproblem}'), 12)
+        self.assertEqual(tex.count('\\edXabox'), 36)
+        self.assertEqual(tex.count('\\label{eq:'), 6)
+        self.assertNotIn('includegraphics', tex)
+
+    def test_scaling_exponent(self):
+        sizes = [1, 2, 4, 8]
+        self.assertAlmostEqual(scaling_exponent(sizes, [0.1 * n ** 2 for n in sizes]), 2.0)
+        self.assertLess(scaling_exponent(sizes, [1.0 + 0.1 * n for n in sizes]), 1.0)
+        self.assertIsNone(scaling_exponent(sizes, [0.0001] * 4))
+
+    def test_run_benchmark(self):
+        with make_temp_directory() as tmdir:
+            results = run_benchmark([1, 2], tmdir, vary='chapters', params={'sections': 1, 'problems': 1})
+            self.assertEqual([run['size'] for run in results['runs']], [1, 2])
+            self.assertIn('plastex2xhtml', results['scaling'])
+            self.assertIn('handle_refs', results['scaling'])
+            self.assertTrue(results['runs'][0]['peak_memory'] > 0)
+            xb = etree.parse('%s/chapters_2/synthetic.xbundle' % tmdir)
+            self.assertEqual(len(xb.findall('.//chapter')), 2)
+            self.assertEqual(len(xb.findall('.//problem')), 2)
+            self.assertTrue(os.path.exists('%s/chapters_2/course/static/images/example-image.png' % tmdir))
+
+            results = json.loads(json.dumps(results))	# results are saved as JSON
+            print(report(results))
+            print(compare(results, results))
+            self.assertIsInstance(superlinear_stages(results), list)
+
+
+if __name__ == '__main__':
+    unittest.main()
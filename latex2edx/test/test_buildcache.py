@@ -0,0 +1,83 @@
+import os
+import unittest
+try:
+    from path import path	# needs path.py
+except Exception as err:
+    from path import Path as path
+
+import latex2edx as l2emod
+from latex2edx.main import latex2edx
+from latex2edx import buildcache
+from latex2edx.test.util import make_temp_directory
+
+
+class TestBuildCache(unittest.TestCase):
+
+    def test_split_chapters(self):
+        tex = '\n'.join(['\\begin{edXcourse}{1.00x}{1.00x Fall 2013}',
+                         '\\begin{edXchapter}{A}',
+                         'a',
+                         '\\end{edXchapter}',
+                         '',
+                         '\\begin{edXchapter*}{B}',
+                         'b',
+                         '\\end{edXchapter*}',
+                         '\\end{edXcourse}'])
+        preamble, chunks, trailer = buildcache.split_chapters(tex)
+        self.assertEqual(preamble, '\\begin{edXcourse}{1.00x}{1.00x Fall 2013}')
+        self.assertEqual([linenum for (linenum, chunk) in chunks], [1, 5])
+        self.assertTrue(chunks[0][1].endswith('\\end{edXchapter}\n'))
+        self.assertEqual(trailer, '\\end{edXcourse}')
+        self.assertIsNone(buildcache.unsplittable_reason((preamble, chunks, trailer), [[], []]))
+        self.assertIsNotNone(buildcache.unsplittable_reason((preamble, [(1, '\\newcommand{\\x}{y}')], trailer), [[]]))
+        self.assertIsNone(buildcache.split_chapters('\\begin{edXchapter}{A}\n'))
+
+    def test_renumber_ids(self):
+        self.assertEqual(buildcache.renumber_ids('<a id="a0000000001"/><b id="a0000000003"/>', 10, 1, 2),
+                         '<a id="a0000000003"/><b id="a0000000013"/>')
+
+    def test_renderer_dependencies(self):
+        deps = buildcache.renderer_dependencies()
+        self.assertIn('plastexpy/edXpsl.py', [fn for (fn, sha1) in deps])
+        self.assertIn('render/edXpsl.zpts', [fn for (fn, sha1) in deps])
+        self.assertTrue(all(len(sha1) == 40 for (fn, sha1) in deps))
+
+    def test_incremental_build(self):
+        testdir = path(l2emod.__file__).parent / 'testtex'
+        fn = testdir / 'example12_index.tex'
+        print("file %s" % fn)
+        with make_temp_directory() as tmdir:
+            nfn = '%s/%s' % (tmdir, fn.basename())
+            os.system('cp %s/* %s' % (testdir, tmdir))
+            os.chdir(tmdir)
+            cachedir = '%s/cache' % tmdir
+
+            l2e = latex2edx(nfn, output_dir=tmdir)
+            l2e.convert()
+            xbfn = nfn[:-4] + '.xbundle'
+            expected = open(xbfn).read()
+
+            l2e = latex2edx(nfn, output_dir=tmdir, build_cache=cachedir)
+            l2e.convert()
+            self.assertEqual(len(l2e.build_cache.reused), 0)
+            self.assertEqual(len(l2e.build_cache.rendered), 4)	# preamble and three chapters
+            self.assertEqual(open(xbfn).read(), expected)
+
+            l2e = latex2edx(nfn, output_dir=tmdir, build_cache=cachedir)
+            l2e.convert()
+            self.assertEqual(len(l2e.build_cache.rendered), 0)
+            self.assertEqual(open(xbfn).read(), expected)
+            self.assertTrue(l2e.xb.nunchanged > 0)
+
+            # change the second chapter: only it gets rendered again
+            tex = open(nfn).read().replace("More discussion regarding 'topic.'", "More discussion regarding 'things.'")
+            open(nfn, 'w').write(tex)
+            l2e = latex2edx(nfn, output_dir=tmdir, build_cache=cachedir)
+            l2e.convert()
+            self.assertEqual(l2e.build_cache.rendered, ['chapter 2'])
+            expected = expected.replace("More discussion regarding 'topic.'", "More discussion regarding 'things.'")
+            self.assertEqual(open(xbfn).read(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -57,6 +57,7 @@ class TestCustomHtml(unittest.TestCase):
             html = xml.find('.//html')
             self.assertTrue(html.get('display_name') == 'My Name')
             self.assertIn('<span style="display:none;color:red;border-style:solid" data-x="3">this is red text with a border </span>', str(l2e.xb))
+            self.assertEqual(l2e.ncustom_html, 1)
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,283 @@
+import json
+import os
+import tarfile
+import unittest
+try:
+    from path import path	# needs path.py
+except Exception as err:
+    from path import Path as path
+
+from lxml import etree
+import latex2edx as l2emod
+from latex2edx.main import latex2edx
+from latex2edx.xbundle import XBundle
+from latex2edx.filewriter import FileWriter, FileWriteError, TarWriter
+from latex2edx.test.util import make_temp_directory
+
+
+class TestFileWriter(unittest.TestCase):
+
+    def test_write(self):
+        for jobs in [1, 4]:
+            with make_temp_directory() as tmdir:
+                fw = FileWriter(jobs=jobs)
+                fw.mkdir(os.path.join(tmdir, 'a/b'))
+                for k in range(50):
+                    fw.write(os.path.join(tmdir, 'a/b/f%d.xml' % k), '<p>%d</p>\n' % k)
+                for k in range(20):		# later writes to the same file win
+                    fw.write(os.path.join(tmdir, 'a/last.xml'), b'%d' % k)
+                fw.wait()
+                self.assertEqual(fw.nwritten, 70)
+                self.assertEqual(sorted(os.listdir(os.path.join(tmdir, 'a'))), ['b', 'last.xml'])
+                self.assertEqual(len(os.listdir(os.path.join(tmdir, 'a/b'))), 50)	# no temporary files left
+                self.assertEqual(open(os.path.join(tmdir, 'a/b/f7.xml')).read(), '<p>7</p>\n')
+                self.assertEqual(open(os.path.join(tmdir, 'a/last.xml')).read(), '19')
+                fw.close()
+
+    def test_errors(self):
+        with make_temp_directory() as tmdir:
+            fw = FileWriter(jobs=4)
+            fw.write(os.path.join(tmdir, 'ok.xml'), 'ok')
+            fw.write(os.path.join(tmdir, 'missing/bad.xml'), 'bad')
+            with self.assertRaises(FileWriteError) as cm:
+                fw.wait()
+            self.assertEqual([fn for (fn, err) in cm.exception.errors], [os.path.join(tmdir, 'missing/bad.xml')])
+            self.assertTrue(os.path.exists(os.path.join(tmdir, 'ok.xml')))
+            fw.wait()				# errors are reported once
+            with self.assertRaises(OSError):
+                FileWriter().write(os.path.join(tmdir, 'missing/bad.xml'), 'bad')
+
+    def test_close(self):
+        with make_temp_directory() as tmdir:
+            fw = FileWriter(jobs=4)
+            fw.write(os.path.join(tmdir, 'a.xml'), 'a')
+            fw.close()
+            self.assertIsNone(fw.pool)		# threads stopped
+            fw.write(os.path.join(tmdir, 'b.xml'), 'b')	# and started again if needed
+            fw.close()
+            self.assertIsNone(fw.pool)
+            self.assertEqual(fw.nwritten, 2)
+
+            # threads are stopped after a build, even if not exported to a directory
+            tex = os.path.join(tmdir, 'test.tex')
+            with open(tex, 'w') as fp:
+                fp.write('\\begin{edXcourse}{1.00x}{1.00x Fall 2013}[url_name=2013_Fall]\n'
+                         '\\begin{edXchapter}{Unit 1}[url_name=unit1]\n'
+                         '\\end{edXchapter}\n\\end{edXcourse}\n')
+            for xml_only in [False, True]:
+                l2e = latex2edx(tex, output_dir=tmdir, add_wrap=True, xml_only=xml_only, jobs=4)
+                l2e.convert()
+                self.assertIsNone(l2e.writer.pool)
+
+    def test_mkdir_cache(self):
+        with make_temp_directory() as tmdir:
+            fw = FileWriter()
+            fw.mkdir(os.path.join(tmdir, 'x'))
+            os.rmdir(os.path.join(tmdir, 'x'))
+            fw.mkdir(os.path.join(tmdir, 'x'))	# known, so not checked again
+            self.assertFalse(os.path.exists(os.path.join(tmdir, 'x')))
+
+    def test_skip_unchanged(self):
+        for jobs in [1, 4]:
+            with make_temp_directory() as tmdir:
+                fns = [os.path.join(tmdir, 'f%d.xml' % k) for k in range(3)]
+                fw = FileWriter(jobs=jobs)
+                for fn in fns:
+                    fw.write(fn, '<p>one</p>')
+                fw.wait()
+                for fn in fns:
+                    os.utime(fn, (1000, 1000))
+                fw = FileWriter(jobs=jobs)
+                fw.write(fns[0], '<p>one</p>')		# unchanged
+                fw.write(fns[1], '<p>two</p>')		# same size, different content
+                fw.write(fns[2], '<p>three</p>')
+                fw.wait()
+                self.assertEqual((fw.nwritten, fw.nunchanged), (2, 1))
+                self.assertEqual([os.path.getmtime(fn) == 1000 for fn in fns], [True, False, False])
+                self.assertEqual(open(fns[1]).read(), '<p>two</p>')
+
+    def test_known_hashes(self):
+        with make_temp_directory() as tmdir:
+            fn = os.path.join(tmdir, 'f.xml')
+            hashes = {}
+            FileWriter(hashes=hashes).write(fn, 'abc')
+            self.assertEqual(list(hashes), [os.path.abspath(fn)])
+            self.assertEqual(hashes[os.path.abspath(fn)][:2], ['a9993e364706816aba3e25717850c26c9cd0d89d', 3])
+            os.utime(fn, (1000, 1000))
+            hashes[os.path.abspath(fn)][2] = 1000 * 10**9
+            fw = FileWriter(hashes=hashes)
+            fw.write(fn, 'abc')			# not read, since its hash is known
+            self.assertEqual((fw.nwritten, fw.nunchanged), (0, 1))
+
+            # a file edited since (even keeping its size) is not trusted, so is written again
+            for edit in ['xyz', 'abcd']:
+                open(fn, 'w').write(edit)
+                fw = FileWriter(hashes=hashes)
+                fw.write(fn, 'abc')
+                self.assertEqual((fw.nwritten, fw.nunchanged), (1, 0))
+                self.assertEqual(open(fn).read(), 'abc')
+            os.unlink(fn)
+            FileWriter(hashes=hashes).write(fn, 'abc')
+            self.assertEqual(open(fn).read(), 'abc')
+
+    def test_manifest(self):
+        with make_temp_directory() as tmdir:
+            fw = FileWriter()
+            fw.mkdir(os.path.join(tmdir, 'out/sub'))
+            fw.write(os.path.join(tmdir, 'out/sub/a.xml'), 'abc', source='a.tex:3')
+            fw.write(os.path.join(tmdir, 'out/b.xml'), 'def')
+            fw.write(os.path.join(tmdir, 'other.xml'), 'ghi')
+            fw.write(os.path.join(tmdir, 'out/c.xml'), 'jkl')
+            fw.remove(os.path.join(tmdir, 'out/c.xml'))
+            fw.write_manifest(os.path.join(tmdir, 'out/manifest.json'), os.path.join(tmdir, 'out'))
+            manifest = json.load(open(os.path.join(tmdir, 'out/manifest.json')))
+            self.assertEqual(manifest, {'sub/a.xml': {'sha1': 'a9993e364706816aba3e25717850c26c9cd0d89d',
+                                                      'source': 'a.tex:3'},
+                                        'b.xml': {'sha1': '589c22335a381f122d129225f5c0ba3056ed5811',
+                                                  'source': None}})
+            self.assertFalse(os.path.exists(os.path.join(tmdir, 'out/c.xml')))
+
+    def test_rebuild_unchanged(self):
+        testdir = path(l2emod.__file__).parent / 'testtex'
+        fn = testdir / 'example12_index.tex'
+        with make_temp_directory() as tmdir:
+            nfn = '%s/%s' % (tmdir, fn.basename())
+            os.system('cp %s/* %s' % (testdir, tmdir))
+            os.chdir(tmdir)
+            l2e = latex2edx(nfn, output_dir=tmdir)
+            l2e.convert()
+            self.assertEqual(l2e.writer.nunchanged, 0)
+            manifest = json.load(open('%s/manifest.json' % tmdir))
+            self.assertEqual(manifest['static/key_map.json']['source'], nfn)
+            self.assertEqual(manifest['chapter/Module_1.xml']['source'], nfn + ':43')
+            self.assertEqual(manifest['problem/p0.xml']['source'], nfn + ':27')
+            mtimes = dict((x, os.path.getmtime('%s/%s' % (tmdir, x))) for x in manifest)
+
+            l2e = latex2edx(nfn, output_dir=tmdir)
+            l2e.convert()
+            self.assertEqual(l2e.writer.nwritten, 0)
+            self.assertEqual(l2e.writer.nunchanged, len(manifest) + 1)	# and the manifest itself
+            self.assertEqual(json.load(open('%s/manifest.json' % tmdir)), manifest)
+            self.assertEqual(dict((x, os.path.getmtime('%s/%s' % (tmdir, x))) for x in manifest), mtimes)
+
+    def test_keep(self):
+        with make_temp_directory() as tmdir:
+            for fn in ['a.txt', 'b.txt']:
+                open('%s/%s' % (tmdir, fn), 'w').write('hello')
+            st = os.stat(tmdir + '/b.txt')
+            fw = FileWriter(hashes={os.path.abspath(tmdir + '/b.txt'): ['known', st.st_size, st.st_mtime_ns]})
+            self.assertTrue(fw.keep(tmdir + '/a.txt', source='x.tex:1'))
+            self.assertTrue(fw.keep(tmdir + '/b.txt'))		# hash taken as known, without reading the file
+            self.assertFalse(fw.keep(tmdir + '/c.txt'))
+            self.assertEqual(fw.manifest, {tmdir + '/a.txt': {'sha1': 'aaf4c61ddcc5e8a2dabede0f3b482cd9aea9434d',
+                                                              'source': 'x.tex:1'},
+                                           tmdir + '/b.txt': {'sha1': 'known', 'source': None}})
+            self.assertEqual(fw.hashes[os.path.abspath(tmdir + '/a.txt')][0], 'aaf4c61ddcc5e8a2dabede0f3b482cd9aea9434d')
+            self.assertEqual((fw.nwritten, fw.nunchanged), (0, 2))
+            self.assertFalse(TarWriter(tmdir + '/course.tar', tmdir).keep(tmdir + '/a.txt'))
+
+    def test_delta_from(self):
+        testdir = path(l2emod.__file__).parent / 'testtex'
+        fn = testdir / 'example12_index.tex'
+        with make_temp_directory() as tmdir:
+            nfn = '%s/%s' % (tmdir, fn.basename())
+            xbfn = nfn[:-4] + '.xbundle'
+            os.system('cp %s/* %s' % (testdir, tmdir))
+            os.chdir(tmdir)
+            l2e = latex2edx(nfn, output_dir=tmdir + '/course', delta_from=xbfn)
+            l2e.convert()
+            self.assertEqual(l2e.xb.unchanged_units, set())		# no previous xbundle
+            tex = open(nfn).read()
+            open(nfn, 'w').write(tex.replace('Enter the value of $\\pi$', 'Enter the value of $\\pi$ (3.14159...)'))
+            l2e = latex2edx(nfn, output_dir=tmdir + '/course', delta_from=xbfn)
+            l2e.convert()
+            self.assertIn(('html', 'text-L1'), l2e.xb.unchanged_units)
+            self.assertNotIn(('problem', 'p0'), l2e.xb.unchanged_units)
+            self.assertEqual(l2e.writer.nwritten, 2)		# the problem, and the manifest
+            l2e = latex2edx(nfn, output_dir=tmdir + '/full')
+            l2e.convert()
+            for fn in l2e.writer.manifest:
+                self.assertEqual(open(fn).read(), open(fn.replace('/full/', '/course/')).read())
+            self.assertEqual(open(tmdir + '/full/manifest.json').read(), open(tmdir + '/course/manifest.json').read())
+
+    def test_export_jobs(self):
+        cxml = '<course semester="2013_Spring" course="mitx.01">%s</course>' % ''.join(
+            '<chapter display_name="C%d"><sequential display_name="S%d">%s</sequential></chapter>' % (
+                c, c, ''.join('<problem display_name="P%d"><p>%d</p></problem>' % (p, p) for p in range(10)))
+            for c in range(5))
+        files = []
+        for jobs in [1, 4]:
+            xb = XBundle(force_studio_format=True, jobs=jobs)
+            xb.set_course(etree.XML(cxml))
+            with make_temp_directory() as tmdir:
+                xb.export_to_directory(tmdir, xml_only=True)
+                files.append(dict((os.path.relpath(os.path.join(root, fn), tmdir), open(os.path.join(root, fn)).read())
+                                  for (root, dirs, fns) in os.walk(tmdir) for fn in fns))
+        self.assertEqual(len(files[0]), 2 + 5 + 5 + 50 + 50)	# course, chapters, sequentials, verticals, problems
+        self.assertEqual(files[0], files[1])
+
+    def test_tar_writer(self):
+        with make_temp_directory() as tmdir:
+            root = os.path.join(tmdir, 'out')
+            os.makedirs(os.path.join(root, 'static/images'))
+            open(os.path.join(root, 'static/images/a.png'), 'w').write('png')
+            open(os.path.join(root, 'static/b.js'), 'w').write('on disk')
+            tarfn = os.path.join(tmdir, 'course.tar.gz')
+            tw = TarWriter(tarfn, root, static_dirs=['static'])
+            tw.mkdir(os.path.join(root, 'chapter'))
+            tw.write(os.path.join(root, 'chapter/c.xml'), '<chapter/>')
+            tw.write(os.path.join(root, 'static/b.js'), 'written')
+            with self.assertRaises(Exception):
+                tw.write(os.path.join(tmdir, 'outside.xml'), 'x')
+            tw.close()
+            self.assertFalse(os.path.exists(os.path.join(root, 'chapter')))
+            with tarfile.open(tarfn) as tar:
+                members = dict((x.name, tar.extractfile(x).read()) for x in tar.getmembers())
+            self.assertEqual(members, {'course/chapter/c.xml': b'<chapter/>',
+                                       'course/static/b.js': b'written',
+                                       'course/static/images/a.png': b'png'})
+
+    def test_export_tarball(self):
+        cxml = '<course semester="2013_Spring" course="mitx.01"><chapter display_name="C">%s</chapter></course>' % ''.join(
+            '<sequential display_name="S%d"><problem display_name="P%d"><p>%d</p></problem></sequential>' % (k, k, k)
+            for k in range(3))
+        with make_temp_directory() as tmdir:
+            xb = XBundle()
+            xb.set_course(etree.XML(cxml))
+            xb.export_to_directory(tmdir, xml_only=True)
+            cdir = os.path.join(tmdir, 'mitx.01')
+            files = dict(('course/' + os.path.relpath(os.path.join(root, fn), cdir), open(os.path.join(root, fn), 'rb').read())
+                         for (root, dirs, fns) in os.walk(cdir) for fn in fns)
+            xb = XBundle()
+            xb.set_course(etree.XML(cxml))
+            tarfn = os.path.join(tmdir, 'course.tar.gz')
+            xb.export_to_tarball(tarfn, xml_only=True)
+            with tarfile.open(tarfn) as tar:
+                members = dict((x.name, tar.extractfile(x).read()) for x in tar.getmembers())
+        self.assertIn('course/course.xml', members)
+        self.assertEqual(members, files)
+
+    def test_latex2edx_tarball(self):
+        testdir = path(l2emod.__file__).parent / 'testtex'
+        fn = testdir / 'example12_index.tex'
+        with make_temp_directory() as tmdir:
+            nfn = '%s/%s' % (tmdir, fn.basename())
+            os.system('cp %s/* %s' % (testdir, tmdir))
+            os.chdir(tmdir)
+            latex2edx(nfn, output_dir='%s/dir' % tmdir).convert()
+            files = dict(('course/' + os.path.relpath(os.path.join(root, fn), '%s/dir' % tmdir),
+                          open(os.path.join(root, fn), 'rb').read())
+                         for (root, dirs, fns) in os.walk('%s/dir' % tmdir) for fn in fns)
+            tarfn = '%s/course.tar.gz' % tmdir
+            l2e = latex2edx(nfn, output_dir='%s/tar' % tmdir, output_tarball=tarfn)
+            l2e.convert()
+            self.assertFalse(os.path.exists('%s/tar/course.xml' % tmdir))
+            with tarfile.open(tarfn) as tar:
+                members = dict((x.name, tar.extractfile(x).read()) for x in tar.getmembers())
+        self.assertIn('course/static/key_map.json', members)
+        self.assertEqual(sorted(members), sorted(files))
+        self.assertEqual(members, files)
+
+
+if __name__ == '__main__':
+    unittest.main()
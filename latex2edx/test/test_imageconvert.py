@@ -0,0 +1,136 @@
+import json
+import os
+import shutil
+import unittest
+try:
+    from path import path	# needs path.py
+except Exception as err:
+    from path import Path as path
+
+import latex2edx as l2emod
+from latex2edx.imageconvert import ImageConverter, find_images, image_style
+from latex2edx.main import latex2edx
+from latex2edx.test.util import make_temp_directory
+
+TESTDIR = path(l2emod.__file__).parent / 'testtex'
+
+
+def cache_image(converter, pdffn, dim, pngfn):
+    '''
+    Put pngfn into the cache of converter, as the image made from pdffn scaled to dim.
+    '''
+    key = converter.key(pdffn, dim)
+    shutil.copy(pngfn, os.path.join(converter.cache_dir, key + '.png'))
+    with open(os.path.join(converter.cache_dir, key + '.json'), 'w') as fp:
+        json.dump({'npages': 1}, fp)
+
+
+class TestImageConvert(unittest.TestCase):
+
+    def test_image_style(self):
+        self.assertEqual(image_style(''), (400, ''))
+        self.assertEqual(image_style('width=2in,angle=90'), (220, 'angle:90'))
+        self.assertEqual(image_style('width=0.5\\textwidth'), (385, ''))
+
+    def test_find_images(self):
+        with make_temp_directory() as tmdir:
+            os.chdir(tmdir)
+            with open('part.tex', 'w') as fp:
+                fp.write('\\includegraphics{figs/b}\n')
+            latex = 'x \\includegraphics[width=3in]{a} y \\input{part} \\input{missing}'
+            self.assertEqual(find_images(latex), [('width=3in', 'a'), ('', 'figs/b')])
+
+    def test_key(self):
+        with make_temp_directory() as tmdir:
+            os.chdir(tmdir)
+            for fn in ['a.pdf', 'b.pdf']:
+                with open(fn, 'w') as fp:
+                    fp.write('%PDF-1.4 same')
+            conv = ImageConverter()
+            self.assertEqual(conv.key('a.pdf', 400), conv.key('b.pdf', 400))
+            self.assertNotEqual(conv.key('a.pdf', 400), conv.key('a.pdf', 660))
+            self.assertNotEqual(conv.key('a.pdf', 400), ImageConverter(density=300).key('a.pdf', 400))
+
+    def test_cached(self):
+        '''
+        PDF figures whose images are cached are not converted again, nor are copies of them.
+        '''
+        with make_temp_directory() as tmdir:
+            os.chdir(tmdir)
+            for fn in ['fig.pdf', 'copy.pdf', 'other.pdf']:
+                with open(fn, 'w') as fp:
+                    fp.write('%PDF-1.4 ' + ('other' if fn == 'other.pdf' else 'fig'))
+            with open('done.png', 'w') as fp:
+                fp.write('not converted again')
+            conv = ImageConverter(os.path.join(tmdir, 'cache'))
+            cache_image(conv, 'fig.pdf', 660, TESTDIR / 'example-image.png')
+            conv.convert_all([('width=6in', 'fig'), ('width=6in', 'copy'), ('width=6in', 'fig'),
+                              ('', 'done'), ('', 'missing')])
+            self.assertEqual(conv.reused, ['fig.pdf', 'copy.pdf'])
+            self.assertEqual(conv.converted, [])
+            for fn in ['fig.png', 'copy.png']:
+                self.assertEqual(open(fn, 'rb').read(), open(TESTDIR / 'example-image.png', 'rb').read())
+            self.assertEqual(conv.convert('fig', 660), ['fig'])
+            self.assertEqual(conv.summary(), '0 PDF files converted, 2 reused')
+
+    def test_to_cache(self):
+        '''
+        Images stored in the cache are used for a later copy of the same PDF file.
+        '''
+        with make_temp_directory() as tmdir:
+            os.chdir(tmdir)
+            for fn in ['fig.pdf', 'copy.pdf']:
+                with open(fn, 'w') as fp:
+                    fp.write('%PDF-1.4 fig')
+            shutil.copy(TESTDIR / 'example-image.png', 'fig.png')
+            conv = ImageConverter(os.path.join(tmdir, 'cache'))
+            conv.to_cache(conv.target('copy', 400, 1), ['fig'])
+            key = conv.key('fig.pdf', 400)
+            self.assertEqual(sorted(os.listdir('cache')), [key + '.json', key + '.png'])	# no temporary files left
+            self.assertEqual(conv.from_cache(conv.target('copy', 400, 1)), ['copy'])
+            self.assertEqual(open('copy.png', 'rb').read(), open(TESTDIR / 'example-image.png', 'rb').read())
+
+    def test_latex2edx_cached(self):
+        '''
+        latex2edx uses PNG images from the image cache for PDF figures.
+        '''
+        with make_temp_directory() as tmdir:
+            os.chdir(tmdir)
+            with open('fig.pdf', 'w') as fp:
+                fp.write('%PDF-1.4 fig')
+            with open('test.tex', 'w') as fp:
+                fp.write('\\begin{edXcourse}{1.00x}{1.00x Fall 2013}[url_name=2013_Fall]\n\n'
+                         '\\begin{edXchapter}{Unit 1}[url_name=unit1]\n\n'
+                         '\\begin{edXsection}{Intro}[url_name=intro]\n\n'
+                         '\\begin{edXtext}{Figure}[url_name=fig]\n'
+                         '\\includegraphics[width=6in]{fig}\n'
+                         '\\end{edXtext}\n\\end{edXsection}\n\\end{edXchapter}\n\\end{edXcourse}\n')
+            cache_dir = os.path.join(tmdir, 'imcache')
+            os.mkdir(cache_dir)
+            cache_image(ImageConverter(cache_dir), 'fig.pdf', 660, TESTDIR / 'example-image.png')
+            l2e = latex2edx('test.tex', output_dir=tmdir, add_wrap=True, image_cache=cache_dir, image_processes=2)
+            l2e.convert()
+            self.assertEqual(l2e.p2x.image_converter.reused, ['fig.pdf'])
+            self.assertIn('<img src="/static/images/fig.png" width="660"/>', open('test.xbundle').read())
+            self.assertTrue(os.path.exists(path(tmdir) / 'static/images/fig.png'))
+
+    @unittest.skipIf(shutil.which('convert') is None, "needs ImageMagick")
+    def test_convert(self):
+        with make_temp_directory() as tmdir:
+            os.chdir(tmdir)
+            if os.system('convert %s a.pdf' % (TESTDIR / 'example-image.png')) or not os.path.exists('a.pdf'):
+                self.skipTest("ImageMagick can't write PDF files")
+            shutil.copy('a.pdf', 'b.pdf')
+            conv = ImageConverter(os.path.join(tmdir, 'cache'), processes=2)
+            conv.convert_all([('', 'a'), ('', 'b')])
+            self.assertEqual(conv.converted, ['a.pdf'])
+            self.assertEqual(conv.reused, ['b.pdf'])
+            self.assertTrue(os.path.exists('a.png') and os.path.exists('b.png'))
+            os.unlink('a.png')
+            conv2 = ImageConverter(os.path.join(tmdir, 'cache'))
+            conv2.convert_all([('', 'a')])
+            self.assertEqual(conv2.reused, ['a.pdf'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import os
+import unittest
+try:
+    from path import path	# needs path.py
+except Exception as err:
+    from path import Path as path
+from lxml import etree
+
+import plasTeX
+from latex2edx import buildcache
+from latex2edx.imageoptimize import ImageOptimizer, Image
+from latex2edx.main import latex2edx
+from latex2edx.plastexit import plastex2xhtml
+from latex2edx.test.util import make_temp_directory
+
+TEX = ('\\begin{edXcourse}{1.00x}{1.00x Fall 2013}[url_name=2013_Fall]\n\n'
+       '\\begin{edXchapter}{Unit 1}[url_name=unit1]\n\n'
+       '\\begin{edXsection}{Intro}[url_name=intro]\n\n'
+       '\\begin{edXtext}{Figure}[url_name=fig]\n'
+       '\\includegraphics[width=4in]{big} \\includegraphics{small}\n'
+       '\\end{edXtext}\n\\end{edXsection}\n\\end{edXchapter}\n\\end{edXcourse}\n')
+
+
+def make_png(fn, width, height):
+    img = Image.new('RGB', (width, height))
+    img.putdata([((x * 7) % 256, (y * 3) % 256, 128) for y in range(height) for x in range(width)])
+    img.save(fn, 'PNG', compress_level=1)
+
+
+def webp_ok():
+    from PIL import features
+    return features.check('webp')
+
+
+@unittest.skipIf(Image is None, "needs Pillow")
+class TestImageOptimize(unittest.TestCase):
+
+    def test_optimize(self):
+        with make_temp_directory() as tmdir:
+            os.chdir(tmdir)
+            make_png('big.png', 1200, 300)
+            opt = ImageOptimizer(os.path.join(tmdir, 'cache'))
+            entry = opt.optimize('big.png', 440)
+            names = [(name, w, mime) for (fn, name, w, mime) in entry['files']]
+            self.assertEqual(names, [('big.png', 1200, 'image/png'), ('big-440w.png', 440, 'image/png'),
+                                     ('big-880w.png', 880, 'image/png')])
+            full = entry['files'][0][0]
+            self.assertLess(os.path.getsize(full), os.path.getsize('big.png'))
+            self.assertEqual(Image.open(full).tobytes(), Image.open('big.png').tobytes())	# lossless
+            self.assertEqual(Image.open(entry['files'][1][0]).size, (440, 110))
+            self.assertEqual(sorted(os.listdir(os.path.dirname(full))),	# no temporary files left
+                             ['big-440w.png', 'big-880w.png', 'big.png', 'variants.json'])
+            self.assertEqual(opt.optimize('big.png', 440), entry)
+            self.assertEqual((opt.noptimized, opt.nreused), (1, 1))
+
+            # changed image is processed again; other files are not optimized
+            make_png('big.png', 1000, 300)
+            self.assertNotEqual(opt.optimize('big.png', 440)['key'], entry['key'])
+            with open('notes.txt', 'w') as fp:
+                fp.write('text')
+            self.assertIsNone(opt.optimize('notes.txt', 440))
+
+    @unittest.skipIf(Image is None or not webp_ok(), "needs Pillow with WebP")
+    def test_webp(self):
+        with make_temp_directory() as tmdir:
+            os.chdir(tmdir)
+            make_png('small.png', 300, 100)
+            entry = ImageOptimizer(os.path.join(tmdir, 'cache'), webp=True).optimize('small.png', 400)
+            self.assertEqual([(name, w, mime) for (fn, name, w, mime) in entry['files']],
+                             [('small.png', 300, 'image/png'), ('small.webp', 300, 'image/webp')])
+
+    def test_latex2edx(self):
+        with make_temp_directory() as tmdir:
+            os.chdir(tmdir)
+            make_png('big.png', 1200, 300)
+            make_png('small.png', 300, 100)
+            with open('test.tex', 'w') as fp:
+                fp.write(TEX)
+            for k in range(2):
+                l2e = latex2edx('test.tex', output_dir=tmdir, add_wrap=True, optimize_images=True,
+                                build_cache=os.path.join(tmdir, 'bcache'))
+                l2e.convert()
+                self.assertEqual(l2e.p2x.image_optimizer.nreused, k * 2)
+                xb = open('test.xbundle').read()
+                self.assertIn('<img src="/static/images/big.png" width="440" srcset="/static/images/big-440w.png 440w, '
+                              '/static/images/big-880w.png 880w, /static/images/big.png 1200w" '
+                              'sizes="(max-width: 440px) 100vw, 440px"/>', xb)
+                self.assertIn('<img src="/static/images/small.png" width="400"/>', xb)
+                self.assertEqual(sorted(os.listdir('static/images')),
+                                 ['big-440w.png', 'big-880w.png', 'big.png', 'small.png'])
+                self.assertTrue(os.path.exists('bcache/images/optimized'))
+
+    @unittest.skipIf(Image is None or not webp_ok(), "needs Pillow with WebP")
+    def test_same_as_string(self):
+        '''
+        Rendering to a tree gives the same <picture> elements as parsing the XHTML string.
+        '''
+        with make_temp_directory() as tmdir:
+            os.chdir(tmdir)
+            make_png('big.png', 1200, 300)
+            make_png('small.png', 300, 100)
+            os.makedirs('static/images')
+            results = []
+            for xml_tree in [False, True]:
+                plasTeX.idgen = buildcache.IdGenerator(1)
+                p2x = plastex2xhtml(os.path.join(tmdir, 'test.tex'), latex_string=TEX, add_wrap=True, imurl='images',
+                                    optimize_images=True, webp_images=True)
+                p2x.renderer.xml_tree = xml_tree
+                p2x.convert()
+                xml = p2x.xml if xml_tree else etree.fromstring(p2x.xhtml)
+                results.append(etree.tostring(xml, encoding='unicode'))
+            self.assertEqual(results[0], results[1])
+            self.assertIn('<picture><source type="image/webp" srcset="/static/images/small.webp 300w" '
+                          'sizes="(max-width: 400px) 100vw, 400px"/><img src="/static/images/small.png" '
+                          'width="400"/></picture>', results[0])
+            self.assertIn('srcset="/static/images/big-440w.webp 440w, /static/images/big-880w.webp 880w, '
+                          '/static/images/big.webp 1200w"', results[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
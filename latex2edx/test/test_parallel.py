@@ -0,0 +1,56 @@
+import os
+import pickle
+import unittest
+try:
+    from path import path	# needs path.py
+except Exception as err:
+    from path import Path as path
+
+import latex2edx as l2emod
+from latex2edx.main import latex2edx
+from latex2edx.abox import AnswerBox
+from latex2edx.plastexit import predict_counters
+from latex2edx.test.util import make_temp_directory
+
+
+class TestParallelRender(unittest.TestCase):
+
+    def test_predict_counters(self):
+        base = [['edXchapter', 0], ['equation', 0], ['edXsequential', 0]]
+        effect = {'counters': [['edXchapter', 1], ['equation', 2], ['edXsequential', 3]],
+                  'resetby': {'edXchapter': None, 'equation': None, 'edXsequential': 'edXchapter'}}
+        start = [['edXchapter', 4], ['equation', 5], ['edXsequential', 6]]
+        self.assertEqual(predict_counters(start, base, effect),
+                         [['edXchapter', 5], ['equation', 7], ['edXsequential', 3]])
+
+    def test_pickle_abox(self):
+        abox = AnswerBox('type="option" expect="float" options="noneType","float"')
+        abox2 = pickle.loads(pickle.dumps(abox))
+        self.assertEqual(abox2.xmlstr, abox.xmlstr)
+        self.assertEqual(abox2.xmlstr_just_code, abox.xmlstr_just_code)
+
+    def test_parallel_build(self):
+        testdir = path(l2emod.__file__).parent / 'testtex'
+        fn = testdir / 'example12_index.tex'
+        print("file %s" % fn)
+        with make_temp_directory() as tmdir:
+            nfn = '%s/%s' % (tmdir, fn.basename())
+            os.system('cp %s/* %s' % (testdir, tmdir))
+            os.chdir(tmdir)
+            xbfn = nfn[:-4] + '.xbundle'
+
+            l2e = latex2edx(nfn, output_dir=tmdir)
+            l2e.convert()
+            expected = open(xbfn).read()
+            aboxes = set(l2e.p2x.renderer.answer_box_objects)
+
+            l2e = latex2edx(nfn, output_dir=tmdir, render_processes=3)
+            l2e.convert()
+            self.assertEqual(open(xbfn).read(), expected)
+            self.assertEqual(set(l2e.p2x.renderer.answer_box_objects), aboxes)
+            self.assertTrue(len(aboxes) > 0)
+            self.assertEqual([x for x in os.listdir(tmdir) if '.xhtml.' in x], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
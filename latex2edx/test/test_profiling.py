@@ -0,0 +1,71 @@
+import os
+import json
+import tracemalloc
+import unittest
+try:
+    from path import path	# needs path.py
+except Exception as err:
+    from path import Path as path
+
+import latex2edx as l2emod
+from latex2edx.main import latex2edx
+from latex2edx.profiling import BuildProfiler
+from latex2edx.test.util import make_temp_directory
+
+
+class TestProfiling(unittest.TestCase):
+
+    def test_profiler_nesting(self):
+        prof = BuildProfiler()
+        with prof.measure('outer'):
+            with prof.measure('inner', kind='filter'):
+                data = [0] * 100000
+            del data
+        prof.stop()
+        self.assertEqual(prof.records['inner']['kind'], 'filter')
+        self.assertTrue(prof.records['inner']['peak_memory'] > 0)
+        self.assertTrue(prof.records['outer']['peak_memory'] >= prof.records['inner']['peak_memory'])
+        self.assertTrue(prof.records['outer']['wall'] >= prof.records['inner']['wall'])
+
+    def test_report_stops_tracing(self):
+        prof = BuildProfiler()
+        with prof.measure('stage'):
+            data = [0] * 1000
+        self.assertTrue(tracemalloc.is_tracing())
+        self.assertIn('stage', prof.report())
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_disabled_profiler(self):
+        prof = BuildProfiler(enabled=False)
+        with prof.measure('stage'):
+            pass
+        self.assertEqual(len(prof.records), 0)
+
+    def test_profile_build(self):
+        testdir = path(l2emod.__file__).parent / 'testtex'
+        fn = testdir / 'example11_toc_test.tex'
+        print("file %s" % fn)
+        with make_temp_directory() as tmdir:
+            nfn = '%s/%s' % (tmdir, fn.basename())
+            os.system('cp %s/* %s' % (testdir, tmdir))
+            os.chdir(tmdir)
+            l2e = latex2edx(nfn, output_dir=tmdir, profile=True)
+            l2e.convert()
+            self.assertFalse(tracemalloc.is_tracing())		# stopped at the end of the build
+
+            records = l2e.profiler.records
+            for name in ['plastex parse', 'plastex render', 'processFileContent', 'parse xhtml',
+                         'handle_refs', 'fix_table', 'export to directory']:
+                self.assertIn(name, records)
+            self.assertEqual(records['handle_refs']['kind'], 'filter')
+            self.assertTrue(records['fix_table']['calls'] > 0)
+            self.assertIn('handle_refs', l2e.profiler.report())
+
+            pfn = path(tmdir) / 'profile.json'
+            l2e.profiler.save_json(pfn)
+            report = json.loads(open(pfn).read())
+            walls = [x['wall'] for x in report['records']]
+            self.assertEqual(walls, sorted(walls, reverse=True))
+
+if __name__ == '__main__':
+    unittest.main()
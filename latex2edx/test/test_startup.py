@@ -0,0 +1,54 @@
+import os
+import subprocess
+import sys
+import time
+import unittest
+
+# seconds allowed for "latex2edx --help" and "latex2edx --version" (best of several runs)
+STARTUP_BUDGET = float(os.environ.get('LATEX2EDX_STARTUP_BUDGET', '0.75'))
+
+# modules which must not be loaded just to start the command line
+HEAVY_MODULES = ['plasTeX', 'yaml', 'pkg_resources', 'latex2edx.plastexit', 'latex2edx.course_tests',
+                 'latex2edx.abox', 'bs4']
+
+RUN_CLI = '''
+import sys
+from latex2edx.main import CommandLine
+sys.argv = ['latex2edx', '%s']
+try:
+    CommandLine()
+except SystemExit:
+    pass
+print('LOADED: %%s' %% ' '.join(x for x in %r if x in sys.modules))
+'''
+
+
+class TestStartup(unittest.TestCase):
+
+    def run_cli(self, arg):
+        cmd = [sys.executable, '-c', RUN_CLI % (arg, HEAVY_MODULES)]
+        times = []
+        for k in range(3):
+            t0 = time.time()
+            out = subprocess.check_output(cmd).decode('utf8')
+            times.append(time.time() - t0)
+        return out, min(times)
+
+    def test_help(self):
+        out, dt = self.run_cli('--help')
+        print("latex2edx --help took %.3f sec" % dt)
+        self.assertIn('--output-directory', out)
+        self.assertIn('LOADED: \n', out)
+        self.assertLess(dt, STARTUP_BUDGET)
+
+    def test_version(self):
+        out, dt = self.run_cli('--version')
+        print("latex2edx --version took %.3f sec" % dt)
+        self.assertIn('version', out)
+        self.assertNotIn('unknown', out)
+        self.assertIn('LOADED: \n', out)
+        self.assertLess(dt, STARTUP_BUDGET)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+'''
+Test precompiled text filters, in latex2edx/textfilters.py
+'''
+import random
+import re
+import unittest
+
+from latex2edx.textfilters import TextFilters, literal_prefix
+from latex2edx.plastexit import MyRenderer
+
+
+def math(m):
+    return '[mathjaxinline]%s[/mathjaxinline]' % m.group(1).strip()
+
+
+FILTERS = [('(?s)<math>\\$(.*?)\\$</math>', math),
+           (r'(?s)<edxxml>\\edXxml{(.*?)}</edxxml>', lambda m: '<b>%s</B>' % m.group(1).replace('& ', '&')),
+           (re.compile('<B>(.*?)</B>', re.I), r'<strong>\1</strong>'),
+           ('<p>', lambda m: '<p>\n'),
+           ('x|y', 'z'),
+           ]
+
+
+def sequential(filters, stxt):
+    for pat, func in filters:
+        stxt = re.sub(pat, func, stxt)
+    return stxt
+
+
+class TestTextFilters(unittest.TestCase):
+
+    def test_literal_prefix(self):
+        for (pat, prefix) in [('(?s)<math>\\$(.*?)\\$</math>', '<math>$'),
+                              ('(?s)<math>\\\\ensuremath{(.*?)}</math>', '<math>\\ensuremat'),
+                              (r'(?s)<abox(|linenum="\d+")>(.*?)</abox>', '<abox'),
+                              (r'<math>\\\[', '<math>\\['),
+                              ('<p>', '<p>'),
+                              (re.escape('&nbsp;'), '&nbsp;'),
+                              ('<ab?c', '<a'),
+                              ('<a>|<b>', ''),
+                              ('<[|]>(x|y)', '<'),
+                              (r'\d+<', ''),
+                              ('(?i)<p>', ''),
+                              ]:
+            self.assertEqual(literal_prefix(re.compile(pat)), prefix, pat)
+
+    def test_same_as_re_sub(self):
+        '''
+        Random documents, including filters acting on the replacements of earlier ones.
+        '''
+        rnd = random.Random(17)
+        tokens = ['<p>', '<math>$', '$</math>', '<edxxml>\\edXxml{', '}</edxxml>', '<b>', '</B>', 'x', '& ', '\n']
+        filters = TextFilters(FILTERS)
+        for n in range(500):
+            stxt = ''.join(rnd.choice(tokens) for k in range(rnd.randint(0, 30)))
+            self.assertEqual(filters.sub(stxt), sequential(FILTERS, stxt), repr(stxt))
+        self.assertEqual(filters.sub('<edxxml>\\edXxml{a & b}</edxxml>'), '<strong>a &b</strong>')
+
+    def test_error(self):
+        def fail(m):
+            raise ValueError('bad math')
+        with self.assertRaises(ValueError):
+            TextFilters([('<math>', fail)]).sub('<p><math></p>')
+
+
+class TestRendererFilters(unittest.TestCase):
+
+    def test_extra_filters(self):
+        renderer = MyRenderer(extra_filters={'<toc/>': lambda m: '<p>TOC</p>'})
+        stxt = renderer.fix_unicode('<li>’<math>$x$</math> <math>\\ensuremath{}</math><toc/>—')
+        self.assertEqual(renderer.text_filters().sub(stxt), "<li>'[mathjaxinline]x[/mathjaxinline] &nbsp;<p>TOC</p>&#8212;")
+        renderer.filters['TOC'] = 'Contents'
+        self.assertEqual(renderer.text_filters().sub('<toc/>'), '<p>Contents</p>')
+
+
+if __name__ == '__main__':
+    unittest.main()
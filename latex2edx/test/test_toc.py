@@ -157,6 +157,34 @@ class TestToC(unittest.TestCase):
             tocref2 = toc.find('.//table/tbody/tr[@id="indmo1p2"]/td/ul/li/a')
             self.assertIn('Problem Set 1', tocref2.text)
 
+    def test_index_ref_elements(self):
+        '''
+        Test the location side table used by `handle_refs`: each element gets
+        the location of its nearest chapter, sequential, or vertical.
+        '''
+        xml = etree.fromstring(
+            '<document><course><chapter><label>chap:a</label>'
+            '<sequential><html><p><ref>eq:1</ref></p>'
+            '<table class="equation"/><table class="tabular"/></html>'
+            '<p><index>key</index></p></sequential>'
+            '<div class="figure"><label>fig:1</label></div></chapter>'
+            '<toclabel>mo:1</toclabel></course><tocref>mo:1</tocref></document>')
+        chapter = xml.find('.//chapter')
+        seq = chapter.find('sequential')
+        containers = {xml.find('course'): '0', chapter: '1', seq: '1.1', seq[0]: '1.1.1'}
+        locs = {chapter[0]: '1.0'}
+        found = latex2edx.index_ref_elements(xml, containers, locs)
+        self.assertEqual([x.text for x in found['label']], ['chap:a', 'fig:1', 'mo:1'])
+        self.assertEqual([locs.get(x) for x in found['label']], ['1.0', '1', '0'])
+        self.assertEqual([locs.get(x) for x in found['ref'] + found['equation'] + found['index']],
+                         ['1.1.1', '1.1.1', '1.1'])
+        self.assertEqual([locs.get(x) for x in found['figure'] + found['tocref']], ['1', None])
+        # elements removed from the tree, directly or with a parent
+        ref = found['ref'][0]
+        self.assertTrue(latex2edx.in_tree(ref, xml))
+        seq[0].remove(ref.getparent())
+        self.assertFalse(latex2edx.in_tree(ref, xml))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,63 @@
+import os
+import unittest
+
+from lxml import etree
+
+from latex2edx.urlnames import UrlNameRegistry, MAX_LENGTH
+from latex2edx.xbundle import XBundle
+from latex2edx.test.util import make_temp_directory
+
+
+class TestUrlNames(unittest.TestCase):
+
+    def test_x_suffix(self):
+        reg = UrlNameRegistry(['b'])
+        self.assertEqual([reg.add_unique('a') for k in range(4)], ['a', 'ax', 'axx', 'axxx'])
+        reg.add('bxx')
+        self.assertEqual([reg.add_unique('b') for k in range(3)], ['bx', 'bxxx', 'bxxxx'])
+        self.assertIn('bxx', reg)
+        self.assertEqual(len(reg), 9)
+
+    def test_number_suffix(self):
+        reg = UrlNameRegistry()
+        self.assertEqual([reg.add_unique('p', style='number') for k in range(3)], ['p', 'p1', 'p2'])
+        reg.add('a9')
+        self.assertEqual(reg.add_unique('a9', style='number'), 'a10')
+        self.assertEqual(reg.add_unique('a9', style='number'), 'a11')
+        self.assertEqual(reg.add_unique('a10', style='number'), 'a12')
+
+    def test_long_names(self):
+        reg = UrlNameRegistry()
+        names = [reg.add_unique('Exercise') for k in range(MAX_LENGTH)]
+        self.assertEqual(len(set(names)), MAX_LENGTH)
+        self.assertEqual(names[-1], 'Exercise_7')
+        self.assertTrue(max(len(x) for x in names) <= MAX_LENGTH)
+
+    def test_many_collisions(self):
+        reg = UrlNameRegistry()
+        names = [reg.add_unique('problem_Problem', style='number') for k in range(5000)]
+        self.assertEqual(len(set(names)), 5000)
+        self.assertEqual(names[-1], 'problem_Problem4999')
+
+    def test_save_load(self):
+        reg = UrlNameRegistry()
+        for k in range(3):
+            reg.add_unique('a')
+        with make_temp_directory() as tmdir:
+            fn = os.path.join(tmdir, 'url_names.json')
+            reg.save(fn)
+            reg2 = UrlNameRegistry.load(fn)
+        self.assertEqual(set(reg2), set(reg))
+        self.assertEqual(reg2.counters, reg.counters)
+        self.assertEqual(reg2.add_unique('a'), 'axxx')
+
+    def test_xbundle_shares_registry(self):
+        reg = UrlNameRegistry(['Intro_html'])
+        xb = XBundle(url_names=reg)
+        self.assertIs(xb.urlnames, reg)
+        self.assertEqual(xb.make_urlname(etree.Element('html', display_name='Intro')), 'Intro_html1')
+        self.assertIn('Intro_html1', reg)
+
+
+if __name__ == '__main__':
+    unittest.main()
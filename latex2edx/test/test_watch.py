@@ -0,0 +1,60 @@
+import os
+import unittest
+try:
+    from path import path	# needs path.py
+except Exception as err:
+    from path import Path as path
+
+import latex2edx as l2emod
+from latex2edx.main import latex2edx
+from latex2edx.watch import Watcher
+from latex2edx.test.util import make_temp_directory
+
+
+class TestWatch(unittest.TestCase):
+
+    def test_watched_files(self):
+        testdir = path(l2emod.__file__).parent / 'testtex'
+        fn = testdir / 'example7.tex'
+        print("file %s" % fn)
+        with make_temp_directory() as tmdir:
+            os.system('cp %s/* %s' % (testdir, tmdir))
+            os.chdir(tmdir)
+            nfn = '%s/%s' % (tmdir, fn.basename())
+
+            builds = []
+            watcher = Watcher(lambda: latex2edx(nfn, output_dir=tmdir), [nfn], interval=0.01,
+                              on_build=builds.append)
+            self.assertTrue(watcher.build())
+            self.assertEqual(len(builds), 1)
+            self.assertEqual(watcher.files, [nfn, 'sga.xml', 'testscript1.py'])
+
+            snapshot = watcher.snapshot()
+            self.assertEqual(watcher.changed_files(snapshot), [])
+            with open('sga.xml', 'a') as fp:
+                fp.write('\n')
+            self.assertEqual(watcher.changed_files(snapshot), ['sga.xml'])
+
+            # a failed build keeps the watch going, and the list of files
+            os.rename('sga.xml', 'sga.xml.orig')
+            self.assertFalse(watcher.build())
+            self.assertIn('sga.xml', watcher.files)
+            os.rename('sga.xml.orig', 'sga.xml')
+            self.assertTrue(watcher.build())
+            self.assertEqual((watcher.nbuilds, watcher.nfailed), (3, 1))
+
+    def test_watched_images(self):
+        testdir = path(l2emod.__file__).parent / 'testtex'
+        fn = testdir / 'example11_toc_test.tex'
+        print("file %s" % fn)
+        with make_temp_directory() as tmdir:
+            os.system('cp %s/* %s' % (testdir, tmdir))
+            os.chdir(tmdir)
+            nfn = '%s/%s' % (tmdir, fn.basename())
+            l2e = latex2edx(nfn, output_dir=tmdir)
+            l2e.convert()
+            self.assertEqual(l2e.watched_files(), [nfn, 'example-image.png'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,13 @@
 '''
 Run unittest on xbundle.py
 '''
+import os
+import shutil
 import unittest
 from lxml import etree
 from latex2edx.test.util import make_temp_directory
-from latex2edx.xbundle import XBundle
+from latex2edx.xbundle import XBundle, format_xml, iter_format_xml, xmllint_format
+from latex2edx.dirindex import DirectoryIndex
 # ----------------------------------------------------------------------------
 # tests
 
@@ -49,5 +52,240 @@ class TestXBundle(unittest.TestCase):
 
         self.assertEqual(xbin, xbreloaded)
 
+    def testExport(self):
+        xb = XBundle(force_studio_format=True)
+        xb.KeepTogetherTags = ['vertical']
+        xb.set_course(etree.XML('''<course semester="2013_Spring" course="mitx.01">
+  <chapter display_name="Intro">
+    <sequential display_name="Overview">
+      <problem display_name="Q"><p>1+1?</p></problem>
+      <vertical display_name="V"><html display_name="Q">text</html></vertical>
+    </sequential>
+  </chapter>
+  <chapter display_name="Intro"><html>more</html></chapter>
+</course>'''))
+        files = {}
+        with make_temp_directory() as tdir:
+            xb.export_to_directory(tdir, xml_only=True)
+            for (root, dirs, fns) in os.walk(tdir + '/mitx.01'):
+                for fn in fns:
+                    files[os.path.relpath(os.path.join(root, fn), tdir + '/mitx.01')] = open(os.path.join(root, fn)).read()
+        self.assertEqual(sorted(files), ['chapter/Intro_chapter.xml', 'chapter/Intro_chapter1.xml', 'course.xml',
+                                         'course/2013_Spring.xml', 'html/Intro_html.xml', 'html/Q_html.xml',
+                                         'problem/Q_problem.xml', 'sequential/Overview_sequential.xml'])
+        self.assertEqual(files['course/2013_Spring.xml'],
+                         '<course semester="2013_Spring" course="mitx.01" org="MITx">\n'
+                         '  <chapter url_name="Intro_chapter"/>\n  <chapter url_name="Intro_chapter1"/>\n</course>\n')
+        self.assertEqual(files['sequential/Overview_sequential.xml'],
+                         '<sequential display_name="Overview">\n'
+                         '  <vertical url_name="Overview_vertical">\n    <problem url_name="Q_problem"/>\n  </vertical>\n'
+                         '  <vertical display_name="V">\n    <html url_name="Q_html"/>\n  </vertical>\n</sequential>\n')
+        self.assertEqual(files['problem/Q_problem.xml'], '<problem display_name="Q">\n  <p>1+1?</p>\n</problem>\n')
+        self.assertIsNone(xb.course.find('.//descriptor'))
+
+    def make_old_course(self, tdir):
+        '''
+        Write a course in older edX formats: html and problem files, url_names with colons, a missing chapter.
+        '''
+        files = {'course.xml': '<course url_name="2013" org="MITx" course="t1"/>',
+                 'course/2013.xml': '<course display_name="T1"><chapter url_name="c1"/><chapter url_name="missing"/>'
+                                    '<chapter url_name="a:b"/><html filename="week1-intro"/></course>',
+                 'chapter/c1.xml': '<chapter><sequential url_name="s1"/><problem filename="p1"/></chapter>',
+                 'chapter/a/b.xml': '<chapter display_name="Colon"><html url_name="h1"/></chapter>',
+                 'sequential/s1.xml': '<sequential><html url_name="h1"/></sequential>',
+                 'html/h1.xml': '<html><p>hello</p></html>',
+                 'html/week1/week1-intro.html': '<p>Intro<br> unclosed <i>tag</p>',
+                 'problem/p1.xml': '<problem><p>P1</p></problem>'}
+        for (fn, data) in files.items():
+            if not os.path.exists(os.path.dirname(os.path.join(tdir, fn))):
+                os.makedirs(os.path.dirname(os.path.join(tdir, fn)))
+            open(os.path.join(tdir, fn), 'w').write(data)
+
+    def testImportOldFormat(self):
+        with make_temp_directory() as tdir:
+            self.make_old_course(tdir)
+            xbs = []
+            for jobs in [1, 4]:
+                xb = XBundle(jobs=jobs)
+                xb.import_from_directory(tdir)
+                xbs.append(etree.tostring(xb.course).decode())
+        self.assertEqual(xbs[0], xbs[1])
+        self.assertEqual(xbs[0],
+                         '<course display_name="T1" org="MITx" course="t1" semester="2013">'
+                         '<chapter display_name="c1"><sequential display_name="s1"><html display_name="h1"><p>hello</p></html>'
+                         '</sequential><problem display_name=""><p>P1</p></problem></chapter><chapter url_name="missing"/>'
+                         '<chapter display_name="Colon"><html display_name="h1"><p>hello</p></html></chapter>'
+                         '<html display_name=""><body><p>Intro<br/> unclosed <i>tag</i></p></body></html></course>')
+
+    def testImportCache(self):
+        with make_temp_directory() as tdir:
+            self.make_old_course(tdir)
+            cache = os.path.join(tdir, 'import_cache.xml')
+            xb = XBundle(keep_urls=True)
+            xb.import_from_directory(tdir, cache=cache)
+            expected = str(xb)
+            self.assertTrue(os.path.exists(cache))
+            os.utime(os.path.join(tdir, 'problem/p1.xml'), (0, 0))
+            xb = XBundle(keep_urls=True)
+            xb.import_from_directory(tdir, cache=cache)		# stale cache: imported again
+            self.assertEqual(str(xb), expected)
+            xb = XBundle(keep_urls=True)
+            xb.import_xml_removing_descriptor = None		# loaded from the cache, without importing
+            xb.import_from_directory(tdir, cache=cache)
+            self.assertEqual(str(xb), expected)
+            open(os.path.join(tdir, 'problem/p1.xml'), 'w').write('<problem><p>changed</p></problem>')
+            xb = XBundle(keep_urls=True)
+            xb.import_from_directory(tdir, cache=cache)
+            self.assertIn('changed', str(xb))
+
+    def testLoadCache(self):
+        xb = XBundle()
+        xb.set_course(etree.XML('<course semester="2013_Spring"><chapter display_name="C">caf\u00e9<!-- c --></chapter></course>'))
+        xb.add_policies(etree.XML('<policies semester="2013_Spring"><policy>x:1</policy></policies>'))
+        expected = str(xb)
+        with make_temp_directory() as tdir:
+            fn = os.path.join(tdir, 'xb.xml')
+            cache = fn + '.cache'
+            xb.save(fn)
+            xb = XBundle()
+            xb.load(fn)
+            self.assertFalse(os.path.exists(cache))
+            xb.load(fn, update_cache=True)
+            self.assertTrue(open(cache, 'rb').read().startswith(b'XBUNDLE-CACHE 1 '))
+            xb = XBundle()
+            xb.load(fn)
+            self.assertEqual(str(xb), expected)
+            xb.course[0].set('display_name', 'D')		# a cache of fn with other content shows it is read
+            xb.save_cache(fn)
+            xb = XBundle()
+            xb.load(fn)
+            self.assertIn('display_name="D"', str(xb))
+            xb = XBundle()
+            xb.load(fn, cache=False)
+            self.assertEqual(str(xb), expected)
+            os.utime(fn, ns=(0, 0))				# fn changed: cache out of date
+            xb = XBundle()
+            xb.load(fn)
+            self.assertEqual(str(xb), expected)
+            xb.save_cache(fn)
+            with open(cache, 'r+b') as fp:			# corrupt cache is ignored
+                fp.seek(-20, 2)
+                fp.write(b'x' * 20)
+            xb = XBundle()
+            xb.load(fn)
+            self.assertEqual(str(xb), expected)
+
+    def testStreaming(self):
+        xb = XBundle()
+        xb.set_course(etree.XML('<course semester="2013_Spring" course="mitx.01">%s<!-- end --></course>' % ''.join(
+            '<chapter display_name="C%d"><sequential display_name="S"><html display_name="H">%d</html></sequential></chapter>'
+            % (k, k) for k in range(3))))
+        xb.add_policies(etree.XML('<policies semester="2013_Spring"><policy>x:1</policy></policies>'))
+        expected = str(xb)
+        with make_temp_directory() as tdir:
+            xb.save(tdir + '/xb.xml')
+            self.assertEqual(open(tdir + '/xb.xml').read(), expected)
+            xb = XBundle()
+            xb.load(tdir + '/xb.xml')
+            xb.export_to_directory(tdir + '/whole')
+            xb = XBundle()
+            chapters = xb.load_streaming(tdir + '/xb.xml')
+            self.assertEqual(xb.course_id(), 'mitx.01')
+            self.assertEqual(len(xb.course), 0)
+            self.assertEqual(xb.metadata.find('policies/policy').text, 'x:1')
+            names = []
+            for chapter in chapters:
+                names.append(chapter.get('display_name'))
+                self.assertEqual(list(xb.course), [chapter])		# previous chapters were removed by the caller
+                xb.course.remove(chapter)
+            self.assertEqual(names, ['C0', 'C1', 'C2'])
+            self.assertEqual(xb.course[0].tag, etree.Comment)
+            xb = XBundle()
+            xb.export_to_directory(tdir + '/stream', chapters=xb.load_streaming(tdir + '/xb.xml'))
+            files = []
+            for d in ['whole', 'stream']:
+                files.append(dict((os.path.relpath(os.path.join(root, fn), tdir + '/' + d), open(os.path.join(root, fn)).read())
+                                  for (root, dirs, fns) in os.walk(tdir + '/' + d) for fn in fns))
+        self.assertEqual(len(files[0]), 12)
+        self.assertEqual(files[0], files[1])
+
+    def testDirectoryIndex(self):
+        with make_temp_directory() as tdir:
+            self.make_old_course(tdir)
+            index = DirectoryIndex(tdir, exclude=[os.path.join(tdir, 'course.xml')])
+            self.assertEqual(len(index), 7)
+            self.assertIn('chapter/a/b.xml', index)
+            self.assertIn('chapter/./a//b.xml', index)
+            self.assertNotIn('chapter/a', index)
+            self.assertTrue(index.exists(os.path.join(tdir, 'html/h1.xml')))
+            signature = index.signature()
+            os.utime(os.path.join(tdir, 'html/h1.xml'), (0, 0))
+            self.assertNotEqual(DirectoryIndex(tdir, exclude=[os.path.join(tdir, 'course.xml')]).signature(), signature)
+
+
+class TestFormatXML(unittest.TestCase):
+    '''
+    format_xml should give the same output as xmllint --format.
+    '''
+    cases = [('<a>  <b>x</b>  <c> <d/> </c><!-- caf&#233; --></a>',
+              '<a>\n  <b>x</b>\n  <c>\n    <d/>\n  </c>\n  <!-- caf&#233; -->\n</a>\n'),
+             ('<p>Text <b> <i/> </b> and <c><d/></c> </p>',
+              '<p>Text <b><i/></b> and <c><d/></c> </p>\n'),
+             ('<a b="caf&#233;&#10;">&#13;&#233;<x/> </a>',
+              '<a b="caf&#xE9;&#10;">&#xD;&#xE9;<x/> </a>\n'),
+             ('<a><b/>x<c/> <d/></a>',
+              '<a><b/>x<c/><d/></a>\n'),
+             ]
+
+    def test_format(self):
+        for (xml, expected) in self.cases:
+            self.assertEqual(format_xml(etree.fromstring(xml)).decode(), expected)
+
+    def test_subelement(self):
+        xml = etree.fromstring('<a><b> <c/> </b>tail</a>')
+        self.assertEqual(format_xml(xml[0]), b'<b>\n  <c/>\n</b>\n')
+        self.assertEqual(etree.tostring(xml), b'<a><b> <c/> </b>tail</a>')	# unchanged
+
+    def test_iter_format(self):
+        for (xml, expected) in self.cases + [('<a>\n <b> <c>x</c>\n <d/></b> <b/>\n</a>', None),
+                                             ('<a xml:space="preserve"> <b/> </a>', None)]:
+            xml = etree.fromstring(xml)
+            self.assertEqual(b''.join(iter_format_xml(xml, depth=2)), format_xml(xml))
+        self.assertEqual(list(iter_format_xml(etree.fromstring('<a> <b><c/></b> <!--x--></a>'), depth=2)),
+                         [b'<a>', b'\n  ', b'<b>', b'\n    ', b'<c/>', b'\n  ', b'</b>', b'\n  ', b'<!--x-->',
+                          b'\n', b'</a>\n'])
+
+    def test_deep(self):
+        xml = etree.fromstring('<a>' * 40 + '</a>' * 40)
+        lines = format_xml(xml).decode().split('\n')
+        self.assertEqual(lines[39], ' ' * 60 + '<a/>')
+
+    def test_export_without_xmllint(self):
+        xb = XBundle()
+        xb.set_course(etree.XML('<course semester="2013_Spring" course="mitx.01">'
+                                '<chapter display_name="Intro"><html display_name="Text">caf\u00e9</html></chapter></course>'))
+        with make_temp_directory() as tdir:
+            os.chdir(tdir)
+            xb.export_to_directory(tdir, xml_only=True)
+            self.assertFalse(os.path.exists('tmp.xml'))
+            chapter = open(tdir + '/mitx.01/chapter/Intro_chapter.xml').read()
+            html = open(tdir + '/mitx.01/html/Text_html.xml').read()
+        self.assertEqual(chapter, '<chapter display_name="Intro">\n  <html url_name="Text_html"/>\n</chapter>\n')
+        self.assertEqual(html, '<html display_name="Text">caf&#xE9;</html>\n')
+
+    @unittest.skipUnless(shutil.which('xmllint'), 'needs xmllint')
+    def test_same_as_xmllint(self):
+        for (xml, expected) in self.cases:
+            self.assertEqual(xmllint_format(etree.fromstring(xml)).decode(), expected)
+        xb = XBundle()
+        xb.set_course(etree.XML('''<course semester="2013_Spring" course="mitx.01">
+  <chapter display_name="Intro">  <sequential display_name="Overview">
+      <html display_name="Overview text">  hello <b>world</b>
+        <p> <i>caf\u00e9</i> </p> </html> <!-- a comment -->
+    </sequential>
+  </chapter>
+</course>'''))
+        self.assertEqual(format_xml(xb.course), xmllint_format(xb.course))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,120 @@
+import os
+import unittest
+
+from lxml import etree
+
+from latex2edx.xbundle import XBundle
+from latex2edx.xbundlediff import XBundleDiff, index_units, unchanged_units
+from latex2edx.test.util import make_temp_directory
+
+COURSE = '''<course url_name="2013_Fall" semester="2013_Fall">
+  <chapter display_name="Unit 1" url_name="Unit_1" linenum="3">
+    <sequential display_name="Intro" url_name="Intro">
+      <problem display_name="P1" url_name="p1" linenum="5">
+        <p>What is <b>6</b> x 7?</p>
+        <stringresponse answer="42"><textline/></stringresponse>
+      </problem>
+      <html url_name="h1"><p>Hello</p><!-- note --></html>
+    </sequential>
+    <sequential display_name="More" url_name="More">
+      <problem display_name="P2" url_name="p2"><p>Two</p></problem>
+    </sequential>
+  </chapter>
+  <chapter display_name="Unit 2">
+    <sequential display_name="Last"/>
+  </chapter>
+</course>'''
+
+
+class TestXBundleDiff(unittest.TestCase):
+
+    def test_index(self):
+        units = index_units(etree.XML(COURSE))
+        self.assertEqual(list(units), [('course', ''), ('chapter', 'Unit_1'), ('sequential', 'Intro'), ('problem', 'p1'),
+                                       ('html', 'h1'), ('sequential', 'More'), ('problem', 'p2'),
+                                       ('chapter', '/chapter[1]'), ('sequential', '/chapter[1]/sequential[1]')])
+        self.assertEqual(units[('problem', 'p1')].parent, ('sequential', 'Intro'))
+        self.assertEqual(units[('problem', 'p1')].display_name, 'P1')
+
+    def test_same(self):
+        old = etree.XML(COURSE)
+        new = etree.XML(COURSE)
+        for elem in new.iter():				# reformatting, and different source lines
+            if elem.text is not None and not elem.text.strip():
+                elem.text = '\n'
+            if elem.tail is not None and not elem.tail.strip():
+                elem.tail = None
+            if elem.get('linenum'):
+                elem.set('linenum', '100')
+        new.find('chapter').set('tex_filename', 'unit1.tex')
+        diff = XBundleDiff(old, new)
+        self.assertFalse(diff)
+        self.assertEqual(diff.report(), '0 added, 0 removed, 0 moved, 0 modified (of 9 units, 9 before)\n')
+
+    def test_changes(self):
+        xb = XBundle()
+        xb.set_course(etree.XML(COURSE))
+        old = XBundle()
+        old.set_course(etree.XML(COURSE))
+        course = xb.course
+        course.find('.//problem[@url_name="p1"]/p/b').text = '7'
+        course.find('.//html[@url_name="h1"]').set('display_name', 'Hi')
+        p2 = course.find('.//problem[@url_name="p2"]')
+        course.find('.//sequential[@url_name="Intro"]').append(p2)
+        course.find('.//sequential[@url_name="More"]').append(etree.XML('<video url_name="v1"/>'))
+        course.remove(course[1])
+        diff = XBundleDiff(old, xb)
+        self.assertTrue(diff)
+        self.assertEqual(diff.added, [('video', 'v1')])
+        self.assertEqual(diff.removed, [('chapter', '/chapter[1]'), ('sequential', '/chapter[1]/sequential[1]')])
+        self.assertEqual(diff.moved, [('problem', 'p2')])
+        self.assertEqual(diff.modified, [('course', ''), ('sequential', 'Intro'), ('problem', 'p1'), ('html', 'h1'),
+                                         ('sequential', 'More')])
+        report = diff.report().split('\n')
+        self.assertIn('modified  problem p1 "P1"', report)
+        self.assertIn('moved     problem p2 "P2"  (from sequential More to sequential Intro)', report)
+        self.assertIn('added     video v1  (in sequential More)', report)
+        self.assertIn('removed   chapter /chapter[1] "Unit 2"  (from course)', report)
+        self.assertEqual(report[-2], '1 added, 2 removed, 1 moved, 5 modified (of 8 units, 9 before)')
+
+    def test_keep_together(self):
+        units = index_units(etree.XML(COURSE), keep_together_tags=['sequential'])
+        self.assertEqual(list(units), [('course', ''), ('chapter', 'Unit_1'), ('problem', 'p1'), ('html', 'h1'),
+                                       ('problem', 'p2'), ('chapter', '/chapter[1]')])
+        self.assertEqual(units[('problem', 'p2')].parent, ('chapter', 'Unit_1'))
+
+    def test_unchanged_units(self):
+        old = etree.XML(COURSE)
+        new = etree.XML(COURSE)
+        self.assertEqual(unchanged_units(old, new), set([('chapter', 'Unit_1'), ('sequential', 'Intro'), ('problem', 'p1'),
+                                                          ('html', 'h1'), ('sequential', 'More'), ('problem', 'p2')]))
+        # sequentials get verticals with new url_names, as does the unnamed chapter's sequential
+        self.assertEqual(unchanged_units(old, new, force_studio_format=True),
+                         set([('chapter', 'Unit_1'), ('problem', 'p1'), ('html', 'h1'), ('problem', 'p2')]))
+        new.find('.//problem/p').text = 'What  is '		# blanks matter for the files
+        new.find('.//problem[@url_name="p2"]').set('linenum', '9')
+        self.assertEqual(unchanged_units(old, new, keep_together_tags=['sequential']),
+                         set([('chapter', 'Unit_1'), ('html', 'h1')]))
+
+    def test_xbundle_and_directory(self):
+        '''
+        A course (with url_names) compares the same as an xbundle file, and when exported to a directory
+        and imported back.
+        '''
+        xb = XBundle(keep_urls=True)
+        xb.set_course(etree.XML(COURSE.replace('<chapter display_name="Unit 2">', '<chapter display_name="Unit 2" url_name="Unit_2">')
+                                .replace('<sequential display_name="Last"/>', '<sequential display_name="Last" url_name="Last"/>')))
+        with make_temp_directory() as tdir:
+            fn = os.path.join(tdir, 'xb.xml')
+            xb.save(fn)
+            xb.export_to_directory(tdir)
+            old = XBundle(keep_urls=True)
+            old.load(fn)
+            new = XBundle(keep_urls=True)
+            new.import_from_directory(os.path.join(tdir, xb.course_id()))
+        diff = XBundleDiff(old, new)
+        self.assertEqual((diff.added, diff.removed, diff.moved), ([], [], []))
+
+
+if __name__ == '__main__':
+    unittest.main()
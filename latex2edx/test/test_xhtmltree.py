@@ -0,0 +1,145 @@
+'''
+Test rendering the XHTML from plasTeX directly to an XML tree, in latex2edx/xhtmltree.py
+'''
+import os
+import unittest
+
+from lxml import etree
+
+import plasTeX
+from latex2edx import buildcache, xhtmltree
+from latex2edx.plastexit import MyRenderer, plastex2xhtml
+from latex2edx.test.util import make_temp_directory
+
+TEX = r'''\begin{edXcourse}{1.00x}{1.00x Fall 2013}[url_name=2013_Fall]
+\begin{edXchapter}{Unit 1}[url_name=unit1]
+\begin{edXsection}{Intro}[url_name=intro]
+\begin{edXproblem}{P1}{url_name=p1}
+Quotes ’single’ and ”double” -- a \& b $<$ c~d --- $x^2 < 3$ and $\ensuremath{}$ and \[ y = \frac{1}{2} \]
+\begin{itemize}
+\item One $\alpha$
+\item Two
+\end{itemize}
+\edXabox{type="option" options="red","green" expect="red" inline="1"}
+\edXabox{type="custom" expect="x & y" cfn="check" hints="myhints"}
+\edXabox{type="string" expect="$a < b$" hint="a -- b"}
+\edXxml{<p>raw <b>bold</b></p><ul><li>item</li></ul>}
+\includegraphics[width=2in]{missing_image}
+\begin{edXmath}
+E = mc^2
+\end{edXmath}
+\end{edXproblem}
+\end{edXsection}
+\end{edXchapter}
+\end{edXcourse}
+'''
+
+
+def render(tmdir, xml_tree):
+    plasTeX.idgen = buildcache.IdGenerator(1)
+    p2x = plastex2xhtml(os.path.join(tmdir, 'test.tex'), latex_string=TEX, add_wrap=True)
+    p2x.renderer.xml_tree = xml_tree
+    p2x.convert()
+    return p2x
+
+
+class TestXhtmlTree(unittest.TestCase):
+
+    def test_parse_body(self):
+        stxt = '<html><body>a &nbsp;<b>&#8212;’</b><i>x</i>y</body></html>'
+        fix = lambda s: s.replace('’', "'").replace('&nbsp;', '&#160;')
+        for size in [1, 3, 100]:
+            xml = xhtmltree.parse_body(stxt, fix, chunk_size=size)
+            self.assertEqual(etree.tostring(xml, encoding='unicode'),
+                             "<document>a \xa0<b>—'</b><i>x</i>y</document>")
+
+    def test_element_source(self):
+        xml = etree.fromstring('<p>0<abox a="1 &quot; &lt;">x &amp; <b>y</b> z</abox> t</p>')
+        self.assertEqual(xhtmltree.element_source(xml[0]), '<abox a="1 &quot; &lt;">x &amp; <b>y</b> z</abox>')
+        self.assertEqual(xhtmltree.source_text('a &lt; b&nbsp;&quot;'), 'a < b\xa0"')
+
+    def test_replace_element(self):
+        xml = etree.fromstring('<p>0<a/>1<b>x</b>2<c/>3</p>')
+        xhtmltree.replace_element(xml[1], 'B')
+        self.assertEqual(etree.tostring(xml), b'<p>0<a/>1B2<c/>3</p>')
+        xhtmltree.replace_element(xml[0], 'A', [etree.Element('i'), etree.XML('<j>k</j>')])
+        self.assertEqual(etree.tostring(xml), b'<p>0A<i/><j>k</j>1B2<c/>3</p>')
+        xhtmltree.replace_element(xml[2], '', [])
+        self.assertEqual(etree.tostring(xml), b'<p>0A<i/><j>k</j>1B23</p>')
+
+    def test_add_newlines(self):
+        xml = etree.fromstring('<ul><p>a</p><p class="x">b</p><li>c</li><li/></ul>')
+        xhtmltree.add_newlines(xml)
+        self.assertEqual(etree.tostring(xml), b'<ul><p>\na</p><p class="x">b</p>\n<li>c</li>\n<li/></ul>')
+
+    def test_same_as_string(self):
+        '''
+        Rendering to a tree gives the same XML as parsing the XHTML string.
+        '''
+        with make_temp_directory() as tmdir:
+            os.chdir(tmdir)
+            p2x = render(tmdir, xml_tree=False)
+            self.assertIsNone(p2x.xml)
+            expected = etree.tostring(etree.fromstring(p2x.xhtml), encoding='unicode')
+            boxes = sorted(p2x.renderer.answer_box_objects)
+            p2x = render(tmdir, xml_tree=True)
+            self.assertIsNotNone(p2x.xml)
+            self.assertIsNone(p2x.renderer.xhtml)
+            self.assertEqual(etree.tostring(p2x.xml, encoding='unicode'), expected)
+            self.assertEqual(sorted(p2x.renderer.answer_box_objects), boxes)
+            self.assertEqual(len(boxes), 3)
+            # the XHTML file is written from the tree
+            self.assertEqual(etree.tostring(etree.fromstring(p2x.xhtml), encoding='unicode'), expected)
+        self.assertIn('[mathjaxinline]x^2 &lt; 3[/mathjaxinline]', expected)
+        self.assertIn('<img src="NOTFOUND-missing_image"/>', expected)
+        self.assertIn('<edx_general_hint_system/>', expected)
+
+    def test_extra_filters(self):
+        '''
+        Extra (text) filters make the renderer render to a string.
+        '''
+        with make_temp_directory() as tmdir:
+            os.chdir(tmdir)
+            p2x = plastex2xhtml(os.path.join(tmdir, 'test.tex'), latex_string='Hello world', add_wrap=True,
+                                extra_filters={'world': lambda m: 'there'})
+            p2x.convert()
+            self.assertIsNone(p2x.xml)
+            self.assertIn('Hello there', p2x.xhtml)
+
+    def test_custom_abox(self):
+        '''
+        An abox class (given by abox=) which only makes xmlstr is used, by rendering to a string.
+        '''
+        class Box(object):
+            def __init__(self, aboxstr, config=None, context=None, verbose=False):
+                self.xmlstr = '<customresponse cfn="check"/>'
+                self.xmlstr_just_code = self.xmlstr
+
+        with make_temp_directory() as tmdir:
+            os.chdir(tmdir)
+            p2x = plastex2xhtml(os.path.join(tmdir, 'test.tex'), latex_string=TEX, add_wrap=True, abox=Box)
+            p2x.convert()
+            self.assertIsNone(p2x.xml)
+            self.assertEqual(p2x.xhtml.count('<customresponse cfn="check"/>'), 3)
+
+    def test_overridden_filter(self):
+        '''
+        A renderer overriding a filter_fix_* method renders to a string, using it.
+        '''
+        class Renderer(MyRenderer):
+            def filter_fix_image(self, m):
+                return '<img src="custom"/>'
+
+        with make_temp_directory() as tmdir:
+            os.chdir(tmdir)
+            p2x = plastex2xhtml(os.path.join(tmdir, 'test.tex'), latex_string=TEX, add_wrap=True)
+            p2x.renderer = Renderer(xml_tree=True)
+            self.assertEqual(p2x.renderer.overridden_filters(), ['filter_fix_image'])
+            p2x.convert()
+            self.assertIsNone(p2x.xml)
+            self.assertIn('<img src="custom"/>', p2x.xhtml)
+        self.assertEqual(MyRenderer().overridden_filters(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+'''
+Test single-pass tag dispatch of XML filters, in latex2edx/xmlfilters.py
+'''
+import unittest
+from lxml import etree
+
+from latex2edx.xmlfilters import tag_filter, FilterDispatcher, ElementFilter
+
+
+class TestFilterDispatcher(unittest.TestCase):
+
+    XML = '''<document>
+  <p><dnd>a.tex</dnd></p>
+  <include>b.xml</include>
+  <problem><video src="x"/></problem>
+</document>'''
+
+    def test_tag_filter_whole_tree(self):
+        @tag_filter('video', 'problem')
+        def mark(elem):
+            elem.set('seen', '1')
+        xml = etree.fromstring(self.XML)
+        self.assertIsInstance(mark, ElementFilter)
+        mark(xml)
+        self.assertEqual(len(xml.findall('.//*[@seen="1"]')), 2)
+
+    def test_rename_passes_on_to_later_filter(self):
+        seen = []
+
+        @tag_filter('dnd')
+        def dnd(elem):
+            elem.tag = 'include'
+
+        @tag_filter('include', barrier=True)
+        def include(elem):
+            seen.append(elem.text)
+            elem.addprevious(etree.Element('video'))
+
+        @tag_filter('video')
+        def video(elem):
+            elem.set('done', '1')
+
+        xml = etree.fromstring(self.XML)
+        dispatcher = FilterDispatcher([dnd, include, video])
+        self.assertEqual(len(dispatcher.passes()), 2)
+        dispatcher.run(xml)
+        self.assertEqual(seen, ['a.tex', 'b.xml'])
+        # videos inserted by the barrier filter are seen by the following pass
+        self.assertEqual(len(xml.findall('.//video[@done="1"]')), 3)
+
+    def test_whole_tree_filter_is_barrier(self):
+        order = []
+
+        @tag_filter('problem')
+        def first(elem):
+            order.append('first')
+
+        def middle(tree):
+            order.append('middle')
+
+        @tag_filter('video')
+        def last(elem):
+            order.append('last')
+
+        dispatcher = FilterDispatcher([first, middle, last])
+        self.assertEqual(len(dispatcher.passes()), 3)
+        dispatcher.run(etree.fromstring(self.XML))
+        self.assertEqual(order, ['first', 'middle', 'last'])
+
+    def test_method_filter(self):
+        class Fixer(object):
+            def __init__(self):
+                self.count = 0
+
+            @tag_filter('video')
+            def fix_video(self, video):
+                self.count += 1
+
+        fixer = Fixer()
+        FilterDispatcher([fixer.fix_video]).run(etree.fromstring(self.XML))
+        self.assertEqual(fixer.count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
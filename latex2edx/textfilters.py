@@ -0,0 +1,117 @@
+'''
+Precompiled text (regular expression) filters.
+
+MyRenderer post-processes the XHTML from plasTeX with an ordered list of
+(pattern, function) filters, applied one re.sub after the other.  Each re.sub
+scans the whole document, even for the many filters which cannot match it
+(most documents have no includegraphics, displaymathverbatim, or abox
+elements, for example).
+
+TextFilters compiles the patterns once, and finds the literal text which
+every match of each pattern starts with (e.g. "<displaymath>").  A filter is
+only applied if that text is in the document, which "in" finds several times
+faster than the regular expression engine scans for it.  The result is the
+same as applying all the filters.
+
+Combining all the patterns into one regular expression, and dispatching each
+match to its filter in a single pass, is slower in CPython: an alternation is
+tried at every "<" of the document, and the dispatch (a Python function call
+and a second match per match) costs more than the C-level passes it saves,
+for math-heavy documents.
+'''
+
+import re
+
+GLOBAL_FLAGS = re.compile(r'\(\?[aiLmsux]+\)')
+SPECIAL_CHARACTERS = '.^$*+?{}[]\\|()'
+QUANTIFIERS = ['*', '+', '?', '{']
+
+
+def literal_prefix(pattern):
+    '''
+    Return the literal text which every match of (compiled) pattern starts with, or '' if there
+    is none (or it cannot simply be told).
+    '''
+    if not isinstance(pattern.pattern, str) or pattern.flags & (re.IGNORECASE | re.VERBOSE):
+        return ''
+    source = pattern.pattern
+    m = GLOBAL_FLAGS.match(source)
+    while m:
+        source = source[m.end():]
+        m = GLOBAL_FLAGS.match(source)
+    if top_level_alternation(source):
+        return ''
+    prefix = ''
+    pos = 0
+    while pos < len(source):
+        char = source[pos]
+        if char == '\\':
+            char = source[pos + 1:pos + 2]
+            if not char or char.isalnum():		# eg \d or \1, rather than escaped punctuation
+                break
+            end = pos + 2
+        elif char in SPECIAL_CHARACTERS:
+            break
+        else:
+            end = pos + 1
+        if source[end:end + 1] in QUANTIFIERS:		# the character may be repeated, or left out
+            break
+        prefix += char
+        pos = end
+    return prefix
+
+
+def top_level_alternation(source):
+    '''
+    Return True if regular expression source has a "|" outside of any group.
+    '''
+    depth = 0
+    pos = 0
+    while pos < len(source):
+        char = source[pos]
+        if char == '\\':
+            pos += 1
+        elif char == '[':			# skip character set, in which ] may come first
+            pos += 1
+            if source[pos:pos + 1] == '^':
+                pos += 1
+            if source[pos:pos + 1] == ']':
+                pos += 1
+            while pos < len(source) and source[pos] != ']':
+                pos += 2 if source[pos] == '\\' else 1
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == '|' and depth == 0:
+            return True
+        pos += 1
+    return False
+
+
+class TextFilters(object):
+    '''
+    Ordered list of (pattern, function) filters, applied to a string as re.sub(pattern, function, ...)
+    would be in turn.  Patterns may be strings or compiled regular expressions; functions may also be
+    replacement strings, as for re.sub.
+    '''
+
+    def __init__(self, filters):
+        self.filters = []
+        for (pat, func) in filters:
+            pattern = re.compile(pat)
+            self.filters.append((pattern, func, literal_prefix(pattern)))
+
+    def sub(self, stxt):
+        '''
+        Return stxt with all the filters applied.
+        '''
+        for (pattern, func, prefix) in self.filters:
+            if prefix and prefix not in stxt:
+                continue			# cannot match
+            try:
+                stxt = pattern.sub(func, stxt)
+            except Exception as err:
+                print("Error in rendering %s: %s" % (str(func)[:1000], str(err)[:1000]))
+                raise
+        return stxt
@@ -0,0 +1,97 @@
+'''
+Registry of the url_names used in a course.
+
+url_names are the database keys of edX course content, so they must be
+unique.  A UrlNameRegistry keeps the names in use in a set, for constant time
+lookups, and resolves collisions by adding a suffix to the requested name:
+repeated x's (as done by latex2edx.make_url_name), or an increasing number (as
+done by XBundle.make_urlname).  For each name that collided, the last suffix
+used is remembered, so that a thousand units all named "Problem" do not cost a
+million lookups.  The names given out are the same as those of a linear search,
+except that x's are only added up to MAX_LENGTH characters (beyond which names
+would not be usable as filenames); after that, _1, _2, ... are added.
+
+The registry can be saved to (and loaded from) a JSON file, or pickled, so
+that the names used by one build can be reserved in another, e.g. when
+merging chapters into an existing course.
+'''
+
+import json
+import re
+
+NUMBERED = re.compile(r'(.+?)([0-9]*)$')
+MAX_LENGTH = 200		# longest name made by adding x's
+
+
+class UrlNameRegistry(object):
+    '''
+    Set of url_names in use, with per-name collision counters.
+    '''
+
+    def __init__(self, names=None):
+        self.names = set()
+        self.counters = {}		# {(style, requested name): last suffix count used}
+        for name in names or []:
+            self.add(name)
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def add(self, name):
+        '''
+        Mark name as used (it may already be).
+        '''
+        self.names.add(name)
+
+    def add_unique(self, name, style='x'):
+        '''
+        Add name, or if it is already used, the first unused name made by adding
+        a suffix, and return the name added.  With style 'x', the suffix is x's
+        (name, namex, namexx, ..., then name_1, name_2, ...).  With style 'number',
+        any trailing number is incremented (name, name1, name2, ...; name7, name8, ...).
+        '''
+        if name in self.names:
+            key = (style, name)
+            count = self.counters.get(key, 0)
+            nx = max(MAX_LENGTH - len(name), 0)
+            while True:
+                count += 1
+                if style == 'number':
+                    (base, idx) = NUMBERED.match(name).groups()
+                    candidate = base + str(int(idx or 0) + count)
+                elif count <= nx:
+                    candidate = name + 'x' * count
+                else:
+                    candidate = '%s_%d' % (name, count - nx)
+                if candidate not in self.names:
+                    break
+            self.counters[key] = count
+            name = candidate
+        self.names.add(name)
+        return name
+
+    def as_dict(self):
+        return {'names': sorted(self.names),
+                'counters': sorted([style, name, count] for ((style, name), count) in self.counters.items())}
+
+    @classmethod
+    def from_dict(cls, data):
+        registry = cls(data.get('names', []))
+        for (style, name, count) in data.get('counters', []):
+            registry.counters[(style, name)] = count
+        return registry
+
+    def save(self, fn):
+        with open(fn, 'w') as fp:
+            fp.write(json.dumps(self.as_dict(), indent=2))
+
+    @classmethod
+    def load(cls, fn):
+        with open(fn) as fp:
+            return cls.from_dict(json.load(fp))
@@ -0,0 +1,99 @@
+'''
+Watch mode: rebuild a course whenever any of its source files change.
+
+The converter runs in the same process for every build, so python startup,
+module imports (plasTeX, lxml, the edXpsl macros), and the loading of the
+plasTeX templates are only paid once.  Files are polled for changes in their
+modification time and size, so no extra packages are needed.  The files
+watched are those reported by the converter after each build (the tex file,
+\\input files, images, and \\edXinclude, \\edXincludepy, \\edXdndtex files).
+'''
+
+import os
+import time
+import traceback
+
+import plasTeX
+
+from .buildcache import IdGenerator
+
+
+class Watcher(object):
+    '''
+    Build using converters from make_converter (a function returning a latex2edx
+    instance), then build again each time a watched file changes.
+
+    on_build, if given, is called with the converter after each successful build.
+    '''
+
+    def __init__(self, make_converter, files, interval=1.0, on_build=None):
+        self.make_converter = make_converter
+        self.files = list(files)
+        self.interval = interval
+        self.on_build = on_build
+        self.nbuilds = 0
+        self.nfailed = 0
+
+    @staticmethod
+    def file_state(fn):
+        try:
+            st = os.stat(fn)
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size)
+
+    def snapshot(self):
+        return dict((fn, self.file_state(fn)) for fn in self.files)
+
+    def changed_files(self, snapshot):
+        return [fn for fn in self.files if self.file_state(fn) != snapshot.get(fn)]
+
+    def build(self):
+        '''
+        Do one build, and update the list of watched files.  Errors are reported,
+        but do not stop the watching.  Returns True if the build succeeded.
+        '''
+        t0 = time.time()
+        plasTeX.idgen = IdGenerator(1)		# so element ids are the same as for a fresh process
+        converter = None
+        try:
+            converter = self.make_converter()
+            converter.convert()
+            ok = True
+        except Exception as err:
+            traceback.print_exc()
+            print("[latex2edx.watch] Build failed: %s" % err)
+            ok = False
+        self.nbuilds += 1
+        if converter is not None:
+            files = converter.watched_files()
+            if not ok:		# the build may not have got to all the files, so keep watching the old ones too
+                files += [fn for fn in self.files if fn not in files]
+            self.files = files
+        if ok:
+            if self.on_build is not None:
+                self.on_build(converter)
+            print("[latex2edx.watch] Built in %.2f sec; watching %d files for changes" % (time.time() - t0,
+                                                                                        len(self.files)))
+        else:
+            self.nfailed += 1
+        return ok
+
+    def run(self, max_builds=None):
+        '''
+        Build, then watch for changes and rebuild, until interrupted (or max_builds
+        builds have been done).
+        '''
+        try:
+            self.build()
+            snapshot = self.snapshot()
+            while max_builds is None or self.nbuilds < max_builds:
+                time.sleep(self.interval)
+                changed = self.changed_files(snapshot)
+                if not changed:
+                    continue
+                print("[latex2edx.watch] Changed: %s" % ', '.join(changed))
+                self.build()
+                snapshot = self.snapshot()
+        except KeyboardInterrupt:
+            print("\n[latex2edx.watch] Stopped after %d builds" % self.nbuilds)
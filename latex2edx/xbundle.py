@@ -20,16 +20,188 @@ import sys
 import re
 import string
 import glob
-import codecs
+import copy
 import subprocess
+import threading
+import gzip
 
+from concurrent.futures import ThreadPoolExecutor
 from lxml import etree
-from lxml.html.soupparser import fromstring as fsbs
+try:
+    from .urlnames import UrlNameRegistry
+    from .filewriter import FileWriter, TarWriter
+    from .dirindex import DirectoryIndex
+except ImportError:		# when run as a script
+    from urlnames import UrlNameRegistry
+    from filewriter import FileWriter, TarWriter
+    from dirindex import DirectoryIndex
 try:
     from path import path	# needs path.py
 except Exception as err:
     from path import Path as path
 
+#-----------------------------------------------------------------------------
+# XML formatting
+#
+# Files are written in the format of "xmllint --format" (without the XML
+# declaration), as produced by libxml2 up to version 2.13:
+#
+#   - whitespace-only text is dropped when it is the first text in an element with
+#     children, or follows a child of an element which does not start with text
+#   - elements whose children are all elements, comments, or processing instructions
+#     have them indented by two spaces per level (up to 60 spaces); the contents of
+#     elements with text are left as they are
+#   - non-ASCII characters are written as hexadecimal character references, eg &#xE9;,
+#     except in comments and processing instructions, where they are decimal; so is
+#     carriage return in text (&#xD;), but not in attribute values (&#13;)
+#
+# format_xml does this without running xmllint, so that it is the same whichever
+# libxml2 is installed (later versions of libxml2 indent differently).
+# iter_format_xml gives the same output in pieces, one subtree at a time, for
+# writing very large xbundles without holding the whole formatted text.
+
+XML_SPACE = '{http://www.w3.org/XML/1998/namespace}space'
+# xml:space states of the libxml2 parser; whitespace is always kept after SPACE_AFTER_TEXT,
+# which an element in SPACE_INHERIT changes to once text starting with whitespace is kept
+(SPACE_INHERIT, SPACE_DEFAULT, SPACE_PRESERVE, SPACE_AFTER_TEXT) = (-1, 0, 1, -2)
+BLANK_RUN = re.compile('(?:^|[&<>\r\x80-\U0010ffff])[ \t\n]')	# text starting with whitespace, or whitespace after a character reference
+MAX_INDENT = 30
+MARKUP_OR_CHARREF = re.compile(rb'<!--.*?-->|<\?.*?\?>|<[^>]*>|&#([0-9]+);', re.S)
+CHARREF = re.compile(rb'&#([0-9]+);')
+
+
+def is_blank(text):
+    return not text.strip(' \t\n')
+
+
+def strip_blanks(elem, space=SPACE_INHERIT):
+    '''
+    Remove whitespace-only text from elem and its descendants, as the libxml2 parser does for xmllint --format.
+    space is the xml:space state of the parent element.
+    '''
+    if space == SPACE_AFTER_TEXT:
+        space = SPACE_INHERIT
+    space = {'default': SPACE_DEFAULT, 'preserve': SPACE_PRESERVE}.get(elem.get(XML_SPACE), space)
+
+    def keep(text, first):
+        nonlocal space
+        if not text:
+            return None
+        if is_blank(text):
+            if not (space in [SPACE_PRESERVE, SPACE_AFTER_TEXT]
+                    or (first and not len(elem))		# only content
+                    or (not first and elem.text is not None)):	# element starts with text
+                return None
+        elif not BLANK_RUN.search(text):
+            return text
+        if space == SPACE_INHERIT:
+            space = SPACE_AFTER_TEXT
+        return text
+
+    elem.text = keep(elem.text, True)
+    for child in elem:
+        if isinstance(child.tag, str):
+            strip_blanks(child, space)
+        child.tail = keep(child.tail, False)
+
+
+def indent_xml(elem, level=0):
+    '''
+    Indent children of elem and its descendants, stopping at elements with text content.
+    '''
+    if elem.text is not None or not len(elem):
+        return
+    if any(child.tail is not None or child.tag is etree.Entity for child in elem):
+        return
+    pad = '\n' + '  ' * min(level, MAX_INDENT)
+    subpad = '\n' + '  ' * min(level + 1, MAX_INDENT)
+    elem.text = subpad
+    for child in elem:
+        if isinstance(child.tag, str):
+            indent_xml(child, level + 1)
+        child.tail = subpad
+    child.tail = pad
+
+
+def hex_charref(m, minimum=128):
+    if int(m.group(1)) < minimum:
+        return m.group(0)
+    return b'&#x%X;' % int(m.group(1))
+
+
+def text_or_tag_charref(m):
+    data = m.group(0)
+    if m.group(1) is not None:			# character reference in text
+        return hex_charref(m) if m.group(1) != b'13' else b'&#xD;'
+    if data.startswith((b'<!--', b'<?')) or b'&#' not in data:
+        return data
+    return CHARREF.sub(hex_charref, data)	# tag, with character references in attribute values
+
+
+def convert_charrefs(data):
+    if b'&#' not in data:
+        return data
+    return MARKUP_OR_CHARREF.sub(text_or_tag_charref, data)
+
+
+def format_element(xml, level=0, space=SPACE_INHERIT):
+    '''
+    Return xml element formatted at indentation level, as bytes, without tail.
+    space is the xml:space state of its parent.
+    '''
+    xml = copy.deepcopy(xml)
+    xml.tail = None
+    strip_blanks(xml, space)
+    indent_xml(xml, level)
+    return convert_charrefs(etree.tostring(xml, encoding='ascii'))
+
+
+def format_xml(xml):
+    '''
+    Return xml element formatted as by "xmllint --format", as bytes, without XML declaration.
+    '''
+    return format_element(xml) + b'\n'
+
+
+def iter_format_xml(xml, depth=1, level=0, space=SPACE_INHERIT):
+    '''
+    Yield format_xml(xml) in pieces: the start and end tags of xml (and of its descendants,
+    down to depth levels), with each child in between formatted separately.  This is only
+    done where it gives the same output, ie for an element which is indented (with
+    children, and only whitespace text), with no namespaces; else the element is formatted whole.
+    '''
+    state = SPACE_INHERIT if space == SPACE_AFTER_TEXT else space
+    state = {'default': SPACE_DEFAULT, 'preserve': SPACE_PRESERVE}.get(xml.get(XML_SPACE), state)
+    texts = [xml.text] + [child.tail for child in xml]
+    if (depth < 1 or not len(xml) or xml.nsmap or state == SPACE_PRESERVE
+            or not all(text is None or is_blank(text) for text in texts)
+            or any(child.tag is etree.Entity for child in xml)):
+        yield format_element(xml, level, space) + (b'\n' if level == 0 else b'')
+        return
+    start = etree.tostring(etree.Element(xml.tag, dict(xml.attrib)), encoding='ascii')
+    yield convert_charrefs(start[:-2] + b'>')		# <tag .../> -> <tag ...>
+    subpad = ('\n' + '  ' * min(level + 1, MAX_INDENT)).encode('ascii')
+    for child in xml:
+        yield subpad
+        if isinstance(child.tag, str):
+            for data in iter_format_xml(child, depth - 1, level + 1, state):
+                yield data
+        else:						# comment or processing instruction
+            yield convert_charrefs(etree.tostring(child, encoding='ascii', with_tail=False))
+    yield ('\n' + '  ' * min(level, MAX_INDENT)).encode('ascii')
+    yield b'</%s>' % xml.tag.encode('utf8') + (b'\n' if level == 0 else b'')
+
+
+def xmllint_format(xml):
+    '''
+    Return xml element formatted by running "xmllint --format", as bytes, without XML declaration.
+    '''
+    p = subprocess.run(['xmllint', '--format', '-'], input=etree.tostring(xml, with_tail=False), stdout=subprocess.PIPE, check=True)
+    data = p.stdout
+    if data.startswith(b'<?xml '):
+        data = data.split(b'\n', 1)[1]
+    return data
+
 #-----------------------------------------------------------------------------
 
 DEF_POLICY_JSON = """
@@ -125,10 +297,19 @@ class XBundle(object):
     DefaultOrg = 'MITx'
     PolicyTagMap = {'policy' : 'policy', 'gradingpolicy': 'grading_policy'}
     html_parser = etree.HTMLParser(compact=False,recover=True,remove_blank_text=True)
+    CacheSuffix = '.cache'
+    CacheMagic = b'XBUNDLE-CACHE'
+    CacheVersion = 1
 
     def __init__(self, keep_urls=False, force_studio_format=False,
                  skip_hidden=False, keep_studio_urls=False,
                  no_overwrite=None,
+                 output_hashes=None,
+                 url_names=None,
+                 xmllint=False,
+                 jobs=1,
+                 writer=None,
+                 unchanged_units=None,
                  ):
         '''
         if keep_urls=True then the original url_name attributes are kept upon import and export,
@@ -137,10 +318,29 @@ class XBundle(object):
         if keep_studio_urls=True and keep_urls=True, then keep random urls.
 
         no_overwrite: optional list of xml tags for which files should not be overwritten (eg course)
+
+        output_hashes: optional dict of sha1 hashes (with sizes and mtimes) of files written by a previous export,
+                       keyed by absolute path, used to recognize unchanged files without reading them (see FileWriter);
+                       the dict is updated.
+
+        url_names: optional UrlNameRegistry of url_names already in use (eg shared with latex2edx).
+
+        xmllint: if True, format XML files by running xmllint (slow), instead of the equivalent format_xml.
+
+        jobs: number of threads used to write files on export (see FileWriter); if > 1, call self.writer.wait()
+              after export_xml_to_directory or write_xml_file (export_to_directory does this itself).
+              Also the number of threads used to parse files on import.
+
+        writer: optional FileWriter to use (eg shared with latex2edx, for its manifest), instead of making one
+                with jobs and output_hashes.  Files with unchanged content are not written again in any case.
+
+        unchanged_units: optional set of (tag, url_name) of descriptors known to be exported to the same file as by
+                         a previous export (see xbundlediff.unchanged_units); their files, if they exist, are kept
+                         as they are, without being formatted again.
         '''
         self.course = etree.Element('course')
         self.metadata = etree.Element('metadata')
-        self.urlnames = []
+        self.urlnames = url_names if url_names is not None else UrlNameRegistry()
         self.xml = None				# only used if XML xbundle file was read in
         self.keep_urls = keep_urls
         self.force_studio_format = force_studio_format	# sequential must be followed by vertical in export
@@ -148,8 +348,20 @@ class XBundle(object):
         self.keep_studio_urls = keep_studio_urls
         self.no_overwrite = no_overwrite or []
         self.overwrite_files = []
+        self.xmllint = xmllint
+        self.jobs = jobs
+        self.own_writer = writer is None
+        self.writer = writer if writer is not None else FileWriter(jobs, hashes=output_hashes)
+        self.unchanged_units = unchanged_units or set()
         return
 
+    @property
+    def nunchanged(self):
+        '''
+        number of files not written since unchanged
+        '''
+        return self.writer.nunchanged
+
 
     #----------------------------------------
     # creation by parts
@@ -170,7 +382,7 @@ class XBundle(object):
             def walk(xml):
                 un = xml.get('url_name','')
                 if un:
-                    self.urlnames.append(un)
+                    self.urlnames.add(un)
                 if xml.tag in self.DescriptorTags:
                     for child in xml:
                         walk(child)
@@ -196,23 +408,148 @@ class XBundle(object):
     #----------------------------------------
     # load/save
 
-    def load(self, fn):
+    def load(self, fn, cache=None, update_cache=False):
         """
-        Load from xbundle.xml file
+        Load from xbundle.xml file.
+
+        cache: filename of a compressed copy of the xbundle (see save_cache), default fn + '.cache';
+               if it was made from fn as it is now (same size and modification time), it is read
+               instead of fn.  cache=False always parses fn.
+        update_cache: if True, write the cache if it was missing or out of date.
         """
-        self.xml = etree.parse(fn).getroot()
+        if cache is None:
+            cache = self.cache_filename(fn)
+        xml = self.load_cache(cache, fn) if cache else None
+        parsed = xml is None
+        if parsed:
+            xml = etree.parse(fn).getroot()
+        self.xml = xml
         self.course = self.xml.find('course')
         self.metadata = self.xml.find('metadata')
         self.errlog("course id = %s" % self.course_id())
+        if parsed and cache and update_cache:
+            self.save_cache(fn, cache)
+
+
+    def cache_filename(self, fn):
+        return fn + self.CacheSuffix
+
+
+    def cache_header(self, fn):
+        '''
+        First line of the cache of xbundle file fn: format version, and the size and modification time of fn.
+        '''
+        st = os.stat(fn)
+        return b'%s %d %d %d\n' % (self.CacheMagic, self.CacheVersion, st.st_size, st.st_mtime_ns)
+
+
+    def save_cache(self, fn, cache=None):
+        """
+        Save a compressed copy of the xbundle, which was just loaded from or saved to file fn,
+        for load(fn) to read instead of fn, until fn is changed.  The cache holds the unformatted
+        XML, compressed with gzip, after a header line identifying fn; it is typically a tenth the
+        size of fn, or less, so it is quicker to read from a slow or network disk.
+        """
+        cache = cache or self.cache_filename(fn)
+        xml = self.xml
+        if xml is None or xml.find('course') is not self.course:
+            xml = etree.Element('xbundle')
+            xml.append(self.metadata)
+            xml.append(self.course)
+            self.xml = xml
+        tmpfn = '%s.tmp%d' % (cache, os.getpid())
+        with open(tmpfn, 'wb') as fp:
+            fp.write(self.cache_header(fn))
+            with gzip.GzipFile(fileobj=fp, mode='wb', compresslevel=1, mtime=0) as gz:
+                gz.write(etree.tostring(xml))
+        os.replace(tmpfn, cache)
+
+
+    def load_cache(self, cache, fn):
+        '''
+        Return the <xbundle> element from cache file, or None if it does not exist or is not
+        the cache of fn as it is now.
+        '''
+        if not os.path.exists(cache):
+            return None
+        try:
+            with open(cache, 'rb') as fp:
+                header = fp.readline()
+                if header != self.cache_header(fn):
+                    return None
+                xml = etree.parse(gzip.GzipFile(fileobj=fp, mode='rb')).getroot()
+        except Exception as err:
+            print("[xbundle] Ignoring cache %s, error %s" % (cache, err))
+            return None
+        print("[xbundle] Loaded %s from cache %s" % (fn, cache))
+        return xml
+
+
+    def load_streaming(self, fn):
+        """
+        Start loading xbundle.xml file incrementally, for files too large to hold in memory:
+        read the metadata and the <course> start tag, setting self.metadata, and self.course
+        (with no children yet).  Return an iterator over the children of the course (eg chapters),
+        each appended to self.course as it is read; the caller may remove (eg export) each one
+        before the next is read.  The metadata should come before the course, as written by save().
+        """
+        events = etree.iterparse(fn, events=('start', 'end'))
+        depth = 0
+        for (event, elem) in events:
+            if event == 'end':
+                depth -= 1
+                if depth == 1 and elem.tag == 'metadata':
+                    self.metadata = elem
+                continue
+            depth += 1
+            if depth == 2 and elem.tag == 'course':
+                self.xml = etree.Element('xbundle')
+                self.course = etree.SubElement(self.xml, 'course', dict(elem.attrib))
+                self.errlog("course id = %s" % self.course_id())
+                return self.iter_course_children(events, elem)
+        raise Exception("[xbundle] no course in %s" % fn)
+
+
+    def iter_course_children(self, events, live):
+        '''
+        Move each child of live (the <course> being parsed) to self.course when it has been read, and yield it.
+        '''
+        depth = 2
+        for (event, elem) in events:
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            if depth == 2:
+                while len(live):		# include preceding comments
+                    child = live[0]
+                    self.course.append(child)
+                    if child is elem:
+                        break
+                yield elem
+            elif depth == 1:			# end of course
+                self.course.text = live.text
+                for child in list(live):
+                    self.course.append(child)
+                return
 
 
     def save(self, fn='xbundle.xml', fp=None):
         """
-        Save to xbundle.xml file
+        Save to xbundle.xml file.  The file is written a chapter at a time, as each is
+        formatted, so that the whole formatted file is not held in memory.
         """
-        if fp is None:
-            fp = open(fn,'w')
-        fp.write(str(self))
+        xml = etree.Element('xbundle')
+        self.xml = xml
+        xml.append(self.metadata)
+        xml.append(self.course)
+        if fp is not None:
+            for data in self.iter_pp_xml(xml, depth=2):
+                fp.write(data.decode())
+            return
+        with open(fn, 'w') as fp:
+            for data in self.iter_pp_xml(xml, depth=2):
+                fp.write(data.decode())
 
 
     def __str__(self):
@@ -226,17 +563,67 @@ class XBundle(object):
     # import/export
 
 
-    def import_from_directory(self, dir='./'):
+    def import_from_directory(self, dir='./', cache=None):
         '''
         Create xbundle from edX xml directory.
         Using this is a great way to sanitize directory structure
         and also normalize url_name filenames (and make them
         meaningfully human readable).
+
+        cache: optional filename of an import cache; if given, and no file in dir has been added,
+               removed, or modified (by size and mtime) since the cache was saved, the xbundle is
+               loaded from the cache, instead of from the course files.  Else the cache is updated.
         '''
         dir = path(dir)
+        index = DirectoryIndex(dir, exclude=[cache] if cache else [])
+        key = None
+        if cache and not self.skip_hidden:		# skip_hidden depends on self.policy, which is not in the key
+            key = self.import_cache_key(index)
+            if self.load_import_cache(cache, key):
+                return
         self.metadata = etree.Element('metadata')
         self.import_metadata_from_directory(dir)
-        self.import_course_from_directory(dir)
+        self.import_course_from_directory(dir, index=index)
+        if key is not None:
+            self.save_import_cache(cache, key)
+
+
+    def import_cache_key(self, index):
+        options = [self.keep_urls, self.keep_studio_urls]
+        return '%s-%s' % (index.signature(), ''.join(str(int(x)) for x in options))
+
+
+    def load_import_cache(self, fn, key):
+        '''
+        Load metadata and course from import cache file fn, if it exists and has the given key.
+        Return True if loaded.
+        '''
+        if not os.path.exists(fn):
+            return False
+        try:
+            for (event, elem) in etree.iterparse(fn, events=('start',)):	# just read the key
+                if elem.get('import_key') != key:
+                    return False
+                break
+            xml = etree.parse(fn).getroot()
+        except Exception as err:
+            print("[xbundle] Ignoring import cache %s, error %s" % (fn, err))
+            return False
+        self.metadata = xml.find('metadata')
+        self.course = xml.find('course')
+        print("[xbundle] Loaded course from import cache %s" % fn)
+        return True
+
+
+    def save_import_cache(self, fn, key):
+        try:
+            data = etree.tostring(self.metadata) + etree.tostring(self.course)
+            etree.fromstring(b'<xbundle>' + data + b'</xbundle>')	# check it can be read back
+        except Exception as err:
+            print("[xbundle] Not saving import cache %s, error %s" % (fn, err))
+            return
+        with open(fn, 'wb') as fp:
+            fp.write(b'<xbundle import_key="' + key.encode('ascii') + b'">' + data + b'</xbundle>\n')
 
 
     def import_metadata_from_directory(self, dir):
@@ -259,12 +646,12 @@ class XBundle(object):
                 print("Oops, failed to add file %s, error=%s" % (afn, err))
 
 
-    def import_course_from_directory(self, dir):
+    def import_course_from_directory(self, dir, index=None):
         '''load course tree, removing intermediate descriptors with url_name'''
         dir = path(dir)
         x = etree.parse(dir / 'course.xml').getroot()
         semester = x.get('url_name','')		# the url_name of <course> is special - the semester
-        cxml = self.import_xml_removing_descriptor(dir, x)
+        cxml = self.import_xml_removing_descriptor(dir, x, index=index)
         cxml.set('semester',semester)
         self.course = cxml
         self.fix_old_course_section()
@@ -322,107 +709,177 @@ class XBundle(object):
                     xml.set(k,str(v))
 
 
-    def import_xml_removing_descriptor(self, dir, xml):
+    def import_xml_removing_descriptor(self, dir, xml, index=None):
         '''
-        load XML file, recursively following and removing intermediate
-        descriptors with url_name.
+        load XML file, following and removing intermediate
+        descriptors with url_name, throughout the tree below xml.
 
         if element is a DescriptorTag element, and display_name is missing, then
         use its url_name, if that is available.
 
-        dir should be a path.
+        dir should be a path.  index is a DirectoryIndex of dir, used to check
+        which files exist (made if not given).
+
+        The tree is walked level by level (not recursively); the files for all
+        the elements of a level are parsed together, using self.jobs threads.
+        Returns the element which replaces xml.
         '''
-        un = xml.get('url_name','')
-        if xml.tag in self.DescriptorTags and 'url_name' in xml.attrib and un:
-            unfn = un.replace(':','/')		# colon -> subdir slash in url_name
-            fn = dir / xml.tag / (unfn+'.xml')
-            if not os.path.exists(fn):
-                # print "[xbundle] Skipping %s, does not exist" % fn
-                return xml
-            try:
-                dxml = etree.parse(fn).getroot()
-            except Exception as err:
-                print("[xbundle] Error parsing xml for %s" % fn)
-                raise
-            try:
-                dxml.attrib.update(xml.attrib)
-            except Exception as err:
-                print("[xbundle] error updating attribute, dxml=%s\nxml=%s"  % (etree.tostring(dxml), etree.tostring(xml)))
-                print("dxml.attrib=%s" % dxml.attrib)
-                print("xml.attrib=%s" % xml.attrib)
-                print("likely your version of lxml is too old (need version >= 3)")
-                raise
-            dxml.attrib.pop('url_name')
+        if index is None:
+            index = DirectoryIndex(dir)
+        pool = ThreadPoolExecutor(max_workers=self.jobs) if self.jobs > 1 else None
+        local = threading.local()		# html parser for each thread
+
+        def parse(fn, html):
+            if not html:
+                return etree.parse(fn).getroot()
+            if pool is None:
+                return etree.parse(fn, parser=self.html_parser).getroot()
+            if not hasattr(local, 'parser'):
+                local.parser = self.html_parser.copy()
+            return etree.parse(fn, parser=local.parser).getroot()
+
+        def parse_all(requests):
+            '''
+            requests = list of (filename, html) or None; returns list of (root element, exception)
+            '''
+            def parse_or_error(request):
+                if request is None:
+                    return (None, None)
+                try:
+                    return (parse(*request), None)
+                except Exception as err:
+                    return (None, err)
+            if pool is None:
+                return [parse_or_error(r) for r in requests]
+            return list(pool.map(parse_or_error, requests))
 
-            if self.keep_urls and self.is_not_random_urlname(un):
-                dxml.set('url_name_orig', un)	# keep url_name as url_name_orig
+        try:
+            (resolved, level) = self.import_level(dir, index, parse_all, [(None, xml)])
+            xml = resolved[0]
+            while level:
+                (resolved, level) = self.import_level(dir, index, parse_all, level)
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=True)
+        return xml
 
-            if dxml.tag in self.DescriptorTags and dxml.get('display_name') is None:
-                if not dxml.tag=='course':	# special case: don't add display_name to course
-                    dxml.set('display_name',un)
 
-            if self.skip_hidden:
-                self.update_metadata_from_policy(dxml)
-                if xml.get('hide_from_toc','')=='true':
-                    print("[xbundle] Skipping %s (%s), it has hide_from_toc=true" % (xml.tag, xml.get('display_name','<noname>')))
+    def import_level(self, dir, index, parse_all, level):
+        '''
+        Resolve the elements of one level of the tree being imported, replacing each descriptor
+        (with url_name) by the contents of its file, and each html or problem with a filename
+        by the contents of that file.  level is a list of (parent, element).
+        Return the resolved elements, and the next level, ie the children of the resolved elements.
+        '''
+        uns = [x.get('url_name', '') for (parent, x) in level]
+        descend = [True] * len(level)
+
+        # descriptors
+        requests = []
+        for (k, (parent, x)) in enumerate(level):
+            un = uns[k]
+            request = None
+            if x.tag in self.DescriptorTags and 'url_name' in x.attrib and un:
+                unfn = un.replace(':','/')		# colon -> subdir slash in url_name
+                if '%s/%s.xml' % (x.tag, unfn) in index:
+                    request = (dir / x.tag / (unfn+'.xml'), False)
                 else:
-                    xml = dxml
-            else:
-                xml = dxml
-
-        fn = xml.get('filename','')
-        if xml.tag in ['html','problem'] and fn: # special for <html filename="..." display_name="..."/>
-                                                 # and <problem filename="...">
-            if xml.tag=='html':
-                if not fn.endswith('.html'):
-                    fn += '.html'
-                #if not fn.startswith('html/'):
-                #    fn = 'html/' + fn
-                options = dict(parser=self.html_parser)
-            elif xml.tag=='problem':
-                if not fn.endswith('.xml'):
-                    fn += '.xml'
-                #if not fn.startswith('problems/'):
-                #    fn = 'problems/' + fn
-                options = {}
-
-            if not os.path.exists(dir/xml.tag/fn):
-                if '-' in fn:
-                    fn = '%s/%s' % (fn.split('-',1)[0], fn)
-            try:
-                dxml = etree.parse(dir / xml.tag / fn, **options).getroot()
-            except Exception as err:
-                print("Error!  Can't load and parse HTML file %s, error:" % (dir/xml.tag/fn))
+                    # print "[xbundle] Skipping %s, does not exist" % fn
+                    descend[k] = None
+            requests.append(request)
+        resolved = [x for (parent, x) in level]
+        for (k, (dxml, err)) in enumerate(parse_all(requests)):
+            if err is not None:
+                print("[xbundle] Error parsing xml for %s" % requests[k][0])
+                raise err
+            if dxml is not None:
+                resolved[k] = self.replace_descriptor(level[k][1], dxml, uns[k])
+
+        # html and problem files
+        requests = []
+        for (k, x) in enumerate(resolved):
+            fn = x.get('filename','')
+            request = None
+            if descend[k] is not None and x.tag in ['html','problem'] and fn:	# special for <html filename="..." display_name="..."/>
+                                                                    	# and <problem filename="...">
+                if x.tag=='html':
+                    if not fn.endswith('.html'):
+                        fn += '.html'
+                elif x.tag=='problem':
+                    if not fn.endswith('.xml'):
+                        fn += '.xml'
+                if '%s/%s' % (x.tag, fn) not in index:
+                    if '-' in fn:
+                        fn = '%s/%s' % (fn.split('-',1)[0], fn)
+                request = (dir / x.tag / fn, x.tag=='html')
+            requests.append(request)
+        for (k, (dxml, err)) in enumerate(parse_all(requests)):
+            if err is not None:
+                print("Error!  Can't load and parse HTML file %s, error:" % requests[k][0])
                 print(err)
-                dxml = None
             if dxml is not None:
+                x = resolved[k]
                 if 'xmlns' in dxml.attrib:
                     dxml.attrib.pop('xmlns')
-                dxml.attrib.update(xml.attrib)
+                dxml.attrib.update(x.attrib)
                 dxml.attrib.pop('filename')
                 if dxml.tag in self.DescriptorTags and dxml.get('display_name') is None:
-                    dxml.set('display_name',un)
-                xml = dxml
+                    dxml.set('display_name',uns[k])
+                resolved[k] = dxml
+
+        nextlevel = []
+        for (k, (parent, x)) in enumerate(level):
+            xml = resolved[k]
+            if descend[k] is None:
+                continue
+            if self.skip_hidden:
+                self.update_metadata_from_policy(xml)
+                if xml.get('hide_from_toc','')=='true':
+                    print("[xbundle] Skipping %s (%s), it has hide_from_toc=true" % (xml.tag, xml.get('display_name','<noname>')))
+                    descend[k] = False
+            if xml is not x and parent is not None:
+                x.addprevious(xml)	# replace descriptor with contents
+                parent.remove(x)
+            if descend[k]:
+                nextlevel.extend((xml, child) for child in xml)
+        return (resolved, nextlevel)
+
+
+    def replace_descriptor(self, xml, dxml, un):
+        '''
+        Return the element (dxml, loaded from the file for descriptor xml with url_name un) which replaces xml.
+        '''
+        try:
+            dxml.attrib.update(xml.attrib)
+        except Exception as err:
+            print("[xbundle] error updating attribute, dxml=%s\nxml=%s"  % (etree.tostring(dxml), etree.tostring(xml)))
+            print("dxml.attrib=%s" % dxml.attrib)
+            print("xml.attrib=%s" % xml.attrib)
+            print("likely your version of lxml is too old (need version >= 3)")
+            raise
+        dxml.attrib.pop('url_name')
+
+        if self.keep_urls and self.is_not_random_urlname(un):
+            dxml.set('url_name_orig', un)	# keep url_name as url_name_orig
+
+        if dxml.tag in self.DescriptorTags and dxml.get('display_name') is None:
+            if not dxml.tag=='course':	# special case: don't add display_name to course
+                dxml.set('display_name',un)
 
         if self.skip_hidden:
-            self.update_metadata_from_policy(xml)
+            self.update_metadata_from_policy(dxml)
             if xml.get('hide_from_toc','')=='true':
                 print("[xbundle] Skipping %s (%s), it has hide_from_toc=true" % (xml.tag, xml.get('display_name','<noname>')))
                 return xml
+        return dxml
 
-        for child in xml:
-            dchild = self.import_xml_removing_descriptor(dir, child)	# recurse
-            if not dchild==child:
-                child.addprevious(dchild)	# replace descriptor with contents
-                xml.remove(child)
-        return xml
 
-
-    def export_to_directory(self, exdir='./', xml_only=False, newfmt=True):
+    def export_to_directory(self, exdir='./', xml_only=False, newfmt=True, chapters=None):
         '''
         Export xbundle to edX xml directory
-        First insert all the intermediate descriptors needed.
         Do about and XML separately.
+        chapters: optional iterator over the children of the course (from load_streaming), which are
+                  exported as they are read, instead of the children of self.course.
         '''
         coursex = etree.Element('course')
         semester = self.course.get('semester', '')
@@ -436,20 +893,36 @@ class XBundle(object):
         else:
             coursex.set('number', self.course.get('number', ''))  # backwards compatibility
 
-        self.export = self.make_descriptor(self.course, semester)
-        self.export.append(self.course)
-        self.add_descriptors(self.course)
-
-        # print self.pp_xml(self.export)
+        self.set_url_name(self.course, semester)
 
         self.dir = self.mkdir(path(exdir) / self.course_id())
+        self.export_xml_to_directory(self.course, dowrite=True, children=chapters)
         if not xml_only:
-            self.export_meta_to_directory()
-        self.export_xml_to_directory(self.export[0], dowrite=True)
+            self.export_meta_to_directory()		# after the course, whose end may be where metadata is read
 
         # write out top-level course.xml
 
         self.write_xml_file(self.dir / 'course.xml', coursex)
+        if self.own_writer:
+            self.writer.close()			# also stops its threads
+        else:
+            self.writer.wait()
+
+
+    def export_to_tarball(self, tarfn, xml_only=False, newfmt=True, prefix='course', chapters=None):
+        '''
+        Export xbundle to compressed tar archive tarfn (eg course.tar.gz, for import into Open edX),
+        with the course files in directory prefix, streamed into the archive without writing them to disk.
+        chapters is as for export_to_directory.
+        '''
+        writer = self.writer
+        exdir = os.getcwd()			# not written to; only used to name the files
+        self.writer = TarWriter(tarfn, os.path.join(exdir, self.course_id()), prefix=prefix)
+        try:
+            self.export_to_directory(exdir, xml_only=xml_only, newfmt=newfmt, chapters=chapters)
+            self.writer.close()
+        finally:
+            self.writer = writer
 
 
     def export_meta_to_directory(self):
@@ -462,18 +935,12 @@ class XBundle(object):
             dir = self.mkdir(pdir / semester)
             for k in pxml:
                 fn = self.PolicyTagMap.get(k.tag, k.tag) + '.json'
-                open(dir / fn, 'w').write(k.text)  # write out content to policy directory file
+                self.writer.write(dir / fn, k.text)  # write out content to policy directory file
 
         adir = self.mkdir(self.dir / 'about')
         for fxml in self.metadata.findall('about/file'):
             fn = fxml.get('filename')
-            try:
-                fp = open(adir / fn, 'w')
-                if fxml.text is not None and len(fxml.text):
-                    fp.write(fxml.text)
-                fp.close()
-            except Exception as err:
-                self.errlog('failed to write about file %s, error %s' % (adir / fn, err))
+            self.writer.write(adir / fn, fxml.text or '')
 
 
     def write_xml_file(self, fn, xml, force_overwrite=False):
@@ -481,54 +948,67 @@ class XBundle(object):
             print("[xbundle] Not overwriting %s for %s" % (fn, xml))
             fn = fn + '.new'
             self.overwrite_files.append(fn)
-        open(fn, 'w').write(self.pp_xml(xml).decode())
+        self.writer.write(fn, self.pp_xml(xml), source=self.source_location(xml))
+
+    @staticmethod
+    def source_location(xml):
+        '''
+        Return "tex_filename:linenum" for the first element (in xml or below it) with a tex_filename, else None.
+        '''
+        for x in xml.iter(tag=etree.Element):
+            if x.get('tex_filename'):
+                return '%s:%s' % (x.get('tex_filename'), x.get('linenum', ''))
+        return None
 
-    def export_xml_to_directory(self, elem, dowrite=False):
+    def export_xml_to_directory(self, elem, dowrite=False, parent='', children=None):
         '''
-        Do this recursively.  If an element is a descriptor, then put that in its own
-        subdirectory.
+        Export the descriptors within elem, in a single walk.  On the way down, each
+        descriptor (not in KeepTogetherTags) is given a url_name, and replaced by a
+        pointer to it (an empty element with that url_name); on the way back up, it
+        is written to its own file, in a subdirectory named by its tag.
+        If dowrite, then also write elem, and remove it from its parent.
+        parent is the url_name used to make url_names of children unique.
         '''
         def write_xml(x):
             un = x.get('url_name')
             if un is None:
                 self.errlog("Oops!  error in export_xml_to_directory, missing url_name:")
                 self.errlog(x)
-            elem.attrib.pop('url_name')
-            if 'url_name_orig' in elem.attrib and self.keep_urls:
-                elem.attrib.pop('url_name_orig')
+            x.attrib.pop('url_name')
+            if 'url_name_orig' in x.attrib and self.keep_urls:
+                x.attrib.pop('url_name_orig')
             edir = self.mkdir(self.dir / x.tag)
+            unchanged = (x.tag, un) in self.unchanged_units
             # Check for any ':' symbols in the url_name and create appropriate subdirectories
             subdirs = un.split(':')
             for newdir in subdirs[:-1] :
                 edir = self.mkdir(edir / newdir)
             un = subdirs[-1]
-            self.write_xml_file(edir / un + '.xml', x)
+            if not (unchanged and self.writer.keep(edir / un + '.xml', source=self.source_location(x))):
+                self.write_xml_file(edir / un + '.xml', x)
             return un
 
-        # print elem
-        if elem.tag == 'descriptor':
-            # print "--> %s" % list(elem)
-            self.export_xml_to_directory(elem[0], dowrite=True)  # recurse on children, depth first
-            elem.tag = elem.get('tag')			# change descriptor to point to new elem
-            elem.set('url_name', elem.get('url_name'))
-            elem.attrib.pop('tag')
-            # self.export_xml_to_directory(elem)	# recurse on this tag
-
-        elif elem.tag == etree.Comment:			# comment <!-- foo -->
-            pass
-
-        elif elem.tag not in self.DescriptorTags:  # don't recurse if not a DescriptorTag
-            pass
-
-        # elif elem.get('url_name') is None:
-        #    pass
+        for child in (elem if children is None else children):
+            if self.force_studio_format:
+                if elem.tag == 'sequential' and not child.tag == 'vertical':  # studio needs seq -> vert -> other
+                    # move child into vertical
+                    vert = etree.Element('vertical')
+                    child.addprevious(vert)
+                    vert.set('url_name', self.make_urlname(vert))
+                    vert.append(child)
+                    child = vert			# continue processing on the vertical
+            if child.tag not in self.DescriptorTags:	# don't recurse if not a DescriptorTag
+                continue
+            if child.tag in self.KeepTogetherTags:
+                self.export_xml_to_directory(child, parent=child.get('url_name', ''))
+            else:
+                un = self.set_url_name(child, url_name=child.get('url_name', ''), parent=parent)
+                child.addprevious(etree.Element(child.tag, url_name=un))	# pointer to child
+                self.export_xml_to_directory(child, dowrite=True, parent=un)
 
-        else:
-            if elem.findall('.//descriptor'):		# if any descriptors in children
-                for k in elem:
-                    self.export_xml_to_directory(k)  # recurse on children (don't necessarily write)
-            if dowrite:
-                write_xml(elem)		                # write to file and remove from parent
+        if dowrite:
+            write_xml(elem)			# write to file and remove from parent
+            if elem.getparent() is not None:
                 elem.getparent().remove(elem)
 
 
@@ -542,28 +1022,28 @@ class XBundle(object):
 
     def mkdir(self, p):
         '''p is a path'''
-        if not p.exists():
-            p.mkdir()
+        self.writer.mkdir(p)
         return p
 
 
     def pp_xml(self, xml):
-        # os.popen('xmllint --format -o tmp.xml -','w').write(etree.tostring(xml))
-        try:
-            p = subprocess.Popen(['xmllint', '--format', '-o', 'tmp.xml', '-'], stdin=subprocess.PIPE)
-            p.stdin.write(etree.tostring(xml))
-            p.stdin.close()
-            p.wait()
-            xml = codecs.open('tmp.xml', encoding="utf8").read()
-            xml = xml.encode("utf8")
-        except Exception as err:
-            print("[xbundle.py] Warning - no xmllint")
-            print(err)
-            xml = etree.tostring(xml, pretty_print=True)
+        if self.xmllint:
+            try:
+                return xmllint_format(xml)
+            except Exception as err:
+                print("[xbundle.py] Warning - xmllint failed, using format_xml")
+                print(err)
+        return format_xml(xml)
 
-        if xml.startswith(b'<?xml '):
-            xml = xml.split(b'\n', 1)[1]
-        return xml
+    def iter_pp_xml(self, xml, depth=1):
+        '''
+        Yield pp_xml(xml) in pieces (see iter_format_xml).
+        '''
+        if self.xmllint:
+            yield self.pp_xml(xml)
+            return
+        for data in iter_format_xml(xml, depth=depth):
+            yield data
 
     def make_urlname(self, xml, parent=''):
         dn = xml.get('display_name', '')
@@ -574,7 +1054,7 @@ class XBundle(object):
             if not s:
                 s = xmlp.tag
         s += " " + xml.tag
-        s = s.encode('ascii', 'xmlcharrefreplace')
+        s = s.encode('ascii', 'xmlcharrefreplace').decode('ascii')
         map = {'"\':<>?|![]': '',
                ',/().;=+ ': '_',
                '/': '__',
@@ -582,64 +1062,26 @@ class XBundle(object):
                }
         for m, v in list(map.items()):
             for ch in m:
-                s = s.replace(ch.encode(), v.encode())
+                s = s.replace(ch, v)
         if dn and s in self.urlnames and parent:
             s += '_' + parent
-        while s in self.urlnames:
-            m = re.match(b'(.+?)([0-9]*)$', s)
-            (s, idx) = m.groups()
-            idx = int(idx or 0)
-            s += str(idx + 1).encode()
-        self.urlnames.append(s)
-        return s
+        return self.urlnames.add_unique(s, style='number')
 
 
-    def make_descriptor(self, xml, url_name='', parent=''):
+    def set_url_name(self, xml, url_name='', parent=''):
         """
-        Construct and return a descriptor element for the given element
-        at the head of xml.
+        Set and return the url_name of the given element, which names the file
+        it is exported to.
 
-        Use url_name for the descriptor, if given.
+        Use url_name, if given.
         """
-        descriptor = etree.Element('descriptor')
-        descriptor.set('tag', xml.tag)
         uno = xml.get('url_name_orig', '')
         if self.keep_urls and not url_name and uno and self.is_not_random_urlname(uno):
             url_name = uno
         if not url_name:
             url_name = self.make_urlname(xml, parent=parent)
-        descriptor.set('url_name', url_name)
         xml.set('url_name', url_name)
-        return descriptor
-
-
-    def add_descriptors(self, xml, parent=''):
-        '''
-        Recursively walk through self.course and add descriptors
-        A descriptor is an intermediate tag, which points to content
-        via a url_name.  These are used by edX to simplify loading
-        of course content.
-        '''
-        for elem in xml:
-            if self.force_studio_format:
-                if xml.tag == 'sequential' and not elem.tag == 'vertical':  # studio needs seq -> vert -> other
-                    # move child into vertical
-                    vert = etree.Element('vertical')
-                    elem.addprevious(vert)
-                    # vert.set('display_name', 'vert_'+elem.get('display_name',''))
-                    vert.set('url_name', self.make_urlname(vert))
-                    vert.append(elem)
-                    elem = vert			# continue processing on the vertical
-            # if elem.tag in self.DescriptorTags and not elem.get('url_name',''):
-            if elem.tag in self.DescriptorTags:
-                if not elem.tag in self.KeepTogetherTags:
-                    un = elem.get('url_name', '')
-                    desc = self.make_descriptor(elem, url_name=un, parent=parent)
-                    elem.addprevious(desc)
-                    desc.append(elem)		# move descriptor to become new parent of elem
-                else:
-                    desc = elem
-                self.add_descriptors(elem, desc.get('url_name', ''))  # recurse
+        return url_name
 
 # ----------------------------------------------------------------------------
 # tests
@@ -710,17 +1152,28 @@ def RunTests():  # pragma: no cover
 if __name__ == '__main__':
 
     def usage():
-        print("Usage: python xbundle.py [--force-studio] [cmd] [infn] [outfn]")
+        print("Usage: python xbundle.py [--force-studio] [--xmllint] [--jobs N] [--import-cache FN] [--cache] [cmd] [infn] [outfn]")
         print("where:")
         print("  cmd = test:    run unit tests")
         print("  cmd = convert: convert between xbundle and edX directory format")
         print("                 the xbundle filename must end with .xml")
+        print("                 an output filename ending with .tar.gz is written as a tar archive")
+        print("  cmd = diff:    list the units added, removed, moved, or modified from xbundle (or edX")
+        print("                 directory) infn to outfn; the exit status is 1 if there are any")
         print("  --force-studio forces <sequential> to always be followed by <vertical> in export")
         print("                 this makes it compatible with Studio import")
+        print("  --xmllint      format XML files by running xmllint, instead of the built-in formatter")
+        print("  --jobs N       use N threads to read (or write) the files of the edX xml directory")
+        print("  --import-cache FN")
+        print("                 when importing, reuse FN if no file in the edX xml directory has changed, else update it")
+        print("  --cache        keep a compressed copy of the xbundle file (with .cache appended to its name),")
+        print("                 read instead of the xbundle file when this is unchanged")
         print("")
         print("examples:")
         print("  python xbundle.py convert ../data/edx4edx edx4edx_xbundle.xml")
         print("  python xbundle.py convert edx4edx_xbundle.xml ./")
+        print("  python xbundle.py convert edx4edx_xbundle.xml course.tar.gz")
+        print("  python xbundle.py diff old_xbundle.xml new_xbundle.xml")
 
     if len(sys.argv) < 2:
         usage()
@@ -731,6 +1184,20 @@ if __name__ == '__main__':
     if len(sys.argv) > argc and sys.argv[argc] == '--force-studio':
         argc += 1
         options['force_studio_format'] = True
+    if len(sys.argv) > argc and sys.argv[argc] == '--xmllint':
+        argc += 1
+        options['xmllint'] = True
+    if len(sys.argv) > argc + 1 and sys.argv[argc] == '--jobs':
+        options['jobs'] = int(sys.argv[argc + 1])
+        argc += 2
+    import_cache = None
+    if len(sys.argv) > argc + 1 and sys.argv[argc] == '--import-cache':
+        import_cache = sys.argv[argc + 1]
+        argc += 2
+    use_cache = False
+    if len(sys.argv) > argc and sys.argv[argc] == '--cache':
+        argc += 1
+        use_cache = True
 
     cmd = sys.argv[argc]
 
@@ -742,17 +1209,48 @@ if __name__ == '__main__':
         infn = sys.argv[argc]
         outfn = sys.argv[argc + 1]
         xb = XBundle(**options)
-        if infn.endswith('.xml'):
+        if infn.endswith('.xml') and (outfn.endswith('.tar.gz') or outfn.endswith('.tgz')):
+            print("Converting xbundle file '%s' to edX tar archive '%s'" % (infn, outfn))
+            if use_cache:
+                xb.load(infn, update_cache=True)
+                xb.export_to_tarball(outfn)
+            else:
+                xb.export_to_tarball(outfn, chapters=xb.load_streaming(infn))
+            print("done")
+        elif infn.endswith('.xml'):
             print("Converting xbundle file '%s' to edX xml directory '%s'" % (infn, outfn))
-            xb.load(infn)
-            xb.export_to_directory(outfn)
+            if use_cache:
+                xb.load(infn, update_cache=True)
+                xb.export_to_directory(outfn)
+            else:
+                chapters = xb.load_streaming(infn)		# export each chapter as it is read
+                xb.export_to_directory(outfn, chapters=chapters)
             print("done")
         elif outfn.endswith('.xml'):
             print("Converting edX xml directory '%s' to xbundle file '%s'" % (infn, outfn))
-            xb.import_from_directory(infn)
+            xb.import_from_directory(infn, cache=import_cache)
             xb.save(outfn)
+            if use_cache:
+                xb.save_cache(outfn)
             print("done")
         else:
             usage()
+
+    elif cmd == 'diff':
+        try:
+            from .xbundlediff import XBundleDiff
+        except ImportError:		# when run as a script
+            from xbundlediff import XBundleDiff
+        xbs = []
+        for fn in sys.argv[argc + 1:argc + 3]:
+            xb = XBundle(**options)
+            if os.path.isdir(fn):
+                xb.import_from_directory(fn)
+            else:
+                xb.load(fn, update_cache=use_cache)
+            xbs.append(xb)
+        diff = XBundleDiff(*xbs)
+        sys.stdout.write(diff.report())
+        sys.exit(1 if diff else 0)
     else:
         usage()
@@ -0,0 +1,248 @@
+'''
+Structural diff between two xbundles.
+
+Running "diff -r" on two exported course directories is slow for large
+courses, and noisy: the files are reformatted, and renamed when url_names are
+made differently.  An XBundleDiff instead compares the course trees of two
+xbundles directly, unit by unit, where a unit is a descriptor which would be
+exported to its own file (the course, and each chapter, sequential, problem,
+etc within it).
+
+Each tree is indexed in a single walk, by (tag, url_name) (or url_name_orig,
+for a course imported from an edX xml directory; units without either are
+named by their position in their parent).  The content of each unit is
+hashed, with whitespace-only text dropped, attributes sorted, and each child
+unit replaced by a reference to it, so that a change in a problem shows up in
+the problem alone.  Attributes which record where the content came from
+(linenum and tex_filename, from latex2edx) are ignored by default.
+
+Units are then reported as added, removed, moved (to another parent), or
+modified, in linear time.
+
+unchanged_units compares the units exactly instead, to find those which a
+new build would export to the same files as the previous one, so that they
+need not be formatted and written again (latex2edx --delta-from).
+'''
+
+import hashlib
+
+from lxml import etree
+try:
+    from .xbundle import XBundle
+except ImportError:		# when run as a script
+    from xbundle import XBundle
+
+IGNORE_ATTRIBUTES = ['linenum', 'tex_filename']
+COURSE_KEY = ('course', '')		# the course is the same unit, whatever its url_name
+
+
+class Unit(object):
+    '''
+    A unit of a course: its key, the key of its parent unit, and the hash of its content.
+    fixed is True if the file the unit is exported to depends only on the course tree, and not on the
+    url_names made during export (ie the unit, and the units it points to, have url_name attributes).
+    '''
+
+    __slots__ = ['key', 'parent', 'sha1', 'display_name', 'fixed']
+
+    def __init__(self, key, parent, sha1, display_name, fixed=True):
+        self.key = key
+        self.parent = parent
+        self.sha1 = sha1
+        self.display_name = display_name
+        self.fixed = fixed
+
+
+def unit_key(elem, parent_key, counts, keys):
+    '''
+    Return the key (tag, name) of unit elem, whose parent unit has key parent_key.
+    counts is {(parent_key, tag): number} for the positions of unnamed units;
+    keys is the set of keys already given, for duplicate url_names.
+    '''
+    name = elem.get('url_name') or elem.get('url_name_orig')
+    if not name:
+        n = counts.get((parent_key, elem.tag), 0) + 1
+        counts[(parent_key, elem.tag)] = n
+        name = '%s/%s[%d]' % (parent_key[1], elem.tag, n)
+    key = (elem.tag, name)
+    k = 1
+    while key in keys:
+        k += 1
+        key = (elem.tag, '%s#%d' % (name, k))
+    keys.add(key)
+    return key
+
+
+def index_units(course, descriptor_tags=None, ignore_attributes=None, keep_together_tags=None,
+                exact=False, force_studio_format=False):
+    '''
+    Return {key: Unit} for all the units in the given <course> element, in document order.
+
+    A unit is the course, or an element with a descriptor tag whose parent is a unit (or an element
+    with a keep_together_tag, within a unit), as done by XBundle.export_xml_to_directory.  Its hash
+    covers its tag, attributes (other than its url_name, and ignore_attributes), text which is not
+    blank, comments, and the elements within it, except that a unit within it counts only by its key.
+
+    If exact, the hash also covers blank text and the order of the attributes, and ignores no attributes
+    other than url_name, so that units with the same hash are exported to the same file, if fixed
+    (force_studio_format is as for the XBundle exporting them).
+    '''
+    descriptor_tags = set(descriptor_tags if descriptor_tags is not None else XBundle.DescriptorTags)
+    keep_together_tags = set(keep_together_tags or [])
+    skip = set(['url_name'] + ([] if exact else ignore_attributes if ignore_attributes is not None else IGNORE_ATTRIBUTES))
+    units = {}
+    counts = {}
+    keys = set()
+    stack = []			# per open element: (unit key if a unit, content of the enclosing unit,
+    				#                    key of the unit whose children it may have, tag)
+
+    def studio_wrapped(tag):
+        '''
+        True if a child with the given tag, of the open element, is put into a new vertical on export.
+        '''
+        (key, content, container, parent_tag) = stack[-1]
+        return force_studio_format and container is not None and parent_tag == 'sequential' and tag != 'vertical'
+
+    for (event, elem) in etree.iterwalk(course, events=('start', 'end', 'comment', 'pi')):
+        if event == 'start':
+            key = None
+            container = None
+            if not stack:
+                key = container = COURSE_KEY
+                keys.add(key)
+            else:
+                parent = stack[-1][2]
+                if studio_wrapped(elem.tag):
+                    units[parent].fixed = False
+                if parent is not None and elem.tag in descriptor_tags:
+                    if elem.tag in keep_together_tags:
+                        container = parent
+                    else:
+                        key = container = unit_key(elem, parent, counts, keys)
+                        stack[-1][1].append('\x04%s\x01%s' % key)	# reference to the unit
+                        if elem.get('url_name') is None:
+                            units[parent].fixed = False
+            if key is None:
+                content = stack[-1][1]
+            else:
+                content = []
+                units[key] = Unit(key, stack[-1][2] if stack else None, None, elem.get('display_name'),
+                                  fixed=(not stack or elem.get('url_name') is not None))
+            stack.append((key, content, container, elem.tag))
+            content.append('\x02' + elem.tag)
+            attrs = [kv for kv in elem.items() if kv[0] not in skip]
+            if attrs:
+                content.append(repr(attrs if exact else sorted(attrs)))
+            text = elem.text
+            if text and (exact or not text.isspace()):
+                content.append(text)
+        elif event == 'end':
+            (key, content, container, tag) = stack.pop()
+            content.append('\x03')
+            if key is not None:
+                units[key].sha1 = hashlib.sha1('\x01'.join(content).encode('utf8')).hexdigest()
+            text = elem.tail
+            if stack and text and (exact or not text.isspace()):
+                stack[-1][1].append(text)
+        else:						# comment or processing instruction
+            if studio_wrapped(None):
+                units[stack[-1][2]].fixed = False
+            content = stack[-1][1]
+            content.append(etree.tostring(elem, with_tail=False, encoding='unicode'))
+            text = elem.tail
+            if text and (exact or not text.isspace()):
+                content.append(text)
+    return units
+
+
+def unchanged_units(old, new, descriptor_tags=None, keep_together_tags=None, force_studio_format=False):
+    '''
+    Return the set of keys of the units of course new (other than the course itself) which are
+    exported to the same file as in course old, with the same parent.  Both should have been
+    read from xbundle files written by XBundle.save, and are exported by XBundles with the
+    given tags and force_studio_format.
+    '''
+    options = dict(descriptor_tags=descriptor_tags, keep_together_tags=keep_together_tags, exact=True,
+                   force_studio_format=force_studio_format)
+    old_units = index_units(old, **options)
+    unchanged = set()
+    for (key, unit) in index_units(new, **options).items():
+        old_unit = old_units.get(key)
+        if (old_unit is not None and key != COURSE_KEY and unit.fixed and old_unit.fixed
+                and unit.sha1 == old_unit.sha1 and unit.parent == old_unit.parent):
+            unchanged.add(key)
+    return unchanged
+
+
+class XBundleDiff(object):
+    '''
+    Differences between the courses of two XBundles (or <course> elements): lists of the keys
+    of the units added, removed, moved (to another parent unit), and modified.  A unit may be
+    both moved and modified.
+    '''
+
+    def __init__(self, old, new, descriptor_tags=None, ignore_attributes=None, keep_together_tags=None):
+        if not etree.iselement(old):
+            old = old.course
+        if not etree.iselement(new):
+            new = new.course
+        self.old = index_units(old, descriptor_tags, ignore_attributes, keep_together_tags)
+        self.new = index_units(new, descriptor_tags, ignore_attributes, keep_together_tags)
+        self.added = [key for key in self.new if key not in self.old]
+        self.removed = [key for key in self.old if key not in self.new]
+        self.moved = []
+        self.modified = []
+        for (key, unit) in self.new.items():
+            old_unit = self.old.get(key)
+            if old_unit is None:
+                continue
+            if old_unit.parent != unit.parent:
+                self.moved.append(key)
+            if old_unit.sha1 != unit.sha1:
+                self.modified.append(key)
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.moved or self.modified)
+
+    def changes(self):
+        '''
+        Return list of (change, key, detail), where change is added, removed, moved, or modified,
+        in the order of the new course (removed units last, in the order of the old course).
+        '''
+        changes = []
+        moved = set(self.moved)
+        modified = set(self.modified)
+        for (key, unit) in self.new.items():
+            if key not in self.old:
+                changes.append(('added', key, 'in %s' % key_name(unit.parent)))
+                continue
+            if key in moved:
+                changes.append(('moved', key, 'from %s to %s' % (key_name(self.old[key].parent), key_name(unit.parent))))
+            if key in modified:
+                changes.append(('modified', key, ''))
+        for key in self.removed:
+            changes.append(('removed', key, 'from %s' % key_name(self.old[key].parent)))
+        return changes
+
+    def summary(self):
+        return '%d added, %d removed, %d moved, %d modified (of %d units, %d before)' % (
+            len(self.added), len(self.removed), len(self.moved), len(self.modified), len(self.new), len(self.old))
+
+    def report(self):
+        '''
+        Return the changes as text, one line each (with the display_name of the unit, if any),
+        followed by a summary line.
+        '''
+        lines = []
+        for (change, key, detail) in self.changes():
+            unit = self.old[key] if change == 'removed' else self.new[key]
+            line = '%-9s %s' % (change, key_name(key))
+            if unit.display_name:
+                line += ' "%s"' % unit.display_name
+            lines.append(line + '  (%s)' % detail if detail else line)
+        lines.append(self.summary())
+        return '\n'.join(lines) + '\n'
+
+
+def key_name(key):
+    return key[0] + (' ' + key[1] if key[1] else '')
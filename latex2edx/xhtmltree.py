@@ -0,0 +1,122 @@
+'''
+Building the XML tree of the XHTML from plasTeX directly.
+
+plasTeX renders a document to an XHTML string.  MyRenderer used to rewrite
+that string with its text filters (math, answer boxes, images, edXxml),
+slice out the <body>, and hand the result to latex2edx, which parsed it;
+answer boxes were serialised into the string, to be parsed back again.  For
+a large course, several full copies of the document were alive at once.
+
+The functions here let MyRenderer parse the <body> once, a piece at a time
+(so the whole string is never copied), and then apply its filters to the
+elements of the tree: math becomes text, answer boxes and images become
+elements, and only edXxml content (which is XML written by the author) is
+parsed on its own.  element_source gives the text filters' view of an
+element, so that the tree is the same as parsing the filtered string.
+'''
+
+from lxml import etree
+from xml.sax.saxutils import unescape
+
+CHUNK_SIZE = 1 << 20		# characters of XHTML parsed at a time
+XML_ENTITIES = {'&nbsp;': '\xa0', '&quot;': '"'}
+
+
+def parse_body(stxt, fix=None, chunk_size=CHUNK_SIZE):
+    '''
+    Return a <document> element with the content of the <body> of XHTML string stxt.
+    The content is parsed in pieces of about chunk_size characters, each passed through
+    function fix (if given) first.  Pieces end just before a start tag, so that fix sees
+    whole entities, and whole elements which have no child elements (e.g. <math>).
+    '''
+    start = stxt.index('<body>') + 6
+    end = stxt.index('</body>')
+    parser = etree.XMLParser()
+    parser.feed('<document>')
+    while start < end:
+        stop = stxt.find('<', min(start + chunk_size, end), end)
+        while stop >= 0 and stxt.startswith('</', stop):
+            stop = stxt.find('<', stop + 1, end)
+        if stop < 0:
+            stop = end
+        piece = stxt[start:stop]
+        parser.feed(fix(piece) if fix else piece)
+        start = stop
+    parser.feed('</document>')
+    return parser.close()
+
+
+def element_source(elem, fix=None):
+    '''
+    Return elem (without its tail) as XHTML text, passed through function fix (if given),
+    e.g. for matching with the regular expression of a text filter.
+    '''
+    stxt = etree.tostring(elem, encoding='unicode', with_tail=False)
+    if stxt.endswith('/>') and not elem.text and not len(elem):	# empty element, written as <x></x> by plasTeX
+        stxt = '%s></%s>' % (stxt[:-2], elem.tag)
+    return fix(stxt) if fix else stxt
+
+
+def source_text(stxt):
+    '''
+    Return the text given by XHTML text stxt (which has no elements).
+    '''
+    return unescape(stxt, XML_ENTITIES)
+
+
+def parse_fragment(stxt):
+    '''
+    Return (text, elements) for XHTML fragment stxt, where text comes before the first element.
+    '''
+    wrapper = etree.fromstring('<fragment>%s</fragment>' % stxt.replace('&nbsp;', '&#160;'))
+    return (wrapper.text or '', list(wrapper))
+
+
+def replace_element(elem, text='', elements=()):
+    '''
+    Replace elem by text, followed by the given elements (with their tails), keeping the tail of elem.
+    '''
+    parent = elem.getparent()
+    previous = elem.getprevious()
+    tail = elem.tail or ''
+    elements = list(elements)
+    if elements:
+        elements[-1].tail = (elements[-1].tail or '') + tail
+    else:
+        text += tail
+    if text:
+        if previous is not None:
+            previous.tail = (previous.tail or '') + text
+        else:
+            parent.text = (parent.text or '') + text
+    for new in elements:
+        elem.addprevious(new)
+    elem.tail = None
+    parent.remove(elem)
+
+
+def add_newlines_text(stxt):
+    '''
+    Start each <p> with a newline, and put a newline before each <li>, in XHTML text stxt
+    (as MyRenderer does to the whole XHTML string), for readable output.
+    '''
+    return stxt.replace('<p>', '<p>\n').replace('<li>', '\n<li>')
+
+
+def add_newlines(tree):
+    '''
+    Same as add_newlines_text, but for the <p> and <li> elements (without attributes) of an XML tree.
+    Unlike add_newlines_text, this does not change text which looks like a tag (e.g. in CDATA).
+    '''
+    for elem in tree.iter('p', 'li'):
+        if elem.attrib:
+            continue
+        if elem.tag == 'p':
+            elem.text = '\n' + (elem.text or '')
+            continue
+        previous = elem.getprevious()
+        if previous is not None:
+            previous.tail = (previous.tail or '') + '\n'
+        else:
+            parent = elem.getparent()
+            parent.text = (parent.text or '') + '\n'
@@ -0,0 +1,147 @@
+'''
+Single-pass dispatch of XML fix filters.
+
+latex2edx post-processes the XHTML from plasTeX with a list of filters.  Most
+of those only act on elements with a few specific tags, so instead of letting
+each filter search the whole tree, element filters declare their tags (using
+the tag_filter decorator), and FilterDispatcher walks the tree once for each
+run of consecutive element filters, sending each element to the filters which
+registered for its tag.
+
+Filters which need to see the whole tree (plain functions taking the tree)
+still work, and act as ordering barriers: element filters before them are
+completed before they are called, and element filters after them start a new
+walk.  An element filter may also be declared a barrier (e.g. if it inserts
+new content which later filters must see), which ends its walk.
+'''
+
+import functools
+
+from .profiling import BuildProfiler
+
+
+class ElementFilter(object):
+    '''
+    XML filter acting on single elements having one of a given set of tags.
+
+    Calling an ElementFilter with a tree applies it to every matching
+    descendant of the tree, so it can be used just like a whole-tree filter.
+    FilterDispatcher instead calls filter_element directly for each element.
+    '''
+
+    def __init__(self, func, tags, barrier=False, instance=None):
+        self.func = func
+        self.tags = tuple(tags)
+        self.barrier = barrier
+        self.instance = instance
+        functools.update_wrapper(self, func)
+
+    def __get__(self, instance, owner=None):
+        '''
+        Bind filters defined as methods to their instance, like a function would be.
+        '''
+        if instance is None:
+            return self
+        return ElementFilter(self.func, self.tags, self.barrier, instance)
+
+    def __repr__(self):
+        return '<ElementFilter %s tags=%s>' % (self.__name__, ','.join(self.tags))
+
+    def filter_element(self, elem):
+        if self.instance is None:
+            return self.func(elem)
+        return self.func(self.instance, elem)
+
+    def __call__(self, tree):
+        for elem in list(tree.iterdescendants(*self.tags)):
+            self.filter_element(elem)
+
+
+def tag_filter(*tags, **kwargs):
+    '''
+    Decorator turning a function (or method) of one element into an ElementFilter
+    for the given tags.  Use barrier=True if the filter adds new elements which
+    filters later in the list need to process.  Example, e.g. for extra_xml_filters
+    in a latex2edx_config file:
+
+        @tag_filter('problem')
+        def set_max_attempts(problem):
+            problem.set('max_attempts', '3')
+    '''
+    barrier = kwargs.pop('barrier', False)
+    if kwargs:
+        raise TypeError("tag_filter got unexpected arguments %s" % list(kwargs))
+
+    def decorator(func):
+        return ElementFilter(func, tags, barrier=barrier)
+    return decorator
+
+
+class FilterDispatcher(object):
+    '''
+    Apply a list of filters to an XML tree, in order.
+
+    Consecutive ElementFilters are grouped into passes.  Each pass collects the
+    elements with any of its tags in one traversal (in document order), then
+    calls the filters for each element, in filter list order.  The tag of an
+    element is checked again before each filter, so that a filter which renames
+    an element (e.g. edxdndtex -> edxinclude) hands it on to later filters in
+    the same pass.
+
+    If a (BuildProfiler) profiler is given, then the time and memory used by
+    each filter, and by each pass, are recorded.
+    '''
+
+    def __init__(self, filters, profiler=None):
+        self.filters = list(filters)
+        self.profiler = profiler or BuildProfiler(enabled=False)
+
+    def passes(self):
+        '''
+        Return list of passes; each is either a whole-tree filter function,
+        or a list of ElementFilters to be applied in one walk.
+        '''
+        passes = []
+        group = []
+        for filt in self.filters:
+            if isinstance(filt, ElementFilter):
+                group.append(filt)
+                if filt.barrier:
+                    passes.append(group)
+                    group = []
+            else:
+                if group:
+                    passes.append(group)
+                    group = []
+                passes.append(filt)
+        if group:
+            passes.append(group)
+        return passes
+
+    def run(self, tree):
+        for fpass in self.passes():
+            if isinstance(fpass, list):
+                name = 'filter pass (%s)' % ', '.join(filter_name(x) for x in fpass)
+                with self.profiler.measure(name, kind='pass'):
+                    self.run_pass(tree, fpass)
+            else:
+                with self.profiler.measure(filter_name(fpass), kind='filter'):
+                    fpass(tree)
+
+    def run_pass(self, tree, group):
+        tags = set()
+        for filt in group:
+            tags.update(filt.tags)
+        profiling = self.profiler.enabled		# else measure is a no-op, not worth calling for each element
+        for elem in list(tree.iterdescendants(*tags)):
+            for filt in group:
+                if elem.tag in filt.tags:
+                    if profiling:
+                        with self.profiler.measure(filter_name(filt), kind='filter'):
+                            filt.filter_element(elem)
+                    else:
+                        filt.filter_element(elem)
+
+
+def filter_name(filt):
+    return getattr(filt, '__name__', repr(filt))